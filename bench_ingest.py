@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark di ingest_server.py: centinaia di teste simulate a 25 Hz.
+
+Il server gira in un processo separato (un solo core, un solo thread);
+il generatore di carico invia in loopback un terzo dei pacchetti in formato
+binario, un terzo ASCII e un terzo CSV di mainGNSS. Alla fine vengono
+confrontati i pacchetti inviati con quelli ricevuti e viene stampato il
+tempo CPU usato dal server per pacchetto.
+
+Uso:
+    python3 bench_ingest.py [--heads 500] [--rate 25] [--duration 10]
+"""
+
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import socket
+import sys
+import time
+
+from head_packet import encode_ascii, encode_binary, unix_ms_to_tow
+
+
+def server_process(port, duration, result):
+    from ingest_server import run_server
+
+    cpu = time.process_time()
+    server = asyncio.run(run_server('127.0.0.1', [port], 0, interval=0, duration=duration))
+    cpu = time.process_time() - cpu
+    table = server.table
+    result.put({
+        "received": server.received,
+        "invalid": server.invalid,
+        "stale": table.stale,
+        "heads": table.count,
+        "batches": server.batches,
+        "cpu": cpu,
+        "packets_per_head": table.snapshot()['packets'].tolist(),
+    })
+
+
+def make_packet(i, seq, now_ms):
+    """Pacchetto della testa i: formato scelto in base all'indice."""
+    lat, lon = 45.5 + i * 1e-5, 9.19 + seq * 1e-7
+    kind = i % 3
+    if kind == 0:
+        return encode_binary(i.to_bytes(6, 'big'), lat, lon, 20, 4, 36.0,
+                             unix_ms_to_tow(now_ms), seq)
+    t = datetime.datetime.utcfromtimestamp(now_ms / 1000.0)
+    if kind == 1:
+        return encode_ascii(f"{i:012X}", lat, lon, 20, 4, 36.0,
+                            t.strftime("%y%m%d%H%M%S"), seq, now_ms)
+    return (f"GPS,{i},{lat},{lon},{t.isoformat()},120.0,10.0,90,12.5,40.1,"
+            f"{seq & 0xFFFF},{now_ms}").encode()
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark del server di ricezione')
+    ap.add_argument('--heads', type=int, default=500)
+    ap.add_argument('--rate', type=float, default=25.0, help='pacchetti al secondo per testa')
+    ap.add_argument('--duration', type=float, default=10.0, help='secondi di carico')
+    ap.add_argument('--port', type=int, default=47131)
+    args = ap.parse_args()
+
+    result = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=server_process,
+                                   args=(args.port, args.duration + 1.5, result))
+    proc.start()
+    time.sleep(1.0)
+
+    out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    out.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 << 20)
+    addr = ('127.0.0.1', args.port)
+    period = 1.0 / args.rate
+    ticks = int(args.duration * args.rate)
+    sent = 0
+    late = 0
+    start = time.monotonic()
+    for tick in range(ticks):
+        now_ms = int(time.time() * 1000)
+        for i in range(args.heads):
+            out.sendto(make_packet(i, tick + 1, now_ms), addr)
+        sent += args.heads
+        # Ritmo costante: ogni epoca parte al suo istante
+        wait = start + (tick + 1) * period - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        else:
+            late += 1
+    elapsed = time.monotonic() - start
+
+    stats = result.get(timeout=30)
+    proc.join()
+
+    received = stats["received"]
+    loss = 100.0 * (sent - received) / sent if sent else 0.0
+    per_packet_us = stats["cpu"] / received * 1e6 if received else 0.0
+    load = stats["cpu"] / (args.duration + 1.5)
+    print(f"teste {args.heads} × {args.rate:g} Hz per {elapsed:.1f} s "
+          f"({sent / elapsed:.0f} pacchetti/s, epoche in ritardo {late})")
+    print(f"ricevuti {received}/{sent} (persi {loss:.2f}%), non validi {stats['invalid']}, "
+          f"fuori ordine {stats['stale']}, teste in tabella {stats['heads']}")
+    print(f"CPU server {stats['cpu']:.2f} s = {per_packet_us:.1f} µs/pacchetto, "
+          f"carico {load * 100:.0f}% di un core, "
+          f"{received / max(stats['batches'], 1):.1f} datagrammi per risveglio")
+    ok = stats["heads"] == args.heads and loss < 1.0 and stats["invalid"] == 0
+    print("OK" if ok else "FALLITO")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Prova di link_stats.py in loopback, senza teste né ricevitori.
+
+Tre teste simulate (binaria, ASCII e CSV di mainGNSS, tutte con la
+tracciatura attiva) inviano pacchetti a 127.0.0.1; alcuni vengono scartati,
+duplicati o scambiati di posto di proposito, e in mezzo a quelli in tempo
+reale arrivano pacchetti storici dallo spool con sequenze molto vecchie.
+Alla fine i contatori calcolati da LinkStats vengono confrontati con quelli
+attesi (nessun riavvio, storici contati a parte) e le latenze con quelle
+simulate.
+
+Uso:
+    python3 bench_link.py [--packets N] [--rate HZ]
+"""
+
+import argparse
+import datetime
+import socket
+import sys
+import threading
+import time
+
+from head_packet import encode_ascii, encode_binary, unix_ms_to_tow
+from link_stats import LinkStats, open_sockets, serve
+from spool import mark_historical
+
+# Ritardo simulato fra il fix GNSS e l'invio (ms)
+FIX_TO_SEND_MS = 40
+
+DROP_EVERY = 50        # un pacchetto ogni 50 non viene inviato
+DUPLICATE_EVERY = 70   # uno ogni 70 viene inviato due volte
+SWAP_EVERY = 90        # uno ogni 90 viene scambiato con il successivo
+HISTORICAL_EVERY = 5   # dopo uno ogni 5 arriva anche un pacchetto storico
+HISTORICAL_LAG = 5000  # sequenze di ritardo degli storici (oltre SEQ_RESTART_GAP)
+
+
+def make_packet(kind, seq, fix_unix_ms, sent_unix_ms):
+    """Pacchetto di una testa simulata con fix all'istante fix_unix_ms."""
+    t = datetime.datetime.utcfromtimestamp(fix_unix_ms / 1000.0)
+    lat, lon = 45.5020575 + seq * 1e-7, 9.1923868
+    if kind == "binary":
+        return encode_binary(bytes.fromhex("02FC00000001"), lat, lon, 23, 4, 36.0,
+                             unix_ms_to_tow(fix_unix_ms), seq,
+                             unix_ms_to_tow(sent_unix_ms))
+    if kind == "ascii":
+        return encode_ascii("02FC00000002", lat, lon, 23, 4, 36.0,
+                            t.strftime("%y%m%d%H%M%S"), seq, sent_unix_ms)
+    # CSV di mainGNSS.py
+    return ",".join(["GPS", "7", str(lat), str(lon), t.isoformat(), "120.0", "10.0",
+                     "90", "12.5", "40.1", str(seq & 0xFFFF), str(sent_unix_ms)]).encode()
+
+
+def schedule(packets):
+    """Ordine di invio delle sequenze 1..packets con perdite, duplicati e scambi."""
+    order = []
+    seq = 1
+    while seq <= packets:
+        if seq % DROP_EVERY == 0:
+            seq += 1
+            continue
+        if seq % SWAP_EVERY == 0 and seq + 1 <= packets and (seq + 1) % DROP_EVERY:
+            order += [seq + 1, seq]
+            seq += 2
+            continue
+        order.append(seq)
+        if seq % DUPLICATE_EVERY == 0:
+            order.append(seq)
+        seq += 1
+    return order
+
+
+def expected_counts(packets):
+    order = schedule(packets)
+    unique = set(order)
+    lost = packets - len(unique)
+    # l'ultima sequenza persa non è rilevabile se nessuna la segue
+    if packets % DROP_EVERY == 0:
+        lost -= 1
+    return {
+        "lost": lost,
+        "duplicates": len(order) - len(unique),
+        "reordered": sum(1 for i in range(1, len(order)) if order[i] < order[i - 1]
+                         and order[i] != order[i - 1]),
+        "restarts": 0,
+        "historical": sum(1 for seq in order if seq % HISTORICAL_EVERY == 0),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Prova di link_stats in loopback')
+    ap.add_argument('--packets', type=int, default=1000, help='pacchetti per testa')
+    ap.add_argument('--rate', type=float, default=200.0, help='pacchetti al secondo per testa')
+    args = ap.parse_args()
+
+    stats = LinkStats()
+    socks = open_sockets('127.0.0.1', [0])
+    port = socks[0].getsockname()[1]
+    duration = args.packets / args.rate + 1.0
+    receiver = threading.Thread(target=serve, args=(stats, socks, duration, 0), daemon=True)
+    receiver.start()
+
+    out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    kinds = ("binary", "ascii", "csv")
+    period = 1.0 / args.rate
+    for seq in schedule(args.packets):
+        now_ms = int(time.time() * 1000)
+        for kind in kinds:
+            out.sendto(make_packet(kind, seq, now_ms - FIX_TO_SEND_MS, now_ms), ('127.0.0.1', port))
+            if seq % HISTORICAL_EVERY == 0:
+                # Reinvio dallo spool di un pacchetto di molto prima
+                old = make_packet(kind, (seq - HISTORICAL_LAG) & 0xFFFF,
+                                  now_ms - 60000, now_ms - 60000 + FIX_TO_SEND_MS)
+                out.sendto(mark_historical(old), ('127.0.0.1', port))
+        time.sleep(period)
+    receiver.join()
+
+    print(stats.report(histogram=True))
+    print()
+
+    expected = expected_counts(args.packets)
+    failed = False
+    for mac in ("02FC00000001", "02FC00000002", "ID7"):
+        s = stats.sources.get(mac)
+        if s is None:
+            print(f"[FAIL] {mac}: nessun pacchetto")
+            failed = True
+            continue
+        got = {"lost": s.lost, "duplicates": s.duplicates, "reordered": s.reordered,
+               "restarts": s.restarts, "historical": s.historical}
+        ok = got == expected
+        # latenze su loopback: la rete deve essere quasi istantanea
+        ok = ok and s.link_latency.percentile(99) <= 20
+        if mac != "02FC00000002":
+            # il pacchetto ASCII ha l'orario del fix solo al secondo
+            ok = ok and s.gnss_latency.min >= FIX_TO_SEND_MS - 1
+        failed |= not ok
+        print(f"[{'OK' if ok else 'FAIL'}] {mac}: {got} atteso {expected}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
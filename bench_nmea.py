@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark del parser NMEA veloce (nmea_fast) contro pynmea2.parse.
+
+Uso:
+    python3 bench_nmea.py [file_registrato.nmea] [--repeat N]
+
+Il file deve contenere lo stream grezzo del ricevitore (una sentenza per riga,
+ad esempio catturato con `cat /dev/ttyACM0 > stream.nmea`). Senza file viene
+generato uno stream sintetico GGA/RMC/VTG/GSA/GSV a 10 Hz.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import pynmea2
+
+from nmea_fast import NmeaParser, GGA
+
+
+def _with_checksum(body):
+    cs = 0
+    for b in body.encode():
+        cs ^= b
+    return f"${body}*{cs:02X}\r\n".encode()
+
+
+def synthetic_stream(epochs=2000):
+    """Genera uno stream NMEA plausibile per un ricevitore a 10 Hz."""
+    lines = []
+    for i in range(epochs):
+        t = 36000 + i * 0.1
+        hh, rem = divmod(t, 3600)
+        mm, ss = divmod(rem, 60)
+        tag = f"{int(hh):02d}{int(mm):02d}{ss:05.2f}"
+        lat = f"4530.{12345 + i % 1000:05d}"
+        lon = f"00911.{54321 + i % 1000:05d}"
+        lines.append(_with_checksum(f"GNRMC,{tag},A,{lat},N,{lon},E,12.3,87.5,170526,,,R"))
+        lines.append(_with_checksum(f"GNVTG,87.5,T,,M,12.3,N,22.8,K,R"))
+        lines.append(_with_checksum(f"GNGGA,{tag},{lat},N,{lon},E,4,23,0.6,121.4,M,47.9,M,1.0,0000"))
+        lines.append(_with_checksum("GNGSA,A,3,01,03,08,10,14,17,21,22,,,,,1.1,0.6,0.9,1"))
+        lines.append(_with_checksum("GPGSV,3,1,11,01,45,120,44,03,30,210,40,08,60,300,46,10,20,050,38"))
+    return lines
+
+
+def load_stream(path):
+    with open(path, 'rb') as f:
+        return [line for line in f if line.startswith(b'$')]
+
+
+def bench(label, func, lines, repeat):
+    func(lines)  # riscaldamento
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(lines)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(lines)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    per_line = elapsed / (repeat * len(lines)) * 1e6
+    print(f"{label:<10} {per_line:8.2f} us/sentenza  "
+          f"{len(lines) * repeat / elapsed:10.0f} sentenze/s  "
+          f"picco memoria {peak / 1024:.1f} KiB")
+    return per_line
+
+
+def run_pynmea2(lines):
+    for raw in lines:
+        line = raw.decode('ascii', errors='replace').strip()
+        try:
+            msg = pynmea2.parse(line)
+        except pynmea2.ParseError:
+            continue
+        if isinstance(msg, pynmea2.GGA):
+            msg.latitude, msg.longitude, msg.num_sats, msg.gps_qual
+
+
+def run_fast(lines):
+    parser = NmeaParser()
+    fix = parser.fix
+    for raw in lines:
+        if parser.parse(raw) is GGA:
+            fix.lat, fix.lon, fix.satellites, fix.quality
+
+
+def check_agreement(lines):
+    """Confronta posizione e qualità GGA fra i due parser."""
+    parser = NmeaParser()
+    mismatches = 0
+    for raw in lines:
+        if parser.parse(raw) != GGA:
+            continue
+        msg = pynmea2.parse(raw.decode('ascii').strip())
+        fix = parser.fix
+        if (abs(fix.lat - msg.latitude) > 1e-9 or abs(fix.lon - msg.longitude) > 1e-9
+                or fix.quality != int(msg.gps_qual) or fix.satellites != int(msg.num_sats)):
+            mismatches += 1
+    return mismatches
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark parser NMEA')
+    ap.add_argument('stream', nargs='?', help='File NMEA registrato')
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    lines = load_stream(args.stream) if args.stream else synthetic_stream()
+    print(f"Sentenze: {len(lines)} ({'file ' + args.stream if args.stream else 'sintetiche'})")
+
+    mismatches = check_agreement(lines)
+    print(f"Differenze GGA fra i parser: {mismatches}")
+
+    slow = bench('pynmea2', run_pynmea2, lines, args.repeat)
+    fast = bench('nmea_fast', run_fast, lines, args.repeat)
+    print(f"Accelerazione: {slow / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Benchmark dei percorsi per fix / per campione di tutti gli script delle teste.
+
+Ogni fase esegue il codice vero degli script, con l'hardware sostituito:
+    mainrtk          byte seriali di un'epoca → handle_gps_line → datagrammi UDP, log NMEA
+    mainrtk_raw      come mainrtk, con la registrazione grezza (--raw-log)
+    testrtknexter    byte seriali di un'epoca → EpochAssembler → pacchetto ASCII
+    testrtknexter_bin  come sopra, pacchetto binario
+    maingnss         fix di gpsd → process_packet → datagramma CSV (+ log)
+    maingnss_watch   righe JSON TPV/SKY di gpsd → GpsdWatch → process_packet
+    maingnss_kalman  come maingnss_watch, con KALMAN_FLAG (track_filter)
+    accgir           campione MPU6050 → record CSV (+ salvataggio ogni 15 s)
+    picchi           campione I2C (smbus) → rilevamento passi → riga su file
+
+Seriale finta (blocchi già pronti), gpsd finto, smbus e mpu6050 finti; i
+datagrammi vanno davvero a un socket UDP in loopback, svuotato da un thread.
+Le fasi i cui script richiedono librerie non installate (es. filterpy,
+psutil, flask) vengono saltate con un avviso.
+
+Per ogni fase: elementi al secondo, latenza p50/p99 per elemento, blocchi di
+memoria netti per elemento (sys.getallocatedblocks, crescita = perdita) e
+picco di memoria tracciata. I riferimenti si salvano con --save-baseline in
+bench_baseline.json (per nome host); le esecuzioni successive falliscono
+(uscita 1) se una fase peggiora oltre la tolleranza.
+
+Uso:
+    python3 bench_suite.py [--items 2000] [--stage mainrtk ...]
+    python3 bench_suite.py --save-baseline
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+from bench_nmea import synthetic_stream
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# Sentenze per epoca nello stream sintetico (RMC, VTG, GGA, GSA, GSV)
+LINES_PER_EPOCH = 5
+
+
+# ───────────────────────────── HARDWARE FINTO ─────────────────────────────
+class FakeSerial:
+    """Seriale senza descrittore: read() restituisce il blocco preparato con push()."""
+
+    timeout = 0
+
+    def __init__(self):
+        self._pending = b""
+
+    def push(self, data):
+        self._pending = data
+
+    @property
+    def in_waiting(self):
+        return len(self._pending)
+
+    def read(self, n=1):
+        data, self._pending = self._pending[:n], self._pending[n:]
+        return data
+
+
+class FakeGpsdPacket:
+    """Risposta di gpsd.get_current() (attributi usati da mainGNSS)."""
+
+    def __init__(self, i):
+        self.mode = 3
+        self.lat = 45.5020575 + i * 1e-6
+        self.lon = 9.1923868 + i * 1e-6
+        self.alt = 121.4
+        self.hspeed = 10.5
+        self.track = 45.0
+        self._time = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(1.7e9 + i * 0.04))
+
+    def get_time(self):
+        return self._time
+
+
+def gpsd_epoch_lines(i):
+    """Righe JSON che gpsd invia in WATCH per un fix a 25 Hz: TPV e SKY."""
+    t = time.gmtime(1.7e9 + i * 0.04)
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%S", t) + f".{(i * 40) % 1000:03d}Z"
+    tpv = (f'{{"class":"TPV","device":"/dev/ttyACM0","mode":3,"time":"{stamp}",'
+           f'"ept":0.005,"lat":{45.5020575 + i * 1e-6:.9f},"lon":{9.1923868 + i * 1e-6:.9f},'
+           f'"altHAE":169.3,"altMSL":121.4,"epx":0.02,"epy":0.03,"epv":0.05,'
+           f'"track":87.5,"speed":10.5,"climb":0.0,"eps":0.1,"eph":0.04}}\n')
+    sky = ('{"class":"SKY","device":"/dev/ttyACM0","hdop":0.6,"pdop":1.1,"satellites":['
+           + ",".join(f'{{"PRN":{p},"el":45,"az":120,"ss":44,"used":true}}' for p in range(1, 24))
+           + ']}\n')
+    return (tpv + sky).encode()
+
+
+class FakeSMBus:
+    """Bus I2C con un MPU6050 che restituisce valori deterministici."""
+
+    def __init__(self, bus=1):
+        self._n = 0
+
+    def write_byte_data(self, addr, reg, value):
+        pass
+
+    def read_byte_data(self, addr, reg):
+        self._n += 1
+        return (self._n * 37 + reg) & 0xFF
+
+
+class FakeMpu6050:
+    def __init__(self, address=0x68):
+        self._n = 0
+
+    def get_accel_data(self):
+        self._n += 1
+        return {"x": 0.01 * self._n % 2, "y": -0.2, "z": 9.81}
+
+    def get_gyro_data(self):
+        return {"x": 0.5, "y": -1.25, "z": 0.0}
+
+
+def install_fake_modules():
+    """Sostituisce i moduli che parlano con l'hardware (o con gpsd)."""
+    gpsd = types.ModuleType("gpsd")
+    gpsd.connect = lambda *a, **k: None
+    gpsd.get_current = lambda: FakeGpsdPacket(0)
+    smbus = types.ModuleType("smbus")
+    smbus.SMBus = FakeSMBus
+    mpu6050 = types.ModuleType("mpu6050")
+    mpu6050.mpu6050 = FakeMpu6050
+    sys.modules.update(gpsd=gpsd, smbus=smbus, mpu6050=mpu6050)
+
+
+class UdpSink:
+    """Socket UDP in loopback che conta i datagrammi ricevuti."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.2)
+        self.address = self.sock.getsockname()
+        self.received = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            try:
+                self.sock.recv(65535)
+                self.received += 1
+            except socket.timeout:
+                pass
+
+    def close(self):
+        time.sleep(0.3)
+        self._running = False
+        self._thread.join()
+        self.sock.close()
+
+
+# ───────────────────────────────── FASI ─────────────────────────────────
+def epoch_chunks(n):
+    """n blocchi di byte seriali, uno per epoca."""
+    lines = synthetic_stream(n)
+    return [b"".join(lines[i:i + LINES_PER_EPOCH])
+            for i in range(0, len(lines), LINES_PER_EPOCH)]
+
+
+def fanout_to(sink):
+    from udp_fanout import UdpFanout
+    # Senza thread di invio: la fase chiama drain() e misura anche il sendto
+    return UdpFanout([sink.address], maxlen=1024)
+
+
+def bench_log_writer(tmp):
+    """Log in tmp con frame piccoli, così la coda non resta piena durante la misura."""
+    from log_writer import LogWriter
+    return LogWriter(tmp, flush_bytes=16 * 1024).start()
+
+
+def stage_mainrtk(n, sink, tmp, raw=False):
+    import mainRTK
+    from gnss_replay import SessionRecorder
+    from nmea_fast import NmeaParser
+    from serial_reader import SerialLineReader
+
+    mainRTK.udp_fanout = fanout = fanout_to(sink)
+    mainRTK.nmea_log = bench_log_writer(tmp)
+    on_bytes = None
+    if raw:
+        mainRTK.raw_recorder = SessionRecorder(tmp, "BENCH")
+        mainRTK.raw_recorder.writer.flush_bytes = 16 * 1024
+        mainRTK.raw_recorder.start_writer()
+        on_bytes = mainRTK.record_receiver_bytes
+    ser = FakeSerial()
+    reader = SerialLineReader(ser, on_bytes=on_bytes)
+    parser = NmeaParser()
+    handle = mainRTK.handle_gps_line
+
+    def step(chunk):
+        ser.push(chunk)
+        for line in reader.read_lines():
+            handle(line, parser, None)
+        fanout.drain()
+    return step, epoch_chunks(n)
+
+
+def stage_mainrtk_raw(n, sink, tmp):
+    return stage_mainrtk(n, sink, tmp, raw=True)
+
+
+def _stage_testrtknexter(n, sink, tmp, packet_format):
+    import testRTKNEXTER as T
+    from epoch_assembler import EpochAssembler
+    from serial_reader import LineFramer
+
+    T.CONFIG["packet_format"] = packet_format
+    T.udp_fanout = fanout = fanout_to(sink)
+    T.assembler = EpochAssembler(T.on_epoch, deadline=T.CONFIG["epoch_deadline"])
+    framer = LineFramer()
+    on_line = T.on_gps_line
+
+    def step(chunk):
+        for line in framer.feed(chunk):
+            on_line(line)
+        fanout.drain()
+    return step, epoch_chunks(n)
+
+
+def stage_testrtknexter(n, sink, tmp):
+    return _stage_testrtknexter(n, sink, tmp, "ascii")
+
+
+def stage_testrtknexter_bin(n, sink, tmp):
+    return _stage_testrtknexter(n, sink, tmp, "binary")
+
+
+def stage_maingnss(n, sink, tmp):
+    import mainGNSS
+
+    mainGNSS.KALMAN_FLAG = False
+    mainGNSS.sock = fanout = fanout_to(sink)
+    mainGNSS.log_writer = bench_log_writer(tmp)
+    process = mainGNSS.process_packet
+    start = time.time()
+
+    def step(item):
+        i, packet = item
+        # Tempo simulato a 25 Hz: le statistiche escono ogni 15 s come sul campo
+        process(packet, start + i * 0.04)
+        fanout.drain()
+    return step, [(i, FakeGpsdPacket(i)) for i in range(n)]
+
+
+def stage_maingnss_watch(n, sink, tmp, kalman=False):
+    import mainGNSS
+    from gpsd_watch import GpsdWatch
+
+    mainGNSS.KALMAN_FLAG = kalman
+    mainGNSS.sock = fanout = fanout_to(sink)
+    mainGNSS.log_writer = bench_log_writer(tmp)
+    process = mainGNSS.process_packet
+    # gpsd finto: l'altro capo di una coppia di socket
+    gpsd_side, ours = socket.socketpair()
+    gpsd_side.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    watch = GpsdWatch()
+    watch.open(sock=ours)
+    reports = iter(watch)
+
+    def step(lines):
+        gpsd_side.sendall(lines)
+        report = next(reports)
+        process(report, report.timestamp)
+        fanout.drain()
+    return step, [gpsd_epoch_lines(i) for i in range(n)]
+
+
+def stage_maingnss_kalman(n, sink, tmp):
+    return stage_maingnss_watch(n, sink, tmp, kalman=True)
+
+
+def stage_accgir(n, sink, tmp):
+    import AccGirAcquisizione as A
+
+    A.log_dir = tmp
+    sensor = FakeMpu6050()
+    per_flush = A.read_frequency * A.log_interval
+    filename = A.get_log_filename()
+    data = []
+
+    def step(i):
+        data.append(A.read_record(sensor))
+        if len(data) >= per_flush:
+            A.flush_data(data, filename)
+            data.clear()
+    return step, range(n)
+
+
+def stage_picchi(n, sink, tmp):
+    import giroscopioPicchi as G
+
+    G.bus = FakeSMBus()
+    out = open(os.path.join(tmp, "picchi.txt"), "a")
+    sample = G.read_accel_sample
+    now = G.datetime.now
+
+    def step(i):
+        data_str = sample()
+        if data_str is not None:
+            out.write(f"{now().strftime('%Y%m%d_%H%M%S')}: {data_str}\n")
+    return step, range(n)
+
+
+STAGES = {
+    "mainrtk": stage_mainrtk,
+    "mainrtk_raw": stage_mainrtk_raw,
+    "testrtknexter": stage_testrtknexter,
+    "testrtknexter_bin": stage_testrtknexter_bin,
+    "maingnss": stage_maingnss,
+    "maingnss_watch": stage_maingnss_watch,
+    "maingnss_kalman": stage_maingnss_kalman,
+    "accgir": stage_accgir,
+    "picchi": stage_picchi,
+}
+
+
+# ──────────────────────────────── MISURA ────────────────────────────────
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def measure(name, n, sink, tmp):
+    """Esegue una fase e ne restituisce le metriche (None se saltata)."""
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            step, items = STAGES[name](4 * n, sink, tmp)
+    except ImportError as e:
+        print(f"{name:<18} saltata: {e}")
+        return None
+    items = list(items)
+    warmup, timed, traced, counted = (items[i * n:(i + 1) * n] for i in range(4))
+    perf = time.perf_counter_ns
+
+    # Le stampe degli script (una al secondo o per pacchetto) vanno a /dev/null
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for item in warmup:
+            step(item)
+
+        # Throughput: senza cronometro per elemento
+        start = time.perf_counter()
+        for item in timed:
+            step(item)
+        elapsed = time.perf_counter() - start
+
+        # Latenza per elemento
+        latencies = []
+        for item in traced:
+            t0 = perf()
+            step(item)
+            latencies.append(perf() - t0)
+
+        # Memoria: blocchi netti e picco tracciato
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        for item in counted:
+            step(item)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        gc.collect()
+        blocks = sys.getallocatedblocks() - blocks
+
+    latencies.sort()
+    return {
+        "rate": n / elapsed,
+        "p50_us": percentile(latencies, 0.50) / 1000,
+        "p99_us": percentile(latencies, 0.99) / 1000,
+        "blocks": blocks / n,
+        "peak_kib": peak / 1024,
+    }
+
+
+def compare(name, result, base, tolerance):
+    """Restituisce l'elenco dei peggioramenti rispetto al riferimento."""
+    problems = []
+    if result["rate"] < base["rate"] * (1 - tolerance):
+        problems.append(f"elementi/s {result['rate']:.0f} < {base['rate']:.0f}")
+    if result["p50_us"] > base["p50_us"] * (1 + tolerance):
+        problems.append(f"p50 {result['p50_us']:.1f} µs > {base['p50_us']:.1f} µs")
+    # Il p99 è più rumoroso: tolleranza doppia
+    if result["p99_us"] > base["p99_us"] * (1 + 2 * tolerance):
+        problems.append(f"p99 {result['p99_us']:.1f} µs > {base['p99_us']:.1f} µs")
+    if result["blocks"] > base["blocks"] + 0.5:
+        problems.append(f"blocchi/elem {result['blocks']:.2f} > {base['blocks']:.2f}")
+    return [f"{name}: {p}" for p in problems]
+
+
+def load_baselines():
+    try:
+        with open(BASELINE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark dei percorsi per fix degli script')
+    ap.add_argument('--items', type=int, default=2000, help='elementi per misura')
+    ap.add_argument('--stage', action='append', choices=sorted(STAGES),
+                    help='fase da eseguire (ripetibile, default tutte)')
+    ap.add_argument('--save-baseline', action='store_true',
+                    help='salva i risultati come riferimento per questo host')
+    ap.add_argument('--tolerance', type=float, default=0.25,
+                    help='peggioramento ammesso rispetto al riferimento (0.25 = 25%%)')
+    args = ap.parse_args()
+
+    install_fake_modules()
+    sink = UdpSink()
+    host = platform.node()
+    baselines = load_baselines()
+    base = baselines.get(host, {})
+    results = {}
+    failures = []
+
+    print(f"{'fase':<18} {'elem/s':>10} {'p50 µs':>9} {'p99 µs':>9} "
+          f"{'blocchi/elem':>13} {'picco KiB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.stage or STAGES:
+            result = measure(name, args.items, sink, tmp)
+            if result is None:
+                continue
+            results[name] = result
+            print(f"{name:<18} {result['rate']:10.0f} {result['p50_us']:9.1f} "
+                  f"{result['p99_us']:9.1f} {result['blocks']:13.2f} {result['peak_kib']:10.1f}")
+            if name in base and not args.save_baseline:
+                failures += compare(name, result, base[name], args.tolerance)
+    sink.close()
+    print(f"datagrammi ricevuti dal sink UDP: {sink.received}")
+
+    if args.save_baseline:
+        baselines[host] = {**base, **results}
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"riferimenti salvati in {BASELINE_FILE} per {host}")
+        return
+    if not base:
+        print(f"nessun riferimento per {host}: usare --save-baseline")
+    for failure in failures:
+        print(f"[REGRESSIONE] {failure}")
+    print("FALLITO" if failures else "OK")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Benchmark del filtro di tracciamento (track_filter) contro il Kalman
+generico 4×4 usato prima in mainGNSS (filterpy, o le stesse operazioni
+NumPy se filterpy non è installato).
+
+Il percorso simulato è un giro di pista ellittico a velocità variabile,
+campionato a 25 Hz con rumore di posizione; oltre al tempo per fix viene
+stampato l'errore di posizione, velocità e direzione rispetto al vero.
+
+Uso:
+    python3 bench_track.py [--fixes 5000] [--rate 25] [--sigma 0.5]
+"""
+
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+
+from track_filter import TrackFilter
+
+LAT0, LON0 = 45.4805, 9.1345        # centro della pista
+M_PER_DEG_LAT = 111_132.0
+M_PER_DEG_LON = 111_320.0 * math.cos(math.radians(LAT0))
+
+
+def simulate(fixes, rate, sigma, seed=1):
+    """Restituisce [(t, lat, lon, e_vero, n_vero, velocità, direzione)] rumorosi."""
+    rng = random.Random(seed)
+    a, b = 400.0, 150.0             # semiassi della pista (m)
+    out = []
+    phase = 0.0
+    for i in range(fixes):
+        t = 1.7e9 + i / rate
+        speed = 12.0 + 4.0 * math.sin(i / rate / 20.0)     # 8..16 m/s
+        # Avanzamento lungo l'ellisse a velocità speed
+        de = -a * math.sin(phase)
+        dn = b * math.cos(phase)
+        phase += speed / rate / math.hypot(de, dn)
+        e, n = a * math.cos(phase), b * math.sin(phase)
+        heading = math.degrees(math.atan2(de, dn)) % 360.0
+        lat = LAT0 + (n + rng.gauss(0, sigma)) / M_PER_DEG_LAT
+        lon = LON0 + (e + rng.gauss(0, sigma)) / M_PER_DEG_LON
+        out.append((t, lat, lon, e, n, speed, heading))
+    return out
+
+
+def make_generic(dt):
+    """Kalman 4×4 generico come in mainGNSS prima di track_filter."""
+    try:
+        from filterpy.kalman import KalmanFilter
+        kf = KalmanFilter(dim_x=4, dim_z=2)
+        label = "filterpy"
+    except ImportError:
+        kf = None
+        label = "numpy 4x4"
+    F = np.array([[1, 0, dt, 0], [0, 1, 0, dt], [0, 0, 1, 0], [0, 0, 0, 1]], dtype=float)
+    H = np.array([[1, 0, 0, 0], [0, 1, 0, 0]], dtype=float)
+    Q = np.eye(4) * 0.1
+    R = np.eye(2)
+    if kf is not None:
+        kf.F, kf.H, kf.Q, kf.R = F, H, Q, R
+        kf.P *= 1000.
+
+        def step(lon, lat):
+            kf.predict()
+            kf.update(np.array([lon, lat]))
+        return label, step
+
+    state = {"x": np.zeros(4), "P": np.eye(4) * 1000.}
+    I = np.eye(4)
+
+    def step(lon, lat):
+        # Stesse operazioni di filterpy predict()/update()
+        x = F @ state["x"]
+        P = F @ state["P"] @ F.T + Q
+        y = np.array([lon, lat]) - H @ x
+        PHT = P @ H.T
+        S = H @ PHT + R
+        K = PHT @ np.linalg.inv(S)
+        state["x"] = x + K @ y
+        I_KH = I - K @ H
+        state["P"] = I_KH @ P @ I_KH.T + K @ R @ K.T
+    return label, step
+
+
+def angle_diff(a, b):
+    return (a - b + 180.0) % 360.0 - 180.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark filtro di tracciamento')
+    ap.add_argument('--fixes', type=int, default=5000)
+    ap.add_argument('--rate', type=float, default=25.0, help='fix al secondo')
+    ap.add_argument('--sigma', type=float, default=0.5, help='rumore di posizione (m)')
+    args = ap.parse_args()
+
+    track = simulate(args.fixes, args.rate, args.sigma)
+
+    label, generic = make_generic(1.0 / args.rate)
+    start = time.perf_counter()
+    for _, lat, lon, *_ in track:
+        generic(lon, lat)
+    generic_us = (time.perf_counter() - start) / len(track) * 1e6
+
+    tracker = TrackFilter()
+    sigma = args.sigma
+    pos_err = speed_err = heading_err = raw_err = 0.0
+    counted = 0
+    start = time.perf_counter()
+    for t, lat, lon, *_ in track:
+        tracker.update(lat, lon, t, sigma, sigma)
+    track_us = (time.perf_counter() - start) / len(track) * 1e6
+
+    # Accuratezza (seconda passata, fuori dalla misura del tempo)
+    tracker = TrackFilter()
+    for i, (t, lat, lon, e, n, speed, heading) in enumerate(track):
+        est = tracker.update(lat, lon, t, sigma, sigma)
+        if i < args.rate * 2:
+            continue        # assestamento
+        de = (est.lon - LON0) * M_PER_DEG_LON - e
+        dn = (est.lat - LAT0) * M_PER_DEG_LAT - n
+        pos_err += de * de + dn * dn
+        raw_err += (((lon - LON0) * M_PER_DEG_LON - e) ** 2
+                    + ((lat - LAT0) * M_PER_DEG_LAT - n) ** 2)
+        speed_err += (est.speed - speed) ** 2
+        heading_err += angle_diff(est.heading, heading) ** 2
+        counted += 1
+
+    print(f"Fix: {len(track)} a {args.rate:g} Hz, rumore {sigma} m")
+    print(f"{label:<12} {generic_us:8.2f} us/fix")
+    print(f"{'track_filter':<12} {track_us:8.2f} us/fix  ({track_us / generic_us * 100:.0f}% del generico)")
+    print(f"errore posizione RMS: grezzo {math.sqrt(raw_err / counted):.3f} m, "
+          f"filtrato {math.sqrt(pos_err / counted):.3f} m")
+    print(f"errore velocità RMS {math.sqrt(speed_err / counted):.3f} m/s, "
+          f"direzione RMS {math.sqrt(heading_err / counted):.2f}°")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,10 +24,14 @@ pip3 install gpsd-py3 --break-system-packages
 pip3 install psutil --break-system-packages
 pip3 install smbus --break-system-packages
 pip3 install sounddevice --break-system-packages
-pip3 install filterpy --break-system-packages
 sudo pip3 install mpu6050-raspberrypi --break-system-packages
 sudo pip3 install pyserial --break-system-packages
 sudo pip3 install pynmea2 --break-system-packages
+# NumPy: stima di velocità e direzione (heading_estimator.py) in mainGNSS e
+# testRTKNEXTER, oltre a giroscopioPicchi. Pacchetto di sistema già compilato
+sudo apt install -y python3-numpy
+# Solo per i log compressi zstd (log_codec "zstd"), gzip non richiede altro
+#sudo pip3 install zstandard --break-system-packages
 
 echo "----------------------------------------"
 echo "[INFO] Making Directory..."
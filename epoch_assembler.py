@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Raggruppa le sentenze GGA, RMC e VTG della stessa epoca di navigazione.
+
+Ogni epoca è identificata dall'orario UTC di GGA e RMC; VTG non ha orario
+e viene attribuita all'epoca aperta. L'epoca viene emessa appena sono
+arrivate tutte le sentenze attese, oppure allo scadere di una breve
+scadenza (o all'arrivo dell'epoca successiva) se ne manca qualcuna.
+
+I campi mancanti restano quelli dell'ultima epoca che li conteneva; per
+posizione, velocità e data l'Epoch riporta quanto erano vecchi (secondi
+di tempo GNSS, 0 = stessa epoca). La data viene da RMC e, se RMC manca,
+viene fatta avanzare al passaggio della mezzanotte UTC.
+
+Non è thread-safe: add() e poll() vanno chiamate dallo stesso thread
+(quello che legge la seriale).
+"""
+
+import datetime
+
+from nmea_fast import GGA, RMC, VTG
+
+MS_PER_DAY = 86400000
+_HALF_DAY_MS = MS_PER_DAY // 2
+
+# Epoche senza un tipo di sentenza dopo le quali non lo si attende più
+FORGET_AFTER = 10
+
+_ONE_DAY = datetime.timedelta(days=1)
+
+
+def _age(key, source):
+    """Distanza in secondi fra due orari in ms del giorno (None se mai visto)."""
+    if source is None:
+        return None
+    return ((key - source) % MS_PER_DAY) / 1000.0
+
+
+def _system_date(key):
+    """Data UTC dal clock di sistema, scegliendo il giorno più vicino all'orario key."""
+    now = datetime.datetime.utcnow()
+    now_ms = (now.hour * 3600 + now.minute * 60 + now.second) * 1000
+    today = now.date()
+    if key - now_ms > _HALF_DAY_MS:
+        today -= _ONE_DAY
+    elif now_ms - key > _HALF_DAY_MS:
+        today += _ONE_DAY
+    return (today.year, today.month, today.day)
+
+
+class Epoch:
+    """Fix di una singola epoca, riutilizzato ad ogni emissione."""
+
+    __slots__ = (
+        'time', 'date', 'lat', 'lon', 'alt', 'quality', 'satellites', 'hdop',
+        'speed_kmh', 'course', 'kinds', 'complete',
+        'position_age', 'speed_age', 'date_age',
+    )
+
+    def __init__(self):
+        self.time = None        # secondi dalla mezzanotte UTC
+        self.date = None        # (anno, mese, giorno) UTC
+        self.lat = None
+        self.lon = None
+        self.alt = None
+        self.quality = 0
+        self.satellites = 0
+        self.hdop = None
+        self.speed_kmh = 0.0
+        self.course = None
+        self.kinds = set()      # sentenze ricevute in questa epoca
+        self.complete = False   # True se sono arrivate tutte quelle attese
+        self.position_age = None
+        self.speed_age = None
+        self.date_age = None    # None = data dal clock di sistema
+
+
+class EpochAssembler:
+    """Assembla le epoche e chiama on_epoch(epoch) per ognuna.
+
+    epoch è valido solo durante la chiamata (l'oggetto viene riutilizzato).
+    """
+
+    def __init__(self, on_epoch, deadline=0.1, expected=(GGA, RMC, VTG)):
+        self._on_epoch = on_epoch
+        self._deadline = deadline
+        self._expected = tuple(expected)
+        self._last_seen = {}        # tipo → numero dell'ultima epoca che lo conteneva
+        self._epoch = Epoch()
+        self._open = False
+        self._key = None            # orario dell'epoca aperta (ms del giorno)
+        self._opened_at = 0.0
+        self._position_key = None   # orario dell'epoca che ha fornito ogni campo
+        self._speed_key = None
+        self._date_key = None
+        self._date = None
+        self.epochs = 0
+        self.complete = 0
+        self.timeouts = 0
+        self.orphans = 0            # VTG arrivate senza un'epoca aperta
+
+    def add(self, kind, fix, now):
+        """Aggiunge la sentenza appena applicata dal parser a fix.
+
+        kind è il valore restituito da NmeaParser.parse(), now un tempo
+        monotono in secondi.
+        """
+        self.poll(now)
+        e = self._epoch
+
+        if kind is VTG:
+            if not self._open:
+                self.orphans += 1
+                return
+            e.speed_kmh = fix.speed_kmh
+            e.course = fix.course
+            self._speed_key = self._key
+        else:
+            if fix.time is None:
+                return
+            key = int(round(fix.time * 1000)) % MS_PER_DAY
+            if self._open and key != self._key:
+                # Nuova epoca: la precedente non arriverà più a completarsi
+                self._emit()
+            if not self._open:
+                self._open = True
+                self._key = key
+                self._opened_at = now
+                e.kinds.clear()
+
+            if kind is GGA:
+                e.lat = fix.lat
+                e.lon = fix.lon
+                e.alt = fix.alt
+                e.quality = fix.quality
+                e.satellites = fix.satellites
+                e.hdop = fix.hdop
+                self._position_key = key
+            elif kind is RMC:
+                if fix.date:
+                    self._date = fix.date
+                    self._date_key = key
+                # VTG, se presente, dà la velocità direttamente in km/h
+                if VTG not in e.kinds:
+                    e.speed_kmh = fix.speed_kmh
+                    e.course = fix.course
+                    self._speed_key = key
+                # Posizione da RMC solo se l'epoca non ha (ancora) GGA
+                if GGA not in e.kinds and fix.valid and fix.lat is not None:
+                    e.lat = fix.lat
+                    e.lon = fix.lon
+                    self._position_key = key
+        e.kinds.add(kind)
+
+        if self._is_complete():
+            self._emit()
+
+    def poll(self, now):
+        """Emette l'epoca aperta se è scaduta la sua scadenza."""
+        if self._open and now - self._opened_at > self._deadline:
+            self.timeouts += 1
+            self._emit()
+
+    def _expected_now(self):
+        """Tipi attesi, escludendo quelli che il ricevitore ha smesso di inviare."""
+        return [k for k in self._expected
+                if self.epochs - self._last_seen.get(k, 0) <= FORGET_AFTER]
+
+    def _is_complete(self):
+        kinds = self._epoch.kinds
+        for k in self._expected_now():
+            if k not in kinds:
+                return False
+        return True
+
+    def _emit(self):
+        e = self._epoch
+        key = self._key
+        self._open = False
+        e.complete = self._is_complete()
+
+        e.time = key / 1000.0
+        e.position_age = _age(key, self._position_key)
+        e.speed_age = _age(key, self._speed_key)
+        if self._date is None:
+            e.date = _system_date(key)
+            e.date_age = None
+        else:
+            date = self._date
+            if key < self._date_key:
+                # Mezzanotte UTC passata dall'ultima RMC
+                d = datetime.date(*date) + _ONE_DAY
+                date = (d.year, d.month, d.day)
+            e.date = date
+            e.date_age = _age(key, self._date_key)
+
+        for k in e.kinds:
+            self._last_seen[k] = self.epochs
+        self.epochs += 1
+        if e.complete:
+            self.complete += 1
+        self._on_epoch(e)
+
+    def stats(self):
+        return (f"epoche {self.epochs} complete {self.complete} "
+                f"scadute {self.timeouts} VTG orfane {self.orphans}")
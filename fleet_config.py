@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Configurazione di più teste con un solo datagramma (broadcast o multicast).
+
+Comando (JSON, porta 5959 come il vecchio {"horse_number": ...}):
+    {"version": 1718000000,
+     "defaults": {"RATE": 10, "DESTINATION": "10.0.0.1:4141"},
+     "heads": {"B827EB000001": {"HEAD_ID": 12},
+               "B827EB000002": {"HEAD_ID": 7, "RATE": 5}}}
+
+Ogni testa applica la voce col proprio MAC (wlan0), unita ai "defaults",
+e risponde al mittente con una conferma compatta:
+    ACK,<MAC>,<versione>,<HEAD_ID>,OK|ERR
+
+Una testa che riceve di nuovo una versione già applicata risponde
+soltanto: il controller (fleet_controller.py) può quindi ritrasmettere il
+comando a chi non ha confermato senza effetti collaterali. Se le teste
+sono tante il comando viene diviso in più datagrammi con la stessa
+versione, ognuno sotto la dimensione massima.
+"""
+
+import json
+
+CONFIG_PORT = 5959
+MULTICAST_GROUP = "239.255.59.59"
+
+# Dimensione massima di un datagramma di comando (sotto l'MTU della VPN)
+MAX_COMMAND_SIZE = 1400
+
+# Chiavi accettate in una voce di configurazione
+CONFIG_KEYS = ("HEAD_ID", "RATE", "DESTINATION")
+
+
+def normalize_mac(mac):
+    """MAC in esadecimale maiuscolo senza separatori (come head_identity.get_wlan0_mac)."""
+    return mac.replace(':', '').replace('-', '').upper()
+
+
+def build_commands(version, heads, defaults=None, max_size=MAX_COMMAND_SIZE):
+    """Prepara i datagrammi del comando per le teste in heads ({MAC: voce}).
+
+    Le teste vengono distribuite su più datagrammi se non stanno in max_size.
+    """
+    defaults = defaults or {}
+    datagrams = []
+    chunk = {}
+
+    def encode(items):
+        return json.dumps({"version": version, "defaults": defaults, "heads": items},
+                          separators=(',', ':')).encode()
+
+    for mac, entry in heads.items():
+        chunk[normalize_mac(mac)] = entry
+        if len(chunk) > 1 and len(encode(chunk)) > max_size:
+            last = chunk.popitem()
+            datagrams.append(encode(chunk))
+            chunk = dict([last])
+    if chunk:
+        datagrams.append(encode(chunk))
+    return datagrams
+
+
+def entry_for(message, mac):
+    """Voce di configurazione per mac (unita ai defaults), None se non indirizzata."""
+    entry = message.get("heads", {}).get(mac)
+    if entry is None:
+        return None
+    merged = {k: v for k, v in message.get("defaults", {}).items() if k in CONFIG_KEYS}
+    merged.update((k, v) for k, v in entry.items() if k in CONFIG_KEYS)
+    return merged
+
+
+def encode_ack(mac, version, head_id, ok):
+    return f"ACK,{mac},{version},{head_id},{'OK' if ok else 'ERR'}".encode()
+
+
+def decode_ack(datagram):
+    """Restituisce (mac, versione, head_id, ok) o None se non è una conferma."""
+    try:
+        tag, mac, version, head_id, status = datagram.decode('ascii').strip().split(',')
+        if tag != 'ACK':
+            return None
+        return mac, int(version), head_id, status == 'OK'
+    except (ValueError, UnicodeDecodeError):
+        return None
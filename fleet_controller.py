@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Assegna HEAD_ID (ed eventualmente RATE/DESTINATION) a molte teste insieme.
+
+Invia il comando di gruppo (vedi fleet_config.py) in multicast, broadcast o
+a un indirizzo singolo, raccoglie le conferme e ritrasmette il comando solo
+alle teste che non hanno confermato la versione inviata.
+
+Uso:
+    python3 fleet_controller.py assegnazioni.json [--rate 10] [--destination host:porta]
+                                [--target 239.255.59.59] [--retries 5] [--timeout 1.0]
+
+Il file di assegnazioni è JSON {"MAC": HEAD_ID, ...} (oppure {"MAC": {"HEAD_ID": 12,
+"RATE": 5}, ...}) o CSV con righe MAC,HEAD_ID.
+"""
+
+import argparse
+import json
+import socket
+import sys
+import time
+
+from fleet_config import (CONFIG_PORT, MULTICAST_GROUP, build_commands, decode_ack,
+                          normalize_mac)
+
+
+def load_assignments(path):
+    """Legge le assegnazioni {MAC: voce} da un file JSON o CSV."""
+    with open(path) as f:
+        text = f.read()
+    heads = {}
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # CSV: MAC,HEAD_ID per riga (righe vuote e commenti # ignorati)
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            mac, head_id = (field.strip() for field in line.split(',')[:2])
+            heads[normalize_mac(mac)] = {"HEAD_ID": int(head_id)}
+        return heads
+    for mac, entry in data.items():
+        heads[normalize_mac(mac)] = entry if isinstance(entry, dict) else {"HEAD_ID": entry}
+    return heads
+
+
+def run(heads, defaults, target, port, retries, timeout, version, ttl=1):
+    """Invia il comando finché tutte le teste confermano o finiscono i tentativi.
+
+    Restituisce {MAC: (head_id, ok)} per le teste che hanno risposto.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.bind(("0.0.0.0", 0))
+
+    pending = dict(heads)
+    results = {}
+    for attempt in range(retries + 1):
+        commands = build_commands(version, pending, defaults)
+        for datagram in commands:
+            sock.sendto(datagram, (target, port))
+        print(f"[INFO] tentativo {attempt + 1}: {len(pending)} teste, "
+              f"{len(commands)} datagrammi, versione {version}")
+
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, addr = sock.recvfrom(256)
+            except socket.timeout:
+                break
+            ack = decode_ack(data)
+            if ack is None:
+                continue
+            mac, acked_version, head_id, ok = ack
+            if acked_version != version or mac not in heads:
+                continue
+            results[mac] = (head_id, ok)
+            if ok:
+                # Le teste in errore restano in attesa e vengono ritentate
+                pending.pop(mac, None)
+            print(f"  {mac} ({addr[0]}) HEAD_ID {head_id} {'OK' if ok else 'ERRORE'}")
+        if not pending:
+            break
+    sock.close()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Configurazione di gruppo delle teste')
+    ap.add_argument('assignments', help='File JSON o CSV con MAC e HEAD_ID')
+    ap.add_argument('--rate', type=float, help='Pacchetti al secondo per tutte le teste')
+    ap.add_argument('--destination', help='Server host:porta per tutte le teste')
+    ap.add_argument('--target', default=MULTICAST_GROUP,
+                    help='Gruppo multicast, indirizzo broadcast o singola testa')
+    ap.add_argument('--port', type=int, default=CONFIG_PORT)
+    ap.add_argument('--retries', type=int, default=5)
+    ap.add_argument('--timeout', type=float, default=1.0, help='Attesa conferme per tentativo (s)')
+    ap.add_argument('--ttl', type=int, default=1, help='TTL multicast')
+    ap.add_argument('--version', type=int, default=None,
+                    help='Versione della configurazione (default: ora Unix)')
+    args = ap.parse_args()
+
+    heads = load_assignments(args.assignments)
+    defaults = {}
+    if args.rate is not None:
+        defaults["RATE"] = args.rate
+    if args.destination:
+        defaults["DESTINATION"] = args.destination
+    version = args.version if args.version is not None else int(time.time())
+
+    results = run(heads, defaults, args.target, args.port, args.retries,
+                  args.timeout, version, args.ttl)
+
+    confirmed = [mac for mac, (_, ok) in results.items() if ok]
+    failed = [mac for mac in heads if mac not in confirmed]
+    print(f"\n[INFO] versione {version}: {len(confirmed)}/{len(heads)} teste confermate")
+    for mac in failed:
+        status = "errore" if mac in results else "nessuna risposta"
+        print(f"  {mac} HEAD_ID {heads[mac].get('HEAD_ID')}: {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
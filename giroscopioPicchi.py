@@ -11,9 +11,6 @@ import sounddevice as sd
 import numpy as np
 import subprocess
 
-# Print available sound devices
-print(sd.query_devices())
-
 # IDs and constants
 HEAD_ID = 1
 SENSOR_ID = 3
@@ -52,11 +49,8 @@ MIC_GAIN = 0.9
 OUTPUT_VOLUME = 0.9
 file_lock = threading.Lock()
 
-# Initialize MPU6050
-bus = smbus.SMBus(1)
-bus.write_byte_data(MPU6050_ADDR, PWR_MGMT_1, 0)
-bus.write_byte_data(MPU6050_ADDR, ACCEL_CONFIG, 0x08)
-bus.write_byte_data(MPU6050_ADDR, GYRO_CONFIG, 0x00)
+# I2C bus, opened by init_mpu6050()
+bus = None
 
 # Socket and step detection setup
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -66,6 +60,15 @@ step_count = 0
 last_step_time = time.time()
 
 
+def init_mpu6050():
+    """Open the I2C bus and configure the MPU6050."""
+    global bus
+    bus = smbus.SMBus(1)
+    bus.write_byte_data(MPU6050_ADDR, PWR_MGMT_1, 0)
+    bus.write_byte_data(MPU6050_ADDR, ACCEL_CONFIG, 0x08)
+    bus.write_byte_data(MPU6050_ADDR, GYRO_CONFIG, 0x00)
+
+
 def read_word(sensor_address, reg_address):
     """Read 16-bit data from the sensor."""
     high = bus.read_byte_data(sensor_address, reg_address)
@@ -89,43 +92,51 @@ def detect_step(average_past, current_value, average_future, last_step_time, cur
     return False
 
 
+def read_accel_sample():
+    """Read one sample and update step detection; None while the window fills."""
+    global last_step_time, step_count
+
+    # Read accelerometer values
+    accel_x = read_word(MPU6050_ADDR, ACCEL_XOUT_H)
+    accel_y = read_word(MPU6050_ADDR, ACCEL_YOUT_H)
+    accel_z = read_word(MPU6050_ADDR, ACCEL_ZOUT_H)
+
+    # Read gyroscope values
+    gyro_x = read_word(MPU6050_ADDR, GYRO_XOUT_H)
+    gyro_y = read_word(MPU6050_ADDR, GYRO_YOUT_H)
+    gyro_z = read_word(MPU6050_ADDR, GYRO_ZOUT_H)
+
+    # Update step detection values
+    if len(future_values) < WINDOW_SIZE:
+        future_values.append(accel_z)
+        return None
+    else:
+        past_values.append(future_values.popleft())
+        future_values.append(accel_z)
+
+    # Detect steps
+    average_past = calculate_moving_average(past_values)
+    average_future = calculate_moving_average(future_values)
+    current_time = time.time()
+
+    if detect_step(average_past, accel_z, average_future, last_step_time, current_time):
+        step_count += 1
+        last_step_time = current_time
+
+    # Create data string
+    return f"SENSOR,{HEAD_ID},{SENSOR_ID},{accel_x},{accel_y},{accel_z},{gyro_x},{gyro_y},{gyro_z},{step_count}"
+
+
 def write_accel():
     """Write accelerometer and gyroscope data to a file."""
-    global is_active, last_step_time, step_count
     filename = datetime.now().strftime("%Y%m%d_%H%M%S") + ".txt"
 
     with open(filename, 'a') as file:
         try:
             while is_active:
-                # Read accelerometer values
-                accel_x = read_word(MPU6050_ADDR, ACCEL_XOUT_H)
-                accel_y = read_word(MPU6050_ADDR, ACCEL_YOUT_H)
-                accel_z = read_word(MPU6050_ADDR, ACCEL_ZOUT_H)
-
-                # Read gyroscope values
-                gyro_x = read_word(MPU6050_ADDR, GYRO_XOUT_H)
-                gyro_y = read_word(MPU6050_ADDR, GYRO_YOUT_H)
-                gyro_z = read_word(MPU6050_ADDR, GYRO_ZOUT_H)
-
-                # Update step detection values
-                if len(future_values) < WINDOW_SIZE:
-                    future_values.append(accel_z)
+                data_str = read_accel_sample()
+                if data_str is None:
                     continue
-                else:
-                    past_values.append(future_values.popleft())
-                    future_values.append(accel_z)
-
-                # Detect steps
-                average_past = calculate_moving_average(past_values)
-                average_future = calculate_moving_average(future_values)
-                current_time = time.time()
-
-                if detect_step(average_past, accel_z, average_future, last_step_time, current_time):
-                    step_count += 1
-                    last_step_time = current_time
-
-                # Create data string
-                data_str = f"SENSOR,{HEAD_ID},{SENSOR_ID},{accel_x},{accel_y},{accel_z},{gyro_x},{gyro_y},{gyro_z},{step_count}"
                 file.write(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}: {data_str}\n")
 
                 # Sleep to match sensor sampling rate
@@ -198,5 +209,11 @@ def control_audio():
         return jsonify({"status": "error", "message": "Invalid action"}), 400
 
 
-# Run the Flask server in threaded mode
-app.run(host="0.0.0.0", port=5000, threaded=True)
+if __name__ == "__main__":
+    # Print available sound devices
+    print(sd.query_devices())
+
+    init_mpu6050()
+
+    # Run the Flask server in threaded mode
+    app.run(host="0.0.0.0", port=5000, threaded=True)
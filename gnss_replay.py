@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Registrazione e riproduzione deterministica dei flussi GNSS.
+
+record: apre la seriale del ricevitore e si collega al caster NTRIP (come
+farebbe mainRTK.py), inoltra le correzioni al ricevitore e salva su file,
+con l'istante di arrivo, sia i byte letti dalla seriale sia quelli ricevuti
+dal caster.
+
+play: riproduce una registrazione su una pseudo-tty (al posto di
+/dev/ttyACM0) e su un caster NTRIP locale in TCP, a velocità reale, N volte
+più veloce o alla massima velocità possibile. Gli script girano senza
+modifiche puntandoli alla pty e al caster locale:
+
+    python3 gnss_replay.py play giro.rec --link /tmp/ttyGNSS --caster-port 2101
+    python3 mainRTK.py --gps-port /tmp/ttyGNSS --ntrip-host 127.0.0.1 --ntrip-port 2101
+    python3 testRTKNEXTER.py --gps-port /tmp/ttyGNSS --ntrip-host 127.0.0.1 --ntrip-port 2101
+    gpsd -N -n /tmp/ttyGNSS   # poi mainGNSS.py, che legge da gpsd
+
+Formato del file (anche compresso gzip o zstd, riconosciuto in lettura):
+    intestazione  b'GNSSREC1'
+    record        istante (F8, s dall'inizio) | canale (U1) | lunghezza (U4) | byte
+Canali: 0 = byte dal ricevitore (seriale), 1 = byte dal caster NTRIP,
+2 = byte scritti verso il ricevitore (solo informativo, non riprodotto).
+
+SessionRecorder scrive lo stesso formato a segmenti orari compressi, in
+background (log_writer.py): è la registrazione continua di mainRTK.py
+(--raw-log) in logRTK, con file <testa>_<inizio sessione>_<AAAAMMGG_HH>.rec.gz.
+Gli istanti sono secondi dall'inizio della sessione in tutti i segmenti;
+play accetta più segmenti in ordine e li riproduce come un'unica sessione:
+
+    python3 gnss_replay.py play logRTK/B827EB0A1B2C_20261017_140312_*.rec.gz --speed 0
+"""
+
+import argparse
+import base64
+import gzip
+import os
+import re
+import pty
+import socket
+import struct
+import threading
+import time
+import tty
+from datetime import datetime
+
+from log_writer import (CODEC_GZIP, CODEC_ZSTD, DECOMPRESS_ERRORS, FSYNC_INTERVAL, ZSTD_MAGIC,
+                        LogWriter)
+
+FILE_MAGIC = b'GNSSREC1'
+CH_SERIAL = 0
+CH_NTRIP = 1
+CH_TO_RECEIVER = 2
+
+# Estensioni dei segmenti di SessionRecorder
+RECORDING_EXTENSIONS = {CODEC_GZIP: ".rec.gz", CODEC_ZSTD: ".rec.zst"}
+
+_RECORD = struct.Struct('<dBI')
+
+
+class RecordWriter:
+    """Scrive record (istante, canale, byte) su un file binario aperto."""
+
+    def __init__(self, f, start=None):
+        self._f = f
+        self._lock = threading.Lock()
+        self.start = time.monotonic() if start is None else start
+        self.bytes = [0, 0, 0]
+        f.write(FILE_MAGIC)
+
+    def write(self, channel, data, now=None):
+        t = (time.monotonic() if now is None else now) - self.start
+        with self._lock:
+            self._f.write(_RECORD.pack(t, channel, len(data)))
+            self._f.write(data)
+            self.bytes[channel] += len(data)
+
+    def flush(self):
+        with self._lock:
+            self._f.flush()
+
+
+class SessionRecorder:
+    """Registrazione continua a segmenti compressi, scritta da un thread.
+
+    write() accoda soltanto (coda limitata di log_writer.LogWriter): può
+    essere chiamata dal thread di lettura della seriale senza attese su SD.
+    """
+
+    def __init__(self, directory, head, codec=CODEC_GZIP, fsync=FSYNC_INTERVAL,
+                 max_age=120.0, max_bytes=8 * 1024 * 1024):
+        if codec not in RECORDING_EXTENSIONS:
+            raise ValueError(f"codec non supportato per le registrazioni: {codec}")
+        self.head = head
+        self.session = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.start = time.monotonic()
+        self.bytes = [0, 0, 0]
+        name_format = f"{head}_{self.session}_".replace('%', '%%') + "%Y%m%d_%H"
+        self.writer = LogWriter(directory, codec=codec, name_format=name_format,
+                                extension=RECORDING_EXTENSIONS[codec], header=FILE_MAGIC,
+                                fsync=fsync, max_age=max_age, max_bytes=max_bytes)
+
+    def start_writer(self):
+        self.writer.start()
+        return self
+
+    def write(self, channel, data, now=None):
+        """Accoda un record; data può essere una memoryview (viene copiata)."""
+        t = (time.monotonic() if now is None else now) - self.start
+        self.writer.write(b''.join((_RECORD.pack(t, channel, len(data)), data)))
+        self.bytes[channel] += len(data)
+
+    def close(self):
+        self.writer.close()
+
+    def stats(self):
+        return (f"raw seriale {self.bytes[CH_SERIAL]} B, NTRIP {self.bytes[CH_NTRIP]} B; "
+                f"{self.writer.stats()}")
+
+
+def open_recording(path):
+    """Apre una registrazione, compressa gzip, zstd o no."""
+    f = open(path, 'rb')
+    magic = f.read(4)
+    if magic[:2] == b'\x1f\x8b':
+        f.close()
+        f = gzip.open(path, 'rb')
+    elif magic == ZSTD_MAGIC:
+        import zstandard
+        f.seek(0)
+        f = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True,
+                                                        closefd=True)
+    else:
+        f.seek(0)
+    return f
+
+
+def _file_records(path):
+    """Genera (istante, canale, byte, primo della registrazione) da un file."""
+    with open_recording(path) as f:
+        try:
+            magic = f.read(len(FILE_MAGIC))
+            if len(magic) < len(FILE_MAGIC):
+                return      # segmento vuoto o con il primo frame troncato
+            if magic != FILE_MAGIC:
+                raise ValueError(f"{path}: non è una registrazione GNSS")
+            first = True
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    return
+                if header[:len(FILE_MAGIC)] == FILE_MAGIC:
+                    # Registrazione successiva (segmenti uniti con cat)
+                    first = True
+                    header = header[len(FILE_MAGIC):] + f.read(len(FILE_MAGIC))
+                    if len(header) < _RECORD.size:
+                        return
+                t, channel, length = _RECORD.unpack(header)
+                data = f.read(length)
+                if len(data) < length:
+                    return  # coda troncata
+                yield t, channel, data, first
+                first = False
+        except (EOFError,) + DECOMPRESS_ERRORS:
+            return          # frame compresso troncato (mancanza di corrente)
+
+
+def read_records(paths):
+    """Genera (istante, canale, byte) da una registrazione o da una lista di file.
+
+    I file vengono letti in ordine come un'unica registrazione, e così più
+    registrazioni concatenate con cat. I segmenti della stessa sessione
+    (SessionRecorder) proseguono già il tempo del precedente; una
+    registrazione il cui tempo riparte da zero viene accodata alla fine
+    della precedente.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    offset = 0.0
+    last = 0.0
+    for path in paths:
+        for t, channel, data, first in _file_records(path):
+            if first and offset + t < last:
+                offset = last - t
+            last = offset + t
+            yield last, channel, data
+
+
+def session_segments(directory, head=None, session=None):
+    """Segmenti di SessionRecorder in directory, {(testa, sessione): [file in ordine]}."""
+    pattern = re.compile(r'^(.+)_(\d{8}_\d{6})_\d{8}_\d{2}\.rec\.(?:gz|zst)$')
+    sessions = {}
+    for name in sorted(os.listdir(directory)):
+        match = pattern.match(name)
+        if not match:
+            continue
+        key = match.groups()
+        if (head is None or key[0] == head) and (session is None or key[1] == session):
+            sessions.setdefault(key, []).append(os.path.join(directory, name))
+    return sessions
+
+
+# ───────────────────────────── REGISTRAZIONE ─────────────────────────────
+def record(args):
+    import serial
+
+    out = gzip.open(args.out, 'wb') if args.out.endswith('.gz') else open(args.out, 'wb')
+    writer = RecordWriter(out)
+    stop = threading.Event()
+    ser = serial.Serial(args.port, args.baud, timeout=0.2)
+
+    def serial_loop():
+        while not stop.is_set():
+            data = ser.read(ser.in_waiting or 1)
+            if data:
+                writer.write(CH_SERIAL, data)
+
+    def ntrip_loop():
+        host, _, rest = args.ntrip.partition(':')
+        port, _, mount = rest.partition('/')
+        creds = base64.b64encode(f"{args.user}:{args.password}".encode()).decode()
+        request = (f"GET /{mount} HTTP/1.0\r\nUser-Agent: NTRIP python\r\n"
+                   f"Authorization: Basic {creds}\r\n\r\n").encode()
+        while not stop.is_set():
+            try:
+                with socket.create_connection((host, int(port)), 10) as s:
+                    s.sendall(request)
+                    response = s.recv(1024)
+                    if b"200 OK" not in response:
+                        raise ConnectionError("risposta non valida")
+                    data = response.split(b"\r\n\r\n", 1)[1] if b"\r\n\r\n" in response else b""
+                    print("[NTRIP] connesso")
+                    while not stop.is_set():
+                        if data:
+                            writer.write(CH_NTRIP, data)
+                            ser.write(data)
+                            writer.write(CH_TO_RECEIVER, data)
+                        data = s.recv(4096)
+                        if not data:
+                            raise ConnectionError("stream chiuso")
+            except (OSError, ConnectionError) as e:
+                print(f"[NTRIP] {e}; riconnessione in 5 s")
+                stop.wait(5)
+
+    threads = [threading.Thread(target=serial_loop, daemon=True)]
+    if args.ntrip:
+        threads.append(threading.Thread(target=ntrip_loop, daemon=True))
+    for t in threads:
+        t.start()
+    print(f"[INFO] registrazione di {args.port} in {args.out} (Ctrl+C per terminare)")
+    try:
+        deadline = time.monotonic() + args.duration if args.duration else None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(1)
+            writer.flush()
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for t in threads:
+        t.join(timeout=2)
+    ser.close()
+    out.close()
+    print(f"[INFO] seriale {writer.bytes[CH_SERIAL]} B, NTRIP {writer.bytes[CH_NTRIP]} B")
+
+
+# ───────────────────────────── RIPRODUZIONE ─────────────────────────────
+class StandInCaster:
+    """Caster NTRIP locale: accetta qualunque mountpoint e credenziale."""
+
+    def __init__(self, port, host='127.0.0.1'):
+        self._srv = socket.socket()
+        self._srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._srv.bind((host, port))
+        self._srv.listen()
+        self.port = self._srv.getsockname()[1]
+        self._clients = []
+        self._lock = threading.Lock()
+        self.connected = threading.Event()
+        self.bytes_out = 0
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, addr = self._srv.accept()
+            except OSError:
+                return
+            try:
+                conn.settimeout(5)
+                conn.recv(1024)     # richiesta GET, non verificata
+                conn.sendall(b"ICY 200 OK\r\n\r\n")
+                conn.settimeout(None)
+            except OSError:
+                conn.close()
+                continue
+            print(f"[CASTER] client {addr[0]}:{addr[1]}")
+            with self._lock:
+                self._clients.append(conn)
+            self.connected.set()
+
+    def send(self, data):
+        with self._lock:
+            clients = list(self._clients)
+        for conn in clients:
+            try:
+                conn.sendall(data)
+                self.bytes_out += len(data)
+            except OSError:
+                with self._lock:
+                    self._clients.remove(conn)
+                conn.close()
+
+    def close(self):
+        self._srv.close()
+        with self._lock:
+            for conn in self._clients:
+                conn.close()
+            self._clients = []
+
+
+class PtyPort:
+    """Pseudo-tty che fa da ricevitore: si scrive dal lato master."""
+
+    def __init__(self, link=None):
+        self.master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.name = os.ttyname(self._slave)
+        self.link = link
+        if link:
+            if os.path.islink(link):
+                os.unlink(link)
+            os.symlink(self.name, link)
+        self.bytes_in = 0       # scritti dallo script verso il "ricevitore"
+        threading.Thread(target=self._drain_loop, daemon=True).start()
+
+    def _drain_loop(self):
+        # Le correzioni RTCM scritte dallo script vanno lette, o la pty si riempie
+        while True:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            self.bytes_in += len(data)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            n = os.write(self.master, view)
+            view = view[n:]
+
+    def close(self):
+        if self.link and os.path.islink(self.link):
+            os.unlink(self.link)
+        os.close(self.master)
+        os.close(self._slave)
+
+
+def replay(records, port, caster, speed=1.0):
+    """Riproduce i record: speed 1 = tempo reale, N = N volte più veloce, 0 = massimo.
+
+    Restituisce (byte seriali, secondi di registrazione, secondi impiegati).
+    """
+    start = time.monotonic()
+    serial_bytes = 0
+    first_t = None
+    last_t = 0.0
+    for t, channel, data in records:
+        if first_t is None:
+            # Un segmento centrale di una sessione non inizia da zero
+            first_t = t
+        t -= first_t
+        if speed:
+            wait = start + t / speed - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        if channel == CH_SERIAL:
+            port.write(data)
+            serial_bytes += len(data)
+        elif channel == CH_NTRIP and caster is not None:
+            caster.send(data)
+        last_t = t
+    return serial_bytes, last_t, time.monotonic() - start
+
+
+def play(args):
+    port = PtyPort(args.link)
+    caster = StandInCaster(args.caster_port) if args.caster_port is not None else None
+    print(f"[INFO] pty {port.name}" + (f" → {args.link}" if args.link else ""))
+    if caster is not None:
+        print(f"[INFO] caster NTRIP su 127.0.0.1:{caster.port}")
+    try:
+        if caster is not None and args.wait_ntrip:
+            print("[INFO] attendo il client NTRIP...")
+            caster.connected.wait()
+        time.sleep(args.start_delay)
+        rounds = 0
+        while True:
+            serial_bytes, recorded, elapsed = replay(read_records(args.recordings), port,
+                                                     caster, args.speed)
+            rounds += 1
+            print(f"[INFO] giro {rounds}: {serial_bytes} B seriali, {recorded:.1f} s registrati "
+                  f"in {elapsed:.1f} s ({recorded / elapsed if elapsed else 0:.1f}×, "
+                  f"{serial_bytes / elapsed if elapsed else 0:.0f} B/s); "
+                  f"RTCM ricevuti dallo script {port.bytes_in} B")
+            if not args.loop:
+                break
+        # Lascia allo script il tempo di consumare gli ultimi dati
+        time.sleep(args.end_delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if caster is not None:
+            caster.close()
+        port.close()
+
+
+def sessions(args):
+    for (head, session), paths in sorted(session_segments(args.directory, args.head).items()):
+        size = sum(os.path.getsize(p) for p in paths)
+        print(f"{head} {session}: {len(paths)} segmenti, {size / 1048576:.1f} MiB")
+        print(f"    python3 gnss_replay.py play {os.path.join(args.directory, head)}_{session}_*")
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Registrazione e riproduzione dei flussi GNSS')
+    sub = ap.add_subparsers(dest='command', required=True)
+
+    rec = sub.add_parser('record', help='registra seriale e NTRIP')
+    rec.add_argument('out', help='file di uscita (.gz per comprimere)')
+    rec.add_argument('--port', default='/dev/ttyACM0')
+    rec.add_argument('--baud', type=int, default=115200)
+    rec.add_argument('--ntrip', help='caster host:porta/mountpoint')
+    rec.add_argument('--user', default='')
+    rec.add_argument('--password', default='')
+    rec.add_argument('--duration', type=float, default=0.0, help='secondi (0 = fino a Ctrl+C)')
+
+    pl = sub.add_parser('play', help='riproduce su pty e caster locale')
+    pl.add_argument('recordings', nargs='+',
+                    help='registrazione, o segmenti della stessa sessione in ordine')
+    pl.add_argument('--speed', type=float, default=1.0,
+                    help='1 = tempo reale, N = N volte più veloce, 0 = massima velocità')
+    pl.add_argument('--link', help='crea un link simbolico alla pty (es. /tmp/ttyGNSS)')
+    pl.add_argument('--caster-port', type=int, default=2101,
+                    help='porta del caster locale (0 = porta libera)')
+    pl.add_argument('--no-caster', dest='caster_port', action='store_const', const=None)
+    pl.add_argument('--wait-ntrip', action='store_true',
+                    help='inizia solo quando un client si collega al caster')
+    pl.add_argument('--start-delay', type=float, default=2.0,
+                    help='secondi di attesa prima di iniziare (apertura della pty)')
+    pl.add_argument('--end-delay', type=float, default=1.0)
+    pl.add_argument('--loop', action='store_true', help='ripete la registrazione')
+
+    ss = sub.add_parser('sessions', help='elenca le sessioni registrate da mainRTK --raw-log')
+    ss.add_argument('directory', nargs='?', default='/home/pi/ippodromoScripts/logRTK')
+    ss.add_argument('--head', help='solo questa testa')
+
+    args = ap.parse_args()
+    if args.command == 'record':
+        record(args)
+    elif args.command == 'play':
+        play(args)
+    else:
+        sessions(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Flusso ?WATCH di gpsd: un report TPV per fix, appena gpsd lo produce.
+
+Invece di interrogare gpsd con gpsd.get_current() a intervalli fissi (che
+restituisce lo stesso fix più volte o lo consegna in ritardo), si tiene
+aperta una connessione TCP con ?WATCH={"enable":true,"json":true} e si
+legge riga per riga. Solo le righe TPV vengono decodificate (SKY, DEVICE
+ecc. vengono scartate senza json.loads); ogni fix viene consegnato una sola
+volta, riconosciuto dal suo orario GNSS.
+
+I report hanno gli stessi attributi usati da mainGNSS sulle risposte di
+gpsd-py3 (mode, lat, lon, alt, hspeed, get_time()) più l'orario del fix in
+secondi Unix (timestamp) e le accuratezze dichiarate dal ricevitore.
+"""
+
+import calendar
+import json
+import socket
+import time
+from datetime import datetime
+
+GPSD_HOST = "127.0.0.1"
+GPSD_PORT = 2947
+WATCH_COMMAND = b'?WATCH={"enable":true,"json":true}\n'
+
+# Formato dell'orario nei report di gpsd (come gpsd-py3)
+GPSD_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+_TPV_TAG = b'"class":"TPV"'
+
+
+def parse_gpsd_time(text):
+    """Orario ISO di gpsd → (datetime UTC senza fuso, secondi Unix).
+
+    ValueError se non interpretabile (es. secondo intercalare :60).
+    """
+    dot = text.find('.')
+    if dot < 0:
+        text = text[:-1] + '.0Z'
+    elif len(text) - dot > 8:
+        # Frazione in nanosecondi: strptime accetta al massimo i microsecondi
+        text = text[:dot + 7] + 'Z'
+    moment = datetime.strptime(text, GPSD_TIME_FORMAT)
+    return moment, calendar.timegm(moment.timetuple()) + moment.microsecond / 1e6
+
+
+class TpvReport:
+    """Un fix TPV di gpsd."""
+
+    __slots__ = ('mode', 'time', 'datetime', 'timestamp', 'lat', 'lon', 'alt',
+                 'hspeed', 'track', 'epx', 'epy', 'eph', 'device')
+
+    def __init__(self, tpv):
+        self.mode = tpv.get('mode', 0)
+        self.time = tpv['time']
+        self.datetime, self.timestamp = parse_gpsd_time(self.time)
+        self.lat = tpv.get('lat')
+        self.lon = tpv.get('lon')
+        # gpsd recenti riportano altMSL/altHAE, i vecchi solo alt
+        self.alt = tpv.get('altMSL', tpv.get('alt'))
+        self.hspeed = tpv.get('speed')      # m/s
+        self.track = tpv.get('track')       # gradi rispetto al nord
+        self.epx = tpv.get('epx')           # errori stimati (m, 95%)
+        self.epy = tpv.get('epy')
+        self.eph = tpv.get('eph')
+        self.device = tpv.get('device')
+
+    def get_time(self):
+        """Orario del fix come datetime UTC (stesso valore di gpsd-py3)."""
+        return self.datetime
+
+    def __repr__(self):
+        return (f"TpvReport({self.time} mode={self.mode} lat={self.lat} lon={self.lon} "
+                f"speed={self.hspeed})")
+
+
+class GpsdWatch:
+    """Connessione persistente a gpsd in modalità WATCH JSON."""
+
+    def __init__(self, host=GPSD_HOST, port=GPSD_PORT, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._last_time = None
+        self.reports = 0        # TPV consegnati
+        self.duplicates = 0     # TPV con orario già consegnato
+        self.no_fix = 0         # TPV senza fix (mode < 2) o senza orario
+        self.skipped = 0        # righe di altre classi
+
+    def open(self, sock=None):
+        """Si collega a gpsd (o usa sock già collegato) e attiva il WATCH."""
+        self.close()
+        if sock is None:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+        # Nessun timeout di lettura: fra un fix e l'altro il processo dorme
+        sock.settimeout(None)
+        sock.sendall(WATCH_COMMAND)
+        self._sock = sock
+        self._file = sock.makefile('rb')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._sock is not None:
+            self._sock.close()
+        self._file = None
+        self._sock = None
+
+    def __iter__(self):
+        """Genera i fix nuovi (mode >= 2) finché gpsd resta collegato.
+
+        Solleva ConnectionError se gpsd chiude la connessione.
+        """
+        readline = self._file.readline
+        while True:
+            line = readline()
+            if not line:
+                raise ConnectionError("gpsd ha chiuso la connessione")
+            if _TPV_TAG not in line:
+                self.skipped += 1
+                continue
+            report = self.parse(line)
+            if report is not None:
+                yield report
+
+    def parse(self, line):
+        """Decodifica una riga TPV; None se senza fix o già consegnata."""
+        try:
+            tpv = json.loads(line)
+        except ValueError:
+            self.skipped += 1
+            return None
+        if tpv.get('mode', 0) < 2 or 'time' not in tpv:
+            self.no_fix += 1
+            return None
+        if tpv['time'] == self._last_time:
+            # gpsd può emettere più TPV per lo stesso ciclo del ricevitore
+            self.duplicates += 1
+            return None
+        try:
+            report = TpvReport(tpv)
+        except (ValueError, TypeError):
+            # Orario non interpretabile: la riga si scarta senza fermare il flusso
+            self.skipped += 1
+            return None
+        self._last_time = tpv['time']
+        self.reports += 1
+        return report
+
+    def stats(self):
+        return (f"TPV {self.reports} duplicati {self.duplicates} senza fix {self.no_fix} "
+                f"altre righe {self.skipped}")
+
+
+def main():
+    """Stampa i fix ricevuti da gpsd (prova della connessione)."""
+    watch = GpsdWatch()
+    watch.open()
+    last = time.monotonic()
+    try:
+        for report in watch:
+            now = time.monotonic()
+            print(f"{report}  (+{(now - last) * 1000:.0f} ms)")
+            last = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watch.close()
+        print(watch.stats())
+
+
+if __name__ == "__main__":
+    main()
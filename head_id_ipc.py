@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Cambio di HEAD_ID a caldo, senza riavviare il processo GNSS.
+
+receiver_ippodromo.py invia il nuovo valore al processo in esecuzione su
+un socket Unix datagram locale (namespace astratto di Linux: nessun file
+da ripulire); il processo lo applica dal pacchetto successivo e risponde
+con una conferma. Se nessuno conferma entro il timeout (es. la testa esegue
+mainRTK.py, che non usa HEAD_ID) il valore resta soltanto nel file di
+configurazione, letto al prossimo avvio.
+
+Messaggi (JSON):
+    richiesta   {"HEAD_ID": 12}           (altre chiavi, es. "RATE", facoltative)
+    conferma    {"HEAD_ID": 12, "ok": true}
+"""
+
+import json
+import socket
+import threading
+
+# Indirizzo nel namespace astratto (inizia con NUL)
+IPC_ADDRESS = "\0ippodromo/head_id"
+
+
+class HeadIdListener:
+    """Riceve i nuovi HEAD_ID in un thread; value è sempre l'ultimo valido.
+
+    Le altre chiavi ricevute (es. "RATE") finiscono nel dizionario config.
+    """
+
+    def __init__(self, value, address=IPC_ADDRESS, on_change=None):
+        self.value = value
+        self.config = {}
+        self._address = address
+        self._on_change = on_change
+        self._sock = None
+        self.changes = 0
+
+    def start(self):
+        """Apre il socket e avvia il thread; False se un altro processo lo usa già."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind(self._address)
+        except OSError as e:
+            print(f"[IPC] HEAD_ID a caldo non disponibile: {e}")
+            sock.close()
+            return False
+        self._sock = sock
+        threading.Thread(target=self._run, daemon=True).start()
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                data, addr = self._sock.recvfrom(1024)
+            except OSError:
+                return  # socket chiuso
+            try:
+                message = json.loads(data.decode('utf-8'))
+                head_id = message.pop("HEAD_ID")
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                print(f"[IPC] messaggio non valido: {e}")
+                continue
+
+            if message:
+                # Nuovo dizionario: chi legge config non lo vede mai a metà
+                self.config = {**self.config, **message}
+                print(f"[IPC] configurazione aggiornata: {message}")
+            if head_id != self.value:
+                # Un solo assegnamento: chi legge value vede il vecchio o il nuovo
+                self.value = head_id
+                self.changes += 1
+                print(f"[IPC] HEAD_ID cambiato a {head_id}")
+                if self._on_change:
+                    self._on_change(head_id)
+            if addr:
+                try:
+                    self._sock.sendto(json.dumps({"HEAD_ID": head_id, "ok": True}).encode(), addr)
+                except OSError:
+                    pass
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def push_head_id(head_id, address=IPC_ADDRESS, timeout=2.0, **extra):
+    """Invia head_id (e le chiavi in extra) al processo in esecuzione; True se ha confermato."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        # Autobind su un indirizzo astratto, per ricevere la conferma
+        sock.bind("")
+        sock.settimeout(timeout)
+        try:
+            sock.sendto(json.dumps({"HEAD_ID": head_id, **extra}).encode(), address)
+            reply = json.loads(sock.recv(1024).decode('utf-8'))
+        except (OSError, ValueError):
+            # Nessun processo in ascolto (ConnectionRefused/FileNotFound) o timeout
+            return False
+    return reply.get("ok") is True and reply.get("HEAD_ID") == head_id
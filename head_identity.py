@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Identità e configurazione locale di una testa.
+
+get_wlan0_mac() è il MAC con cui la testa viene indirizzata nei comandi di
+gruppo (fleet_config.py) e nominata nelle registrazioni (gnss_replay.py);
+CONFIG_FILE è il config.json letto all'avvio da mainGNSS.py e aggiornato da
+receiver_ippodromo.py.
+"""
+
+import re
+import subprocess
+
+CONFIG_FILE = "/home/pi/config.json"
+
+
+def get_wlan0_mac():
+    """Ottiene il MAC address dell'interfaccia wlan0."""
+    try:
+        # Metodo 1: usando /sys/class/net/wlan0/address
+        with open('/sys/class/net/wlan0/address', 'r') as f:
+            mac = f.read().strip().replace(':', '').upper()
+            return mac
+    except FileNotFoundError:
+        pass
+
+    try:
+        # Metodo 2: usando il comando ip
+        result = subprocess.run(['ip', 'link', 'show', 'wlan0'],
+                              capture_output=True, text=True, check=True)
+        match = re.search(r'link/ether ([0-9a-f:]{17})', result.stdout)
+        if match:
+            mac = match.group(1).replace(':', '').upper()
+            return mac
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        pass
+
+    try:
+        # Metodo 3: usando ifconfig (fallback)
+        result = subprocess.run(['ifconfig', 'wlan0'],
+                              capture_output=True, text=True, check=True)
+        match = re.search(r'ether ([0-9a-f:]{17})', result.stdout)
+        if match:
+            mac = match.group(1).replace(':', '').upper()
+            return mac
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        pass
+
+    # Fallback: usa uuid.getnode() se wlan0 non è disponibile
+    import uuid
+    print("[WARNING] wlan0 non trovata, uso MAC generico")
+    return f"{uuid.getnode():012X}"
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Formati del pacchetto di posizione inviato dalle teste (testRTKNEXTER.py),
+condiviso fra la testa e il server che lo riceve.
+
+Formato ASCII (storico, ~70 byte):
+    MAC/±DD.ddddddd/±DDD.ddddddd/ss/q/vv.v/YYMMDDhhmmss[/seq/invio][/Hddd.d]\\n
+    (seq e invio, in ms Unix, solo con la tracciatura attiva; Hddd.d è la
+    direzione in gradi, solo se richiesta e nota)
+
+Formato binario v1 (26 byte, little endian):
+    magic      U1   0xB7
+    versione   U1   1
+    mac        6 byte
+    lat, lon   I4   gradi * 1e7
+    satelliti  U1
+    qualità    U1   scala GGA (4 = RTK fix, 5 = RTK float)
+    velocità   U2   cm/s
+    tow        U4   millisecondi dall'inizio della settimana (domenica 00:00 UTC)
+    sequenza   U2   contatore del pacchetto (modulo 65536)
+
+Formato binario v2 (30 byte, tracciatura attiva): v1 seguito da
+    invio      U4   ora di invio dal clock della testa, ms della settimana UTC
+
+Formati binari v3 (28 byte) e v4 (32 byte, tracciatura attiva): v1 e v2
+seguiti dalla direzione
+    direzione  U2   centesimi di grado dal nord (0xFFFF = non nota)
+
+Formato CSV di mainGNSS.py:
+    GPS,HEAD_ID,lat,lon,orario,alt,velocità m/s,rotta,cpu,ram[,seq,invio ms Unix]
+    (cpu e ram vuoti se lo stato del sistema viaggia solo nella telemetria)
+
+Telemetria di stato di mainGNSS.py (health_monitor.py), periodica:
+    HEALTH,HEAD_ID,ms Unix,cpu %,ram %,temperatura °C,throttled (hex),
+    disco libero MB,qualità wifi,segnale dBm
+    (campi vuoti se non disponibili; decode() la ignora, vedi decode_health)
+
+decode() riconosce tutti i formati; i tempi sono sempre riportati in ms
+della settimana UTC, così latenza = ricezione - tow_ms (vedi link_stats.py).
+I pacchetti reinviati dallo spool dopo un'interruzione del collegamento
+hanno il prefisso HIST, (vedi spool.py) e vengono decodificati con
+historical=True.
+"""
+
+import datetime
+import struct
+from collections import namedtuple
+
+from spool import HISTORICAL_PREFIX
+
+MAGIC = 0xB7
+VERSION = 1
+VERSION_TRACE = 2
+VERSION_HEADING = 3
+VERSION_HEADING_TRACE = 4
+
+_V1 = struct.Struct('<BB6siiBBHIH')
+_V2 = struct.Struct('<BB6siiBBHIHI')
+_V3 = struct.Struct('<BB6siiBBHIHH')
+_V4 = struct.Struct('<BB6siiBBHIHIH')
+BINARY_SIZE = _V1.size
+BINARY_TRACE_SIZE = _V2.size
+BINARY_HEADING_SIZE = _V3.size
+BINARY_HEADING_TRACE_SIZE = _V4.size
+
+# Direzione non nota nei formati v3/v4
+NO_HEADING = 0xFFFF
+
+MS_PER_DAY = 86400000
+MS_PER_WEEK = 7 * MS_PER_DAY
+
+# Il 1/1/1970 era giovedì: 4 giorni dopo l'inizio della settimana
+_UNIX_WEEK_OFFSET_MS = 4 * MS_PER_DAY
+
+# Pacchetto decodificato; seq, sent_ms (ms della settimana) e heading
+# (gradi) sono None se il pacchetto non li riporta. Per il CSV di mainGNSS
+# mac è "ID<HEAD_ID>" e satelliti/qualità sono None.
+HeadFix = namedtuple('HeadFix',
+                     'mac lat lon satellites quality speed_kmh tow_ms seq sent_ms historical '
+                     'heading',
+                     defaults=(None, False, None))
+
+HEALTH_PREFIX = b'HEALTH,'
+
+# Telemetria decodificata; i valori non disponibili sono None
+HealthReport = namedtuple('HealthReport',
+                          'head_id unix_ms cpu ram temp_c throttled disk_free_mb '
+                          'wifi_quality wifi_dbm historical', defaults=(False,))
+
+_week_day_cache = {}
+
+
+def time_of_week_ms(year, month, day, seconds_of_day):
+    """Millisecondi dall'inizio della settimana UTC (domenica 00:00)."""
+    key = (year, month, day)
+    offset = _week_day_cache.get(key)
+    if offset is None:
+        # isoweekday: lunedì = 1 ... domenica = 7
+        offset = (datetime.date(year, month, day).isoweekday() % 7) * MS_PER_DAY
+        _week_day_cache.clear()
+        _week_day_cache[key] = offset
+    return offset + int(round(seconds_of_day * 1000))
+
+
+def unix_ms_to_tow(unix_ms):
+    """Converte millisecondi Unix in millisecondi della settimana UTC."""
+    return (unix_ms + _UNIX_WEEK_OFFSET_MS) % MS_PER_WEEK
+
+
+def tow_diff_ms(later, earlier):
+    """Differenza fra due tempi della settimana, corretta a cavallo della settimana."""
+    diff = (later - earlier) % MS_PER_WEEK
+    return diff - MS_PER_WEEK if diff > MS_PER_WEEK // 2 else diff
+
+
+def _heading_field(heading):
+    if heading is None or heading != heading:   # None o NaN
+        return NO_HEADING
+    return int(round(heading * 100)) % 36000
+
+
+def encode_binary(mac, lat, lon, satellites, quality, speed_kmh, tow_ms, seq, sent_ms=None,
+                  heading=False):
+    """Pacchetto binario; mac sono i 6 byte dell'indirizzo.
+
+    Con sent_ms (ms della settimana) viene prodotto il formato v2. Con
+    heading (gradi, None se non nota) i formati v3/v4 con la direzione.
+    """
+    speed_cms = int(round(speed_kmh / 0.036))
+    if speed_cms > 0xFFFF:
+        speed_cms = 0xFFFF
+    elif speed_cms < 0:
+        speed_cms = 0
+    fields = (int(round(lat * 1e7)), int(round(lon * 1e7)),
+              min(satellites, 255), quality,
+              speed_cms, tow_ms % MS_PER_WEEK, seq & 0xFFFF)
+    if heading is False:
+        if sent_ms is None:
+            return _V1.pack(MAGIC, VERSION, mac, *fields)
+        return _V2.pack(MAGIC, VERSION_TRACE, mac, *fields, sent_ms % MS_PER_WEEK)
+    if sent_ms is None:
+        return _V3.pack(MAGIC, VERSION_HEADING, mac, *fields, _heading_field(heading))
+    return _V4.pack(MAGIC, VERSION_HEADING_TRACE, mac, *fields, sent_ms % MS_PER_WEEK,
+                    _heading_field(heading))
+
+
+def encode_ascii(mac, lat, lon, satellites, quality, speed_kmh, timestamp,
+                 seq=None, sent_unix_ms=None, heading=None):
+    """Pacchetto ASCII storico; mac è la stringa esadecimale maiuscola.
+
+    Con seq e sent_unix_ms i due campi vengono aggiunti in coda, seguiti
+    dalla direzione (Hddd.d) se heading non è None.
+    """
+    trace = f"/{seq & 0xFFFF}/{sent_unix_ms}" if seq is not None else ""
+    if heading is not None:
+        trace += f"/H{heading % 360.0:.1f}"
+    return (
+        f"{mac}/"
+        f"{lat:+09.7f}/"
+        f"{lon:+010.7f}/"
+        f"{satellites:02d}/"
+        f"{quality}/"
+        f"{speed_kmh:.1f}/"
+        f"{timestamp}{trace}\n"
+    ).encode()
+
+
+def decode(datagram):
+    """Decodifica un pacchetto binario, ASCII o CSV; None se non valido."""
+    if datagram[:len(HISTORICAL_PREFIX)] == HISTORICAL_PREFIX:
+        fix = decode(datagram[len(HISTORICAL_PREFIX):])
+        return fix._replace(historical=True) if fix is not None else None
+    size = len(datagram)
+    if size and datagram[0] == MAGIC:
+        if size < BINARY_SIZE:
+            return None  # troncato (anche senza il byte di versione)
+        version = datagram[1]
+        heading = None
+        if size == BINARY_SIZE and version == VERSION:
+            (_magic, _version, mac, lat, lon, satellites, quality, speed_cms,
+             tow_ms, seq) = _V1.unpack(datagram)
+            sent_ms = None
+        elif size == BINARY_TRACE_SIZE and version == VERSION_TRACE:
+            (_magic, _version, mac, lat, lon, satellites, quality, speed_cms,
+             tow_ms, seq, sent_ms) = _V2.unpack(datagram)
+        elif size == BINARY_HEADING_SIZE and version == VERSION_HEADING:
+            (_magic, _version, mac, lat, lon, satellites, quality, speed_cms,
+             tow_ms, seq, heading) = _V3.unpack(datagram)
+            sent_ms = None
+        elif size == BINARY_HEADING_TRACE_SIZE and version == VERSION_HEADING_TRACE:
+            (_magic, _version, mac, lat, lon, satellites, quality, speed_cms,
+             tow_ms, seq, sent_ms, heading) = _V4.unpack(datagram)
+        else:
+            return None
+        if heading is not None:
+            heading = None if heading == NO_HEADING else heading * 0.01
+        return HeadFix(mac.hex().upper(), lat * 1e-7, lon * 1e-7, satellites,
+                       quality, speed_cms * 0.036, tow_ms, seq, sent_ms, heading=heading)
+    if datagram[:4] == b'GPS,':
+        return decode_csv(datagram)
+    return decode_ascii(datagram)
+
+
+def is_health(datagram):
+    """True per la telemetria di stato (anche reinviata dallo spool)."""
+    if datagram[:len(HISTORICAL_PREFIX)] == HISTORICAL_PREFIX:
+        datagram = datagram[len(HISTORICAL_PREFIX):]
+    return datagram[:len(HEALTH_PREFIX)] == HEALTH_PREFIX
+
+
+def _optional(text, convert=float):
+    return convert(text) if text else None
+
+
+def encode_health(head_id, unix_ms, cpu, ram, temp_c, throttled, disk_free_mb,
+                  wifi_quality, wifi_dbm):
+    """Crea il pacchetto di telemetria; None = campo vuoto."""
+    fields = (cpu, ram, temp_c,
+              None if throttled is None else f"{throttled:x}",
+              disk_free_mb, wifi_quality, wifi_dbm)
+    return (f"HEALTH,{head_id},{unix_ms}," +
+            ",".join("" if v is None else str(v) for v in fields)).encode()
+
+
+def decode_health(datagram):
+    """Decodifica la telemetria di stato; None se non valida."""
+    historical = datagram[:len(HISTORICAL_PREFIX)] == HISTORICAL_PREFIX
+    if historical:
+        datagram = datagram[len(HISTORICAL_PREFIX):]
+    try:
+        fields = bytes(datagram).decode('ascii').strip().split(',')
+        if len(fields) != 10 or fields[0] != 'HEALTH':
+            return None
+        return HealthReport(fields[1], int(fields[2]), _optional(fields[3]),
+                            _optional(fields[4]), _optional(fields[5]),
+                            _optional(fields[6], lambda v: int(v, 16)),
+                            _optional(fields[7]), _optional(fields[8]),
+                            _optional(fields[9]), historical)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def decode_ascii(datagram):
+    """Decodifica il formato ASCII storico; tow_ms viene ricavato dal timestamp."""
+    try:
+        fields = bytes(datagram).decode('ascii').strip().split('/')
+        mac, lat, lon, satellites, quality, speed, ts = fields[:7]
+        tow_ms = time_of_week_ms(2000 + int(ts[0:2]), int(ts[2:4]), int(ts[4:6]),
+                                 int(ts[6:8]) * 3600 + int(ts[8:10]) * 60 + int(ts[10:12]))
+        seq = sent_ms = heading = None
+        if fields[-1][:1] == 'H':
+            heading = float(fields.pop()[1:])
+        if len(fields) >= 9:
+            seq = int(fields[7])
+            sent_ms = unix_ms_to_tow(int(fields[8]))
+        return HeadFix(mac, float(lat), float(lon), int(satellites), int(quality),
+                       float(speed), tow_ms, seq, sent_ms, heading=heading)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def decode_csv(datagram):
+    """Decodifica il pacchetto CSV di mainGNSS.py (orario gpsd in UTC)."""
+    try:
+        fields = bytes(datagram).decode('utf-8').strip().split(',')
+        if len(fields) < 7 or fields[0] != 'GPS':
+            return None
+        t = datetime.datetime.fromisoformat(fields[4].replace('Z', '+00:00'))
+        tow_ms = time_of_week_ms(t.year, t.month, t.day,
+                                 t.hour * 3600 + t.minute * 60 + t.second + t.microsecond * 1e-6)
+        try:
+            speed_kmh = float(fields[6]) * 3.6
+        except ValueError:
+            speed_kmh = 0.0
+        try:
+            heading = float(fields[7])
+        except (IndexError, ValueError):
+            heading = None      # "N/A" prima che la direzione sia nota
+        seq = sent_ms = None
+        if len(fields) >= 12:
+            seq = int(fields[10])
+            sent_ms = unix_ms_to_tow(int(fields[11]))
+        return HeadFix(f"ID{fields[1]}", float(fields[2]), float(fields[3]), None, None,
+                       speed_kmh, tow_ms, seq, sent_ms, heading=heading)
+    except (ValueError, UnicodeDecodeError):
+        return None
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Velocità e direzione stimate sugli ultimi fix, con ripiego sulla rotta del
+ricevitore a bassa velocità.
+
+I fix vengono salvati in un anello NumPy di dimensione fissa (istante e
+metri Est/Nord rispetto a un'origine locale). La velocità è la pendenza
+ai minimi quadrati di Est e Nord rispetto al tempo sui fix degli ultimi
+window secondi: usa tutti i punti e i loro istanti veri, non solo il primo
+e l'ultimo.
+
+Sotto min_speed la posizione si muove poco più del suo rumore e la
+direzione calcolata è inaffidabile: si usa allora la rotta (COG) del
+ricevitore, ricavata dal Doppler; se manca anche quella resta l'ultima
+direzione valida. La velocità usata per la soglia è quella del ricevitore
+(SOG) se disponibile, altrimenti quella stimata.
+
+Usato da mainGNSS.py (fix di gpsd) e da testRTKNEXTER.py (epoche NMEA/UBX).
+"""
+
+import math
+
+import numpy as np
+
+from track_filter import ORIGIN_RESET_M, local_scale
+
+WINDOW = 1.0            # s di fix usati per la stima
+CAPACITY = 64           # fix nell'anello (2,5 s a 25 Hz)
+MIN_POINTS = 3          # fix minimi nella finestra
+MIN_SPEED = 1.5         # m/s: sotto si usa la rotta del ricevitore
+MIN_COG_SPEED = 0.2     # m/s: sotto anche la COG è rumore, resta l'ultima direzione
+
+# Origine della direzione stimata
+SOURCE_FIT = "fit"
+SOURCE_COG = "cog"
+SOURCE_HOLD = "hold"
+
+
+class FixRing:
+    """Anello di fix (t, est, nord) in array NumPy preallocati."""
+
+    def __init__(self, capacity=CAPACITY):
+        self.t = np.full(capacity, -np.inf)
+        self.e = np.zeros(capacity)
+        self.n = np.zeros(capacity)
+        self.capacity = capacity
+        self.index = 0
+        self.count = 0
+
+    def append(self, t, e, n):
+        i = self.index
+        self.t[i] = t
+        self.e[i] = e
+        self.n[i] = n
+        self.index = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def clear(self):
+        self.t.fill(-np.inf)
+        self.index = 0
+        self.count = 0
+
+    def since(self, t0):
+        """Fix con istante >= t0 (copie, in ordine qualsiasi)."""
+        mask = self.t >= t0
+        return self.t[mask], self.e[mask], self.n[mask]
+
+
+class HeadingEstimate:
+    """Velocità (m/s), direzione (gradi dal nord, None se mai nota) e sua origine."""
+
+    __slots__ = ('speed', 'heading', 'source', 'points')
+
+    def __init__(self):
+        self.speed = None
+        self.heading = None
+        self.source = None
+        self.points = 0
+
+    def __repr__(self):
+        return (f"HeadingEstimate(speed={self.speed} heading={self.heading} "
+                f"source={self.source} points={self.points})")
+
+
+class HeadingEstimator:
+    """Stima ai minimi quadrati su una finestra temporale di fix."""
+
+    def __init__(self, window=WINDOW, capacity=CAPACITY, min_speed=MIN_SPEED,
+                 min_points=MIN_POINTS):
+        self.window = window
+        self.min_speed = min_speed
+        self.min_points = min_points
+        self.ring = FixRing(capacity)
+        self.estimate = HeadingEstimate()
+        self._last_t = None
+        self._lat0 = self._lon0 = None
+
+    def _set_origin(self, lat, lon):
+        self._lat0 = lat
+        self._lon0 = lon
+        self._m_per_deg_lat, self._m_per_deg_lon = local_scale(lat)
+        self.ring.clear()
+
+    def add(self, t, lat, lon, cog=None, sog=None):
+        """Aggiunge un fix (istante in s, gradi) e restituisce la stima aggiornata.
+
+        cog è la rotta del ricevitore in gradi, sog la sua velocità in m/s.
+        Un fix con istante già visto non viene aggiunto; un istante
+        all'indietro (riavvio, mezzanotte) svuota l'anello.
+        """
+        if self._lat0 is None:
+            self._set_origin(lat, lon)
+        if self._last_t is not None and t < self._last_t:
+            self.ring.clear()
+        if t != self._last_t:
+            e = (lon - self._lon0) * self._m_per_deg_lon
+            n = (lat - self._lat0) * self._m_per_deg_lat
+            if abs(e) > ORIGIN_RESET_M or abs(n) > ORIGIN_RESET_M:
+                self._set_origin(lat, lon)
+                e = n = 0.0
+            self.ring.append(t, e, n)
+            self._last_t = t
+        return self._update(cog, sog)
+
+    def _fit(self):
+        """(ve, vn, punti) ai minimi quadrati sulla finestra, None se pochi punti."""
+        t, e, n = self.ring.since(self._last_t - self.window)
+        points = len(t)
+        if points < self.min_points:
+            return None
+        dt = t - t.mean()
+        sxx = dt @ dt
+        if sxx <= 0.0:
+            return None
+        # Con dt centrato la somma di dt è zero: la media di e e n non serve
+        return float(dt @ e) / sxx, float(dt @ n) / sxx, points
+
+    def _update(self, cog, sog):
+        est = self.estimate
+        fit = self._fit()
+        fit_speed = None
+        if fit is not None:
+            ve, vn, est.points = fit
+            fit_speed = math.hypot(ve, vn)
+        else:
+            est.points = 0
+
+        gate_speed = sog if sog is not None else fit_speed
+        est.speed = fit_speed if fit_speed is not None else sog
+        if fit is not None and gate_speed is not None and gate_speed >= self.min_speed:
+            est.heading = math.degrees(math.atan2(ve, vn)) % 360.0
+            est.source = SOURCE_FIT
+        elif cog is not None and (sog is None or sog >= MIN_COG_SPEED):
+            est.heading = cog % 360.0
+            est.source = SOURCE_COG
+        else:
+            est.source = SOURCE_HOLD if est.heading is not None else None
+        return est
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Campionamento in background dello stato del sistema della testa.
+
+Un thread legge una volta al secondo (non ad ogni fix) CPU, RAM,
+temperatura, stato di throttling del Raspberry, spazio libero su disco e
+qualità del collegamento wifi, e tiene l'ultimo campione in memoria: chi
+invia i pacchetti legge solo i valori già pronti. Ogni report_every
+campioni viene chiamata on_report, ad esempio per inviare il pacchetto di
+telemetria (head_packet.encode_health).
+
+Fonti:
+    CPU, RAM, disco   psutil
+    temperatura       /sys/class/thermal/thermal_zone0/temp
+    throttling        /sys/devices/platform/soc/soc:firmware/get_throttled,
+                      altrimenti `vcgencmd get_throttled` (ogni THROTTLE_INTERVAL s)
+    wifi              /proc/net/wireless (qualità del link e segnale in dBm)
+"""
+
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+import psutil
+
+THERMAL_PATH = "/sys/class/thermal/thermal_zone0/temp"
+THROTTLED_PATH = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+WIRELESS_PATH = "/proc/net/wireless"
+
+# vcgencmd avvia un processo: sul Pi Zero non più di una volta ogni 10 s
+THROTTLE_INTERVAL = 10.0
+
+HealthSample = namedtuple('HealthSample',
+                          'time cpu ram temp_c throttled disk_free_mb wifi_quality wifi_dbm')
+
+
+def read_temperature():
+    """Temperatura del SoC in °C, None se non disponibile."""
+    try:
+        with open(THERMAL_PATH) as f:
+            return int(f.read()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+def read_throttled_sysfs():
+    """Bitmask di throttling dal firmware (sysfs), None se non esposta."""
+    try:
+        with open(THROTTLED_PATH) as f:
+            return int(f.read().strip(), 16)
+    except (OSError, ValueError):
+        return None
+
+
+def read_throttled_vcgencmd():
+    """Bitmask di throttling da vcgencmd ("throttled=0x50000"), None se assente."""
+    try:
+        result = subprocess.run(['vcgencmd', 'get_throttled'],
+                                capture_output=True, text=True, timeout=2)
+        return int(result.stdout.strip().split('=')[1], 16)
+    except (OSError, subprocess.SubprocessError, IndexError, ValueError):
+        return None
+
+
+def read_wireless(iface):
+    """(qualità del link, segnale dBm) di iface da /proc/net/wireless."""
+    try:
+        with open(WIRELESS_PATH) as f:
+            for line in f:
+                name, sep, rest = line.partition(':')
+                if sep and name.strip() == iface:
+                    fields = rest.split()
+                    return float(fields[1].rstrip('.')), float(fields[2].rstrip('.'))
+    except (OSError, ValueError, IndexError):
+        pass
+    return None, None
+
+
+class HealthSampler:
+    """Thread che aggiorna l'ultimo HealthSample ogni interval secondi."""
+
+    def __init__(self, interval=1.0, iface="wlan0", disk_path="/",
+                 on_report=None, report_every=5):
+        self.interval = interval
+        self.iface = iface
+        self.disk_path = disk_path
+        self.on_report = on_report
+        self.report_every = report_every
+        self.sample = HealthSample(None, None, None, None, None, None, None, None)
+        self.samples = 0
+        self._use_sysfs = read_throttled_sysfs() is not None
+        self._throttled = None
+        self._throttled_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # La prima lettura di cpu_percent() fa da riferimento (restituisce 0)
+        psutil.cpu_percent()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def _read_throttled(self, now):
+        if self._use_sysfs:
+            return read_throttled_sysfs()
+        if now - self._throttled_at >= THROTTLE_INTERVAL:
+            self._throttled = read_throttled_vcgencmd()
+            self._throttled_at = now
+        return self._throttled
+
+    def read(self):
+        """Legge subito un campione completo (chiamato dal thread)."""
+        now = time.time()
+        try:
+            disk_free_mb = round(psutil.disk_usage(self.disk_path).free / 1048576, 1)
+        except OSError:
+            disk_free_mb = None
+        quality, dbm = read_wireless(self.iface) if self.iface else (None, None)
+        return HealthSample(now, psutil.cpu_percent(), psutil.virtual_memory().percent,
+                            read_temperature(), self._read_throttled(now),
+                            disk_free_mb, quality, dbm)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                # Assegnazione unica: i lettori vedono sempre un campione intero
+                self.sample = self.read()
+            except Exception as e:
+                print(f"[HEALTH] errore campionamento: {e}")
+                continue
+            self.samples += 1
+            if self.on_report is not None and self.samples % self.report_every == 0:
+                try:
+                    self.on_report(self.sample)
+                except Exception as e:
+                    print(f"[HEALTH] errore invio telemetria: {e}")
+
+
+def main():
+    """Stampa lo stato del sistema una volta al secondo."""
+    sampler = HealthSampler(on_report=print, report_every=1)
+    sampler.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sampler.stop()
+
+
+if __name__ == "__main__":
+    main()
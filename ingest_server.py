@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Server di riferimento per la ricezione dei pacchetti di posizione delle teste.
+
+Riceve su UDP (porte 3131 e 4141 di default) i pacchetti di testRTKNEXTER
+(ASCII o binario) e di mainGNSS (CSV), decodificati con head_packet.decode,
+e tiene l'ultimo stato di ogni testa in una tabella NumPy preallocata
+(array strutturato, una riga per MAC con indice MAC → riga).
+
+I socket vengono letti dal loop asyncio con add_reader: ad ogni risveglio
+si svuota il socket a blocchi, invece di un callback per datagramma.
+Ogni aggiornamento di riga incrementa la versione della tabella: i
+consumatori chiedono l'istantanea completa oppure solo le righe cambiate
+dopo una certa versione.
+
+Interfaccia per i consumatori (TCP, porta 3200 di default, righe di testo,
+risposte JSON su una riga):
+    SNAPSHOT            tutte le teste
+    HEALTH              ultima telemetria di stato di ogni testa (mainGNSS)
+    DELTA <versione>    teste cambiate dopo <versione>
+    WATCH <secondi>     DELTA inviato periodicamente finché la connessione è aperta
+Risposta: {"version": N, "heads": [{"mac": ..., "lat": ..., ...}, ...]}
+
+Uso:
+    python3 ingest_server.py [--ports 3131 4141] [--api-port 3200]
+"""
+
+import argparse
+import asyncio
+import json
+import signal
+import socket
+import time
+
+import numpy as np
+
+from head_packet import decode, decode_health, tow_diff_ms
+
+HEAD_DTYPE = np.dtype([
+    ('mac', 'U12'),
+    ('lat', 'f8'),
+    ('lon', 'f8'),
+    ('speed_kmh', 'f4'),
+    ('heading', 'f4'),      # gradi dal nord, NaN se il pacchetto non la riporta
+    ('satellites', 'i2'),   # -1 se il formato non lo riporta (CSV)
+    ('quality', 'i2'),      # -1 se il formato non lo riporta (CSV)
+    ('tow_ms', 'i8'),       # tempo GNSS del fix, ms della settimana UTC
+    ('seq', 'i4'),          # -1 senza sequenza
+    ('received', 'f8'),     # ora di ricezione (Unix, s)
+    ('packets', 'u8'),      # pacchetti in tempo reale ricevuti
+    ('historical', 'u8'),   # pacchetti storici (spool) ricevuti
+    ('version', 'u8'),      # versione della tabella all'ultimo aggiornamento
+])
+
+# Massimi delle colonne i2 (satelliti, qualità) e i4 (sequenza)
+I2_MAX = np.iinfo(np.int16).max
+I4_MAX = np.iinfo(np.int32).max
+
+# Datagrammi letti al massimo per ogni risveglio di un socket
+RECV_BATCH = 256
+
+
+class HeadTable:
+    """Ultimo stato di ogni testa in un array strutturato preallocato."""
+
+    def __init__(self, capacity=1024):
+        self.rows = np.zeros(capacity, dtype=HEAD_DTYPE)
+        self.index = {}         # MAC → riga
+        self.count = 0
+        self.version = 0
+        self.stale = 0          # pacchetti più vecchi dello stato già presente
+        self._tow = []          # copia Python di tow_ms per il confronto veloce
+
+    def _add(self, mac):
+        if self.count == len(self.rows):
+            # Capacità esaurita: si raddoppia (raro, una volta per flotta)
+            self.rows = np.concatenate([self.rows, np.zeros(len(self.rows), dtype=HEAD_DTYPE)])
+        row = self.count
+        self.count += 1
+        self.index[mac] = row
+        self._tow.append(None)
+        return row
+
+    def update(self, fix, received):
+        """Applica un pacchetto decodificato (HeadFix); False se scartato.
+
+        Valori fuori dal campo delle colonne intere sollevano OverflowError
+        prima di qualunque modifica alla tabella.
+        """
+        satellites = -1 if fix.satellites is None else fix.satellites
+        quality = -1 if fix.quality is None else fix.quality
+        seq = -1 if fix.seq is None else fix.seq
+        if not (-1 <= satellites <= I2_MAX and -1 <= quality <= I2_MAX and -1 <= seq <= I4_MAX):
+            raise OverflowError(f"{fix.mac}: satelliti {satellites}, qualità {quality}, "
+                                f"sequenza {seq} fuori dal campo della tabella")
+        row = self.index.get(fix.mac)
+        if row is None:
+            row = self._add(fix.mac)
+        rows = self.rows
+        if fix.historical:
+            # Lo stato è quello in tempo reale: gli storici si contano soltanto
+            rows['historical'][row] += 1
+            return False
+        last_tow = self._tow[row]
+        if last_tow is not None and tow_diff_ms(fix.tow_ms, last_tow) < 0:
+            self.stale += 1
+            return False
+
+        self.version += 1
+        self._tow[row] = fix.tow_ms
+        packets = rows['packets'][row] + 1
+        rows[row] = (fix.mac, fix.lat, fix.lon, fix.speed_kmh,
+                     np.nan if fix.heading is None else fix.heading,
+                     satellites, quality, fix.tow_ms, seq,
+                     received, packets, rows['historical'][row], self.version)
+        return True
+
+    def snapshot(self):
+        """Copia di tutte le righe valide."""
+        return self.rows[:self.count].copy()
+
+    def delta(self, since):
+        """Copia delle righe aggiornate dopo la versione since."""
+        rows = self.rows[:self.count]
+        return rows[rows['version'] > since].copy()
+
+
+def rows_to_dicts(rows):
+    names = rows.dtype.names
+    # NaN (direzione assente) non è JSON valido: diventa null
+    return [{name: None if value != value else value for name, value in zip(names, values)}
+            for values in rows.tolist()]
+
+
+class IngestServer:
+    """Ricezione UDP sul loop asyncio e tabella delle teste."""
+
+    def __init__(self, table, bind="0.0.0.0", ports=(3131, 4141)):
+        self.table = table
+        self.bind = bind
+        self.ports = ports
+        self.socks = []
+        self.received = 0
+        self.invalid = 0
+        self.batches = 0
+        self.health = {}        # HEAD_ID → ultimo HealthReport
+
+    def start(self, loop):
+        for port in self.ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+            sock.bind((self.bind, port))
+            sock.setblocking(False)
+            self.socks.append(sock)
+            loop.add_reader(sock.fileno(), self._on_readable, sock)
+
+    def _on_readable(self, sock):
+        now = time.time()
+        update = self.table.update
+        n = 0
+        while n < RECV_BATCH:
+            try:
+                data = sock.recv(2048)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                print(f"[UDP] errore ricezione: {e}")
+                break
+            n += 1
+            fix = decode(data)
+            if fix is None:
+                report = decode_health(data)
+                if report is None:
+                    self.invalid += 1
+                elif not report.historical:
+                    self.health[report.head_id] = report
+                continue
+            try:
+                update(fix, now)
+            except (OverflowError, ValueError, TypeError):
+                # Valori non rappresentabili nelle colonne: datagramma scartato
+                self.invalid += 1
+        self.received += n
+        self.batches += 1
+
+    def close(self, loop):
+        for sock in self.socks:
+            loop.remove_reader(sock.fileno())
+            sock.close()
+        self.socks = []
+
+    def stats(self):
+        avg = self.received / self.batches if self.batches else 0.0
+        return (f"teste {self.table.count} pacchetti {self.received} non validi {self.invalid} "
+                f"fuori ordine {self.table.stale} versione {self.table.version} "
+                f"datagrammi/risveglio {avg:.1f}")
+
+
+def _reply(table, rows):
+    return (json.dumps({"version": table.version, "heads": rows_to_dicts(rows)}) + "\n").encode()
+
+
+async def handle_consumer(table, reader, writer, health=None):
+    """Una connessione di un consumatore: SNAPSHOT, DELTA, WATCH o HEALTH."""
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            cmd, _, arg = line.decode('ascii', errors='replace').strip().partition(' ')
+            cmd = cmd.upper()
+            if cmd == "SNAPSHOT":
+                writer.write(_reply(table, table.snapshot()))
+            elif cmd == "DELTA":
+                writer.write(_reply(table, table.delta(int(arg or 0))))
+            elif cmd == "WATCH":
+                interval = float(arg or 1.0)
+                since = 0
+                while True:
+                    version = table.version
+                    writer.write(_reply(table, table.delta(since)))
+                    await writer.drain()
+                    since = version
+                    await asyncio.sleep(interval)
+            elif cmd == "HEALTH":
+                reports = [r._asdict() for r in (health or {}).values()]
+                writer.write((json.dumps({"health": reports}) + "\n").encode())
+            else:
+                writer.write(b'{"error": "comando sconosciuto"}\n')
+            await writer.drain()
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run_server(bind, ports, api_port, interval=10.0, duration=0.0, table=None):
+    """Avvia ricezione UDP e interfaccia consumatori; restituisce il server a fine corsa."""
+    loop = asyncio.get_running_loop()
+    table = table if table is not None else HeadTable()
+    server = IngestServer(table, bind, ports)
+    server.start(loop)
+
+    api = None
+    if api_port:
+        api = await asyncio.start_server(
+            lambda r, w: handle_consumer(table, r, w, server.health), bind, api_port)
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    if duration:
+        loop.call_later(duration, stop.set)
+
+    print(f"[INFO] UDP {bind} porte {' '.join(map(str, ports))}"
+          + (f", consumatori TCP {api_port}" if api_port else ""))
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), interval if interval else None)
+        except asyncio.TimeoutError:
+            print(f"[INFO] {server.stats()}")
+
+    server.close(loop)
+    if api is not None:
+        api.close()
+        await api.wait_closed()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Server di ricezione dei pacchetti delle teste')
+    ap.add_argument('--bind', default='0.0.0.0')
+    ap.add_argument('--ports', type=int, nargs='+', default=[3131, 4141])
+    ap.add_argument('--api-port', type=int, default=3200, help='porta TCP per i consumatori (0 = nessuna)')
+    ap.add_argument('--interval', type=float, default=10.0, help='secondi fra le statistiche')
+    args = ap.parse_args()
+
+    server = asyncio.run(run_server(args.bind, args.ports, args.api_port, args.interval))
+    print(f"[INFO] {server.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Misura di perdite e latenza sul collegamento fra le teste e il server.
+
+Riceve i pacchetti di posizione sulle porte UDP indicate (testRTKNEXTER:
+ASCII o binario, mainGNSS: CSV; vedi head_packet.py) e per ogni testa
+calcola pacchetti persi, duplicati, fuori ordine e l'istogramma della
+latenza rispetto al tempo GNSS del fix. Se la testa invia anche l'ora di
+invio (tracciatura attiva) viene misurata a parte la latenza di rete.
+
+Perdite, duplicati e ordine richiedono la sequenza nel pacchetto
+(CONFIG["packet_trace"] o formato binario su testRTKNEXTER, TRACE_FLAG su
+mainGNSS). Le latenze assumono clock sincronizzati (NTP/PPS) fra testa e
+server: valori negativi indicano uno sfasamento degli orologi. I
+pacchetti storici reinviati dallo spool vengono solo contati: le loro
+sequenze sono di molto indietro rispetto a quelle in tempo reale e
+sembrerebbero riavvii della testa. Il pacchetto ASCII riporta l'orario
+del fix al secondo, quindi la sua latenza GNSS è sovrastimata fino a 1 s.
+
+Uso:
+    python3 link_stats.py [--ports 3131 4141] [--interval 10] [--histogram]
+"""
+
+import argparse
+import bisect
+import select
+import socket
+import time
+from collections import deque
+
+from head_packet import decode, is_health, tow_diff_ms, unix_ms_to_tow
+
+# Limiti superiori dei bucket dell'istogramma di latenza (ms)
+LATENCY_EDGES_MS = (10, 20, 50, 100, 200, 500, 1000, 2000)
+
+# Sequenze ricordate per riconoscere i duplicati
+SEQ_WINDOW = 1024
+
+# Salto di sequenza oltre il quale si assume un riavvio della testa
+SEQ_RESTART_GAP = 1000
+
+
+class LatencyHistogram:
+    """Istogramma a bucket fissi delle latenze in ms."""
+
+    def __init__(self, edges=LATENCY_EDGES_MS):
+        self.edges = edges
+        self.counts = [0] * (len(edges) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.negative = 0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(self.edges, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if self.min is None or ms < self.min:
+            self.min = ms
+        if self.max is None or ms > self.max:
+            self.max = ms
+        if ms < 0:
+            self.negative += 1
+
+    def percentile(self, p):
+        """Limite superiore (ms) del bucket che contiene il percentile p (0-100)."""
+        if not self.count:
+            return None
+        target = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n:
+                return self.edges[i] if i < len(self.edges) else self.max
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return "nessun dato"
+        text = (f"media {self.total / self.count:.0f} p50 ≤{self.percentile(50)} "
+                f"p99 ≤{self.percentile(99)} max {self.max} ms")
+        if self.negative:
+            text += f" (negative {self.negative}: orologi non allineati?)"
+        return text
+
+    def lines(self, width=40):
+        """Righe di testo con l'istogramma a barre."""
+        peak = max(self.counts) or 1
+        out = []
+        low = "-∞" if self.min is not None and self.min < 0 else "0"
+        for i, n in enumerate(self.counts):
+            high = f"{self.edges[i]}" if i < len(self.edges) else "∞"
+            bar = "#" * (n * width // peak)
+            out.append(f"  {low:>5}-{high:<5} ms {n:8d} {bar}")
+            low = high
+        return out
+
+
+class SourceStats:
+    """Statistiche di una singola testa (MAC o HEAD_ID)."""
+
+    def __init__(self, window=SEQ_WINDOW):
+        self.received = 0
+        self.unique = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.restarts = 0
+        self.historical = 0
+        self.gnss_latency = LatencyHistogram()   # ricezione - tempo GNSS del fix
+        self.link_latency = LatencyHistogram()   # ricezione - ora di invio
+        self._window = window
+        self._seen = set()
+        self._order = deque()
+        self._first = None
+        self._highest = None
+        self._lost_before = 0   # perdite accumulate prima dell'ultimo riavvio
+        self._unique_before = 0
+
+    def add(self, fix, arrival_tow):
+        """Registra un pacchetto decodificato ricevuto all'istante arrival_tow."""
+        self.received += 1
+        if fix.historical:
+            # Fuori dalle sequenze in tempo reale e dalle latenze
+            self.historical += 1
+            return
+        if fix.seq is not None and not self._track(fix.seq):
+            return
+        self.gnss_latency.add(tow_diff_ms(arrival_tow, fix.tow_ms))
+        if fix.sent_ms is not None:
+            self.link_latency.add(tow_diff_ms(arrival_tow, fix.sent_ms))
+
+    def _track(self, seq):
+        """Aggiorna i contatori di sequenza; False se il pacchetto è un duplicato."""
+        if self._highest is None:
+            self._first = self._highest = seq
+            useq = seq
+        else:
+            # Sequenza a 16 bit riportata sulla scala continua
+            diff = (seq - self._highest) & 0xFFFF
+            if diff >= 0x8000:
+                diff -= 0x10000
+            if abs(diff) > SEQ_RESTART_GAP:
+                self._restart(seq)
+                useq = seq
+            else:
+                useq = self._highest + diff
+
+        if useq in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(useq)
+        self._order.append(useq)
+        if len(self._order) > self._window:
+            self._seen.discard(self._order.popleft())
+
+        if useq < self._highest:
+            self.reordered += 1
+            if useq < self._first:
+                self._first = useq
+        else:
+            self._highest = useq
+        self.unique += 1
+        return True
+
+    def _restart(self, seq):
+        self.restarts += 1
+        self._lost_before = self.lost
+        self._unique_before = self.unique
+        self._seen.clear()
+        self._order.clear()
+        self._first = self._highest = seq
+
+    @property
+    def lost(self):
+        if self._highest is None:
+            return 0
+        unique = self.unique - self._unique_before
+        return self._lost_before + (self._highest - self._first + 1) - unique
+
+    def summary(self):
+        text = f"ricevuti {self.received}"
+        if self._highest is not None:
+            expected = self.lost + self.unique
+            loss = 100.0 * self.lost / expected if expected else 0.0
+            text += (f" persi {self.lost} ({loss:.2f}%) duplicati {self.duplicates}"
+                     f" fuori ordine {self.reordered}")
+            if self.restarts:
+                text += f" riavvii {self.restarts}"
+        if self.historical:
+            text += f" storici {self.historical}"
+        return text
+
+
+class LinkStats:
+    """Raccoglie le statistiche per tutte le teste."""
+
+    def __init__(self):
+        self.sources = {}
+        self.invalid = 0
+        self.health = 0         # telemetria HEALTH (non è un fix)
+
+    def ingest(self, datagram, arrival_unix_ms):
+        """Decodifica un datagramma; restituisce il HeadFix o None se non valido."""
+        fix = decode(datagram)
+        if fix is None:
+            if is_health(datagram):
+                self.health += 1
+            else:
+                self.invalid += 1
+            return None
+        stats = self.sources.get(fix.mac)
+        if stats is None:
+            stats = self.sources[fix.mac] = SourceStats()
+        stats.add(fix, unix_ms_to_tow(arrival_unix_ms))
+        return fix
+
+    def report(self, histogram=False):
+        lines = []
+        for mac in sorted(self.sources):
+            s = self.sources[mac]
+            lines.append(f"[{mac}] {s.summary()}")
+            lines.append(f"    GNSS→server {s.gnss_latency.summary()}")
+            if histogram:
+                lines.extend(s.gnss_latency.lines())
+            if s.link_latency.count:
+                lines.append(f"    rete        {s.link_latency.summary()}")
+                if histogram:
+                    lines.extend(s.link_latency.lines())
+        if self.invalid:
+            lines.append(f"pacchetti non validi: {self.invalid}")
+        if self.health:
+            lines.append(f"telemetria HEALTH: {self.health}")
+        return "\n".join(lines) if lines else "nessun pacchetto ricevuto"
+
+
+def open_sockets(bind, ports):
+    socks = []
+    for port in ports:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        s.bind((bind, port))
+        socks.append(s)
+    return socks
+
+
+def serve(stats, socks, duration=0.0, interval=10.0, histogram=False):
+    """Riceve dai socket fino a duration secondi (0 = per sempre)."""
+    start = last_report = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if duration and now - start >= duration:
+            break
+        ready, _, _ = select.select(socks, [], [], 0.5)
+        for s in ready:
+            # Svuota il socket: più datagrammi per ogni risveglio
+            while True:
+                try:
+                    data = s.recv(2048, socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    break
+                stats.ingest(data, int(time.time() * 1000))
+        if interval and now - last_report >= interval:
+            print(stats.report(histogram))
+            print()
+            last_report = now
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Perdite e latenza dei pacchetti delle teste')
+    ap.add_argument('--bind', default='0.0.0.0')
+    ap.add_argument('--ports', type=int, nargs='+', default=[3131, 4141])
+    ap.add_argument('--interval', type=float, default=10.0, help='secondi fra i report')
+    ap.add_argument('--duration', type=float, default=0.0, help='secondi di misura (0 = infinito)')
+    ap.add_argument('--histogram', action='store_true', help='stampa gli istogrammi')
+    args = ap.parse_args()
+
+    stats = LinkStats()
+    socks = open_sockets(args.bind, args.ports)
+    print(f"[INFO] in ascolto su {args.bind} porte {' '.join(map(str, args.ports))}")
+    try:
+        serve(stats, socks, args.duration, args.interval, args.histogram)
+    except KeyboardInterrupt:
+        pass
+    print(stats.report(histogram=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Scrittura dei log in background, compressa, a segmenti orari.
+
+Chi produce i dati (il loop GNSS) chiama soltanto write()/write_line(),
+che accodano in memoria senza mai toccare la SD. Un thread raccoglie la
+coda ogni flush_interval secondi (o prima, oltre flush_bytes), la comprime
+in un frame indipendente (membro gzip o frame zstd) e lo aggiunge al
+segmento corrente, il cui nome deriva dall'ora (name_format, strftime).
+
+Memoria limitata: se la SD si blocca la coda non cresce oltre max_age
+secondi né oltre max_bytes; i dati più vecchi vengono scartati e contati
+in dropped.
+
+fsync (la scrittura sulla SD vera e propria, lenta e che la consuma):
+    "always"    dopo ogni frame
+    "interval"  al massimo ogni fsync_interval secondi (default)
+    "rotate"    solo alla chiusura di un segmento
+    "never"     lasciato al sistema operativo
+
+Dopo una mancanza di corrente l'ultimo frame può essere scritto a metà:
+all'avvio, e prima di aggiungere frame a un segmento esistente, il
+segmento viene riletto frame per frame e troncato dopo l'ultimo completo.
+Ogni frame contiene righe intere, quindi il log recuperato resta leggibile
+con zcat/zstdcat o con `python3 log_writer.py cat`. Con header ogni
+segmento nuovo inizia con quei byte (es. l'intestazione delle registrazioni
+binarie di gnss_replay.py, scritte con write() invece che a righe).
+
+zstd richiede il modulo zstandard (pip3 install zstandard), gzip no.
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_GZIP = "gzip"
+CODEC_ZSTD = "zstd"
+CODEC_NONE = None
+
+EXTENSIONS = {CODEC_GZIP: ".log.gz", CODEC_ZSTD: ".log.zst", CODEC_NONE: ".log"}
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_ROTATE = "rotate"
+FSYNC_NEVER = "never"
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_ROTATE, FSYNC_NEVER)
+
+# Errori di decompressione di un frame corrotto
+DECOMPRESS_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+# Blocchi letti durante la scansione dei frame
+_SCAN_CHUNK = 64 * 1024
+
+
+# ───────────────────────────── LETTURA E RECUPERO ─────────────────────────────
+def detect_codec(path):
+    """Codec del file dai primi byte (CODEC_NONE se non compresso o vuoto)."""
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    if head[:2] == GZIP_MAGIC:
+        return CODEC_GZIP
+    if head == ZSTD_MAGIC:
+        return CODEC_ZSTD
+    return CODEC_NONE
+
+
+def _decompressor(codec):
+    if codec == CODEC_GZIP:
+        return zlib.decompressobj(wbits=31)
+    if zstandard is None:
+        raise RuntimeError("modulo zstandard non installato (pip3 install zstandard)")
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def scan_frames(path, codec=None):
+    """Genera (fine del frame nel file, dati decompressi) per ogni frame completo.
+
+    Si ferma al primo frame incompleto o corrotto: la fine dell'ultimo frame
+    generato è la lunghezza valida del file. Un file non compresso è un
+    unico frame fino all'ultimo a capo.
+    """
+    codec = codec or detect_codec(path)
+    with open(path, 'rb') as f:
+        if codec == CODEC_NONE:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end:
+                yield end, data[:end]
+            return
+
+        pos = 0             # inizio del frame corrente nel file
+        d = _decompressor(codec)
+        out = []
+        fed = 0             # byte del frame corrente già passati al decompressore
+        while True:
+            chunk = f.read(_SCAN_CHUNK)
+            if not chunk:
+                return      # file finito (o frame troncato: scartato)
+            while chunk:
+                try:
+                    out.append(d.decompress(chunk))
+                except DECOMPRESS_ERRORS:
+                    return          # frame corrotto
+                if not d.eof:
+                    fed += len(chunk)
+                    break
+                rest = d.unused_data
+                pos += fed + len(chunk) - len(rest)
+                yield pos, b''.join(out)
+                d = _decompressor(codec)
+                out = []
+                fed = 0
+                chunk = rest
+
+
+def read_segment(path):
+    """Contenuto decompresso dei frame completi del segmento."""
+    return b''.join(data for _end, data in scan_frames(path))
+
+
+def recover_segment(path, codec=None):
+    """Tronca il segmento dopo l'ultimo frame completo; restituisce i byte tolti."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+    valid = 0
+    for valid, _data in scan_frames(path, codec):
+        pass
+    if valid < size:
+        with open(path, 'r+b') as f:
+            f.truncate(valid)
+            os.fsync(f.fileno())
+    return size - valid
+
+
+# ───────────────────────────── SCRITTURA ─────────────────────────────
+class LogWriter:
+    """Coda in memoria limitata + thread che comprime e scrive i segmenti."""
+
+    def __init__(self, directory, codec=CODEC_GZIP, name_format="%Y%m%d_%H",
+                 flush_interval=15.0, flush_bytes=256 * 1024,
+                 max_age=120.0, max_bytes=4 * 1024 * 1024,
+                 fsync=FSYNC_INTERVAL, fsync_interval=60.0, level=None,
+                 extension=None, header=None):
+        if codec not in EXTENSIONS:
+            raise ValueError(f"codec non supportato: {codec}")
+        if codec == CODEC_ZSTD and zstandard is None:
+            raise ValueError("codec zstd: modulo zstandard non installato (pip3 install zstandard)")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"politica fsync non valida: {fsync}")
+        if flush_interval >= max_age:
+            raise ValueError("flush_interval deve essere minore di max_age")
+        self.directory = directory
+        self.codec = codec
+        self.name_format = name_format
+        self.extension = extension or EXTENSIONS[codec]
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.header = header    # byte scritti all'inizio di ogni segmento nuovo
+
+        if codec == CODEC_GZIP:
+            level = 6 if level is None else level
+            self._compress = lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+        elif codec == CODEC_ZSTD:
+            self._compress = zstandard.ZstdCompressor(level=3 if level is None else level).compress
+        else:
+            self._compress = bytes
+
+        self._queue = deque()   # (istante monotonic, bytes)
+        self._queued = 0        # byte in coda
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._file = None
+        self._path = None
+        self._last_fsync = time.monotonic()
+
+        self.written = 0        # byte (non compressi) scritti
+        self.compressed = 0     # byte scritti su disco
+        self.frames = 0
+        self.dropped = 0        # righe/blocchi scartati per coda piena
+        self.errors = 0
+        self.recovered = 0      # byte di coda troncati all'avvio
+
+    # ───── produttore (non blocca mai sulla SD) ─────
+    def write(self, data):
+        """Accoda un blocco di byte (copiato se è una memoryview)."""
+        if type(data) is not bytes:
+            data = bytes(data)
+        now = time.monotonic()
+        with self._lock:
+            queue = self._queue
+            queue.append((now, data))
+            self._queued += len(data)
+            # Limite di memoria: se il thread non riesce a scrivere si perde il più vecchio
+            while queue and (self._queued > self.max_bytes or now - queue[0][0] > self.max_age):
+                _t, old = queue.popleft()
+                self._queued -= len(old)
+                self.dropped += 1
+            if self._queued >= self.flush_bytes:
+                self._wake.set()
+
+    def write_line(self, line):
+        """Accoda una riga (str, bytes o memoryview senza a capo)."""
+        if isinstance(line, str):
+            self.write(line.encode('utf-8') + b'\n')
+        else:
+            self.write(b''.join((line, b'\n')))
+
+    # ───── thread di scrittura ─────
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover_latest()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Scrive quanto resta in coda, sincronizza e chiude il segmento."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10.0)
+            self._thread = None
+        self._flush_queue()
+        self._close_file()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush_queue()
+
+    def _take(self):
+        with self._lock:
+            if not self._queue:
+                return None
+            batch = self._queue
+            self._queue = deque()
+            self._queued = 0
+        return batch
+
+    def _requeue(self, batch):
+        """Rimette in testa un blocco non scritto (resta valido il limite di memoria)."""
+        with self._lock:
+            batch.extend(self._queue)
+            self._queue = batch
+            self._queued = sum(len(data) for _t, data in batch)
+            now = time.monotonic()
+            while batch and (self._queued > self.max_bytes or now - batch[0][0] > self.max_age):
+                _t, old = batch.popleft()
+                self._queued -= len(old)
+                self.dropped += 1
+
+    def _flush_queue(self):
+        batch = self._take()
+        if batch is None:
+            return
+        data = b''.join(data for _t, data in batch)
+        try:
+            f = self._segment(datetime.now().strftime(self.name_format) + self.extension)
+            if self.header is not None and f.tell() == 0:
+                data = self.header + data
+            frame = self._compress(data)
+            f.write(frame)
+        except OSError as e:
+            # SD piena o in errore: si riprova al giro successivo con un file nuovo
+            self.errors += 1
+            print(f"[LOG] errore scrittura {self._path}: {e}")
+            self._close_file(sync=False)
+            self._requeue(batch)
+            return
+        self.frames += 1
+        self.written += len(data)
+        self.compressed += len(frame)
+        self._maybe_fsync()
+
+    # ───── segmenti ─────
+    def _segment(self, name):
+        """File aperto del segmento name (ruota se l'ora è cambiata)."""
+        path = os.path.join(self.directory, name)
+        if path == self._path and self._file is not None:
+            return self._file
+        self._close_file()
+        created = not os.path.exists(path)
+        if not created:
+            self.recovered += recover_segment(path, self.codec)
+        # Senza buffer: ogni frame va al sistema operativo in una sola write
+        self._file = open(path, 'ab', buffering=0)
+        self._path = path
+        if created and self.fsync != FSYNC_NEVER:
+            self._fsync_dir()
+        return self._file
+
+    def _recover_latest(self):
+        """Sistema la coda del segmento più recente (l'unico che può essere a metà)."""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(self.extension)]
+        except OSError:
+            return
+        if not names:
+            return
+        path = max((os.path.join(self.directory, n) for n in names), key=os.path.getmtime)
+        try:
+            lost = recover_segment(path, self.codec)
+        except (OSError, RuntimeError) as e:
+            print(f"[LOG] recupero di {path} non riuscito: {e}")
+            return
+        self.recovered += lost
+        if lost:
+            print(f"[LOG] {path}: troncati {lost} byte di un frame incompleto")
+
+    def _maybe_fsync(self):
+        if self.fsync == FSYNC_ALWAYS:
+            self._sync()
+        elif self.fsync == FSYNC_INTERVAL:
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._last_fsync = time.monotonic()
+        try:
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            self.errors += 1
+            print(f"[LOG] errore fsync {self._path}: {e}")
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    def _close_file(self, sync=True):
+        f = self._file
+        if f is None:
+            return
+        self._file = None
+        try:
+            if sync and self.fsync != FSYNC_NEVER:
+                os.fsync(f.fileno())
+            f.close()
+        except OSError as e:
+            self.errors += 1
+            print(f"[LOG] errore chiusura {self._path}: {e}")
+
+    def stats(self):
+        ratio = self.compressed / self.written * 100 if self.written else 0
+        return (f"log {self.written} B in {self.frames} frame ({ratio:.0f}%), "
+                f"{self._queued} B in coda, {self.dropped} scartati, {self.errors} errori")
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Lettura e recupero dei segmenti di log compressi')
+    sub = ap.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('cat', help='stampa i frame completi dei segmenti')
+    p.add_argument('paths', nargs='+')
+    p = sub.add_parser('recover', help='tronca i segmenti dopo l\'ultimo frame completo')
+    p.add_argument('paths', nargs='+')
+    args = ap.parse_args()
+
+    for path in args.paths:
+        if args.command == 'cat':
+            for _end, data in scan_frames(path):
+                sys.stdout.buffer.write(data)
+        else:
+            lost = recover_segment(path)
+            print(f"{path}: {'troncati ' + str(lost) + ' byte' if lost else 'integro'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,246 @@
 import subprocess
 import gpsd
 import time
-import socket
-import math
 import json
-import psutil
-from filterpy.kalman import KalmanFilter
-import numpy as np
-import os
-from datetime import datetime
 
-# Flag per l'utilizzo del filtro Kalman
+from gpsd_watch import GpsdWatch, parse_gpsd_time
+from head_id_ipc import HeadIdListener
+from head_identity import CONFIG_FILE
+from heading_estimator import HeadingEstimator
+from head_packet import encode_health
+from health_monitor import HealthSampler
+from log_writer import LogWriter
+from track_filter import TrackFilter
+from udp_fanout import UdpFanout
+
+# Flag per l'utilizzo del filtro Kalman (track_filter.py): posizione, velocità
+# e direzione filtrate nel piano locale in metri. Disattivato non costa nulla.
 KALMAN_FLAG = False
 
+# Rapporto fra l'errore stimato da gpsd (epx/epy, circa 95%) e la deviazione
+# standard usata come rumore di misura del filtro
+EP_TO_SIGMA = 0.5
+
+# Flag per aggiungere al pacchetto sequenza e ora di invio in ms (misura
+# di perdite e latenza con link_stats.py)
+TRACE_FLAG = False
+
+# Flag per ricevere i fix dal flusso ?WATCH di gpsd (un pacchetto per fix,
+# appena arriva) invece di interrogare gpsd.get_current() RATE volte al secondo
+WATCH_FLAG = True
+
+# Stato del sistema (CPU, RAM, temperatura, throttling, disco, wifi): campionato
+# una volta al secondo in background. Con HEALTH_IN_PACKET=False i campi cpu e
+# ram del pacchetto di posizione restano vuoti.
+HEALTH_IN_PACKET = True
+# Telemetria HEALTH,... (formato in head_packet.py) ogni TELEMETRY_INTERVAL
+# secondi verso una destinazione "host:porta" separata: il server CSV su
+# HOST:PORT riceve solo righe GPS,... None = telemetria non inviata.
+TELEMETRY_DESTINATION = None
+TELEMETRY_INTERVAL = 5
+
+# Log dei fix in logGNSS: segmenti orari compressi (gzip o zstd) scritti da un
+# thread, senza che il loop GNSS attenda la SD. LOG_FSYNC: "always",
+# "interval" (ogni LOG_FSYNC_INTERVAL s), "rotate" (a fine ora) o "never".
+LOG_CODEC = "gzip"
+LOG_FSYNC = "interval"
+LOG_FSYNC_INTERVAL = 60
+
 # Indirizzo IP e porta del server a cui inviare i dati
 #HOST, PORT = '95.230.211.208', 4141
 HOST, PORT = '95.230.211.208', 4141
 
+# Spool su disco dei pacchetti non consegnati (VPN/rete giù), reinviati come
+# storici (prefisso HIST,) al ritorno del collegamento. Disattivato (None)
+# finché il server non riconosce i pacchetti storici; si attiva con SPOOL_DIR
+# in config.json, es. "/home/pi/ippodromoScripts/spool/mainGNSS". Occupa al
+# massimo 2 MiB (spool.SEGMENTS × spool.SEGMENT_SIZE, ~12 minuti a 25 Hz).
+SPOOL_DIR = None
+SPOOL_REPLAY_RATE = 20      # pacchetti storici al secondo
+UPLINK_IFACE = "wlan0"      # interfaccia sotto la VPN
+
+# Pacchetti al secondo (RATE in config.json, modificabile a caldo)
+RATE = 25
+
 # ID HEAD DEFAULT
 HEAD_ID = 999
 
 try:
-    with open('/home/pi/config.json', 'r') as config_file:
+    with open(CONFIG_FILE, 'r') as config_file:
         config = json.load(config_file)
     HEAD_ID = config.get("HEAD_ID", 6)
+    RATE = config.get("RATE", RATE)
+    WATCH_FLAG = config.get("GPSD_WATCH", WATCH_FLAG)
+    HEALTH_IN_PACKET = config.get("HEALTH_IN_PACKET", HEALTH_IN_PACKET)
+    TELEMETRY_DESTINATION = config.get("TELEMETRY_DESTINATION", TELEMETRY_DESTINATION)
+    TELEMETRY_INTERVAL = config.get("TELEMETRY_INTERVAL", TELEMETRY_INTERVAL)
+    LOG_CODEC = config.get("LOG_CODEC", LOG_CODEC)
+    LOG_FSYNC = config.get("LOG_FSYNC", LOG_FSYNC)
+    SPOOL_DIR = config.get("SPOOL_DIR", SPOOL_DIR)
+    # Destinazione "host:porta" impostata dai comandi di gruppo (fleet_config.py)
+    if config.get("DESTINATION"):
+        host, port = config["DESTINATION"].rsplit(":", 1)
+        HOST, PORT = host, int(port)
 except Exception as e:
     print(f"Errore nella lettura del file di configurazione: {e}")
     HEAD_ID = 999
     
 print("HEAD_ID settata:" + str(HEAD_ID))
+
+# HEAD_ID aggiornabile a caldo da receiver_ippodromo.py (vedi head_id_ipc.py),
+# avviato nel main
+head_id = HeadIdListener(HEAD_ID)
     
 def create_socket():
-    """ Crea il socket UDP. """
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    return s
-
-# Calcola la direzione tra due coordinate
-def calculate_bearing(lat1, lon1, lat2, lon2):
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dLon = lon2 - lon1
-    x = math.sin(dLon) * math.cos(lat2)
-    y = math.cos(lat1) * math.sin(lat2) - (math.sin(lat1) * math.cos(lat2) * math.cos(dLon))
-    initial_bearing = math.atan2(x, y)
-    initial_bearing = math.degrees(initial_bearing)
-    bearing = (initial_bearing + 360) % 360
-    return bearing
+    """ Crea la coda di invio UDP verso il server (socket non bloccante + spool). """
+    fanout = UdpFanout([(HOST, PORT)], spool_dir=SPOOL_DIR,
+                       uplink_iface=UPLINK_IFACE, replay_rate=SPOOL_REPLAY_RATE)
+    fanout.start()
+    return fanout
 
-last_time = time.time()
-interval_sum = 0
-position_count = 0
-initial_measurements = 5  # Numero di misurazioni iniziali per calcolare dt
+def fix_accuracy(packet):
+    """ Deviazioni standard Est/Nord (m) dichiarate dal ricevitore, None se assenti. """
+    epx = getattr(packet, 'epx', None)
+    epy = getattr(packet, 'epy', None)
+    if epx is None and epy is None:
+        # Risposte di gpsd-py3: errori nel dizionario error
+        error = getattr(packet, 'error', None) or {}
+        epx, epy = error.get('x'), error.get('y')
+    return (epx * EP_TO_SIGMA if epx else None,
+            epy * EP_TO_SIGMA if epy else None)
 
-# --- Kalman Filter Setup ---
-dt = 0.04  # Stima iniziale, verrà aggiornata
-kf = KalmanFilter(dim_x=4, dim_z=2)  # Stato 4D (x, y, vx, vy), Misura 2D (x, y)
 
-# Matrice di transizione dello stato (modello a velocità costante)
-kf.F = np.array([[1, 0, dt, 0],
-                 [0, 1, 0, dt],
-                 [0, 0, 1, 0],
-                 [0, 0, 0, 1]])
+def fix_timestamp(packet, current_time):
+    """ Orario del fix in secondi Unix (quello di gpsd se disponibile). """
+    timestamp = getattr(packet, 'timestamp', None)
+    if timestamp is not None:
+        return timestamp
+    try:
+        return parse_gpsd_time(packet.time)[1]
+    except (AttributeError, TypeError, ValueError):
+        return current_time
 
-# Funzione di misura (misurazione della posizione)
-kf.H = np.array([[1, 0, 0, 0],
-                 [0, 1, 0, 0]])
 
-# Matrice di covarianza del rumore di processo (Q) - da regolare
-kf.Q = np.eye(4) * 0.1  # Esempio: rumore di processo ridotto
+def create_telemetry_socket():
+    """ Coda di invio della telemetria HEALTH, None se non configurata. """
+    if not TELEMETRY_DESTINATION:
+        return None
+    host, port = TELEMETRY_DESTINATION.rsplit(":", 1)
+    fanout = UdpFanout([(host, int(port))])
+    fanout.start()
+    return fanout
 
-# Matrice di covarianza del rumore di misura (R) - da regolare in base all'accuratezza del GPS (hAcc)
-kf.R = np.eye(2) * 1.0  # Esempio: rumore di misura con deviazione standard di 1 metro
 
-# Stato iniziale (x) - posizione e velocità iniziali (0 o lettura GPS iniziale)
-kf.x = np.array([0., 0., 0., 0.])
+def send_health(sample):
+    """ Invia la telemetria di stato (chiamata dal thread di health). """
+    telemetry.send(encode_health(head_id.value, int(sample.time * 1000), sample.cpu, sample.ram,
+                            sample.temp_c, sample.throttled, sample.disk_free_mb,
+                            sample.wifi_quality, sample.wifi_dbm))
 
-# Matrice di covarianza iniziale (P) - incertezza elevata all'inizio
-kf.P *= 1000.
-# --- Fine Setup Kalman Filter ---
 
-# Connessione al demone gpsd
-gpsd.connect()
+# Stato del sistema, aggiornato in background (avviato nel main)
+health = HealthSampler(interval=1.0, iface=UPLINK_IFACE,
+                       on_report=send_health if TELEMETRY_DESTINATION else None,
+                       report_every=TELEMETRY_INTERVAL)
 
-# Creazione del socket UDP
-sock = create_socket()
+# Filtro di tracciamento, usato solo con KALMAN_FLAG
+tracker = TrackFilter()
+
+# Velocità e direzione ai minimi quadrati sugli ultimi fix (senza KALMAN_FLAG)
+heading_estimator = HeadingEstimator()
+
+# Coda UDP, creata nel main
+sock = None
 
-last_positions = []
 packet_count = 0
+packet_seq = 0
 last_time = time.time()
 
 # --- Setup Logging ---
 log_dir = "/home/pi/ippodromoScripts/logGNSS"
-os.makedirs(log_dir, exist_ok=True)
-log_buffer = []  # Buffer per accumulare le righe da salvare
-last_log_time = time.time()  # Tempo dell'ultimo salvataggio
+# Al massimo 2 minuti di righe in memoria se la SD si blocca (log_writer.py)
+log_writer = LogWriter(log_dir, codec=LOG_CODEC, fsync=LOG_FSYNC,
+                       fsync_interval=LOG_FSYNC_INTERVAL)
+last_stats_time = time.time()  # Ultima stampa delle statistiche
+
+
+def process_packet(packet, current_time):
+    """ Elabora un fix di gpsd: filtro, direzione, invio UDP e log. Restituisce la riga inviata. """
+    global packet_count, packet_seq
+    global last_stats_time, last_time
+
+    if KALMAN_FLAG:
+        sigma_e, sigma_n = fix_accuracy(packet)
+        estimate = tracker.update(packet.lat, packet.lon, fix_timestamp(packet, current_time),
+                                  sigma_e, sigma_n)
+        filtered_lat = estimate.lat
+        filtered_lon = estimate.lon
+        speed = estimate.speed          # m/s, come hspeed
+        heading = estimate.heading
+    else:
+        filtered_lat = packet.lat
+        filtered_lon = packet.lon
+        speed = packet.hspeed
+
+        # Direzione dagli ultimi fix; a bassa velocità la rotta del ricevitore
+        estimate = heading_estimator.add(fix_timestamp(packet, current_time),
+                                         packet.lat, packet.lon,
+                                         getattr(packet, 'track', None), packet.hspeed)
+        heading = estimate.heading
+
+    packet_count += 1
+
+    # Consumo di CPU e RAM: ultimo campione in memoria, nessuna lettura qui
+    cpu_usage = ram_usage = ""
+    if HEALTH_IN_PACKET:
+        sample = health.sample
+        if sample.cpu is not None:
+            cpu_usage = sample.cpu
+            ram_usage = sample.ram
+
+    data = [
+        "GPS",
+        str(head_id.value),
+        str(filtered_lat),      # Latitudine
+        str(filtered_lon),      # Longitudine
+        str(packet.get_time()), # Orario
+        str(packet.alt) if packet.alt is not None else 'N/A',  # Altitudine
+        str(speed),             # Velocità orizzontale (m/s)
+        str(round(heading) % 360) if heading is not None else 'N/A',  # Direzione (gradi)
+        str(cpu_usage),         # Uso della CPU (%)
+        str(ram_usage)          # Uso della RAM (%)
+    ]
+    if TRACE_FLAG:
+        packet_seq = (packet_seq + 1) & 0xFFFF
+        data.append(str(packet_seq))                    # Sequenza
+        data.append(str(int(time.time() * 1000)))       # Ora di invio (ms)
+
+    # Unisce gli elementi in una stringa separata da virgole
+    data_str = ','.join(data)
+
+    # Invio dei dati via UDP: accoda soltanto, i pacchetti non
+    # consegnati finiscono nello spool
+    sock.send(data_str.encode('utf-8'))
+    print("[ " + str(packet_count) + " ]" + " + " + data_str)
+
+    # Accoda la riga al log: la scrittura su SD avviene nel thread di log_writer
+    log_writer.write_line(data_str)
+
+    # Statistiche ogni 15 secondi (in valore assoluto: con WATCH current_time
+    # è l'orario GNSS, non quello di sistema)
+    if abs(current_time - last_stats_time) >= 15:
+        last_stats_time = current_time
+        print("UDP: " + sock.stats())
+        print("LOG: " + log_writer.stats())
+
+    last_time = current_time
+    return data_str
+
+
+def poll_loop():
+    """ Interroga gpsd RATE volte al secondo (stesso fix ripetuto se non ne arriva uno nuovo). """
+    global packet_count, last_time
 
-try:
     while True:
         current_time = time.time()
         if current_time - last_time >= 1:
@@ -104,98 +250,19 @@ try:
         try:
             packet = gpsd.get_current()
             if packet.mode >= 2:
-                interval = current_time - last_time
-                interval_sum += interval
-                position_count += 1
-                average_interval = interval_sum / position_count if position_count > 0 else 0
-        
-                if position_count <= initial_measurements:
-                    if position_count == initial_measurements:
-                        dt = average_interval
-                        kf.F = np.array([[1, 0, dt, 0],
-                                         [0, 1, 0, dt],
-                                         [0, 0, 1, 0],
-                                         [0, 0, 0, 1]])
-                        print(f"Kalman dt updated to: {dt:.4f}s")
-                kf.predict()
-             
-                z = np.array([packet.lon, packet.lat])  # Vettore di misura (lon, lat)
-                kf.update(z)
-
-                # --- Stato filtrato ---
-                filtered_state = kf.x
-                filtered_lon = filtered_state[0] if KALMAN_FLAG else packet.lon
-                filtered_lat = filtered_state[1] if KALMAN_FLAG else packet.lat
-
-                # Aggiorna la lista delle ultime posizioni
-                last_positions.append((filtered_lat, filtered_lon))
-                if len(last_positions) > 6:
-                    last_positions.pop(0)
-
-                # Calcola la direzione tra la prima e l'ultima posizione
-                if len(last_positions) > 1:
-                    lat1, lon1 = last_positions[0]
-                    lat2, lon2 = last_positions[-1]
-                    average_bearing = calculate_bearing(lat1, lon1, lat2, lon2)
-                else:
-                    average_bearing = "N/A"
-                    
-                packet_count += 1
-
-                # Legge il consumo di CPU e RAM
-                cpu_usage = psutil.cpu_percent()
-                ram_usage = psutil.virtual_memory().percent
-                
-                data = [
-                    "GPS",
-                    str(HEAD_ID),
-                    str(filtered_lat),      # Latitudine
-                    str(filtered_lon),      # Longitudine
-                    str(packet.get_time()), # Orario
-                    str(packet.alt) if packet.alt is not None else 'N/A',  # Altitudine
-                    str(packet.hspeed),     # Velocità orizzontale
-                    str(int(average_bearing)),
-                    str(cpu_usage),         # Uso della CPU (%)
-                    str(ram_usage)          # Uso della RAM (%)
-                ]
-                
-                # Unisce gli elementi in una stringa separata da virgole
-                data_str = ','.join(data)
-                
-                try:
-                    # Invio dei dati via socket UDP
-                    sock.sendto(data_str.encode('utf-8'), (HOST, PORT))
-                    print("[ " + str(packet_count) + " ]" + " + " + data_str)
-                except socket.error:
-                    print("[ " + str(packet_count) + " ]" + " - " + data_str)
-                    print("Errore di invio dati.")
-                
-                # Aggiunge la riga al buffer di log
-                log_buffer.append(data_str)
-                
-                # Controlla se sono passati 15 secondi per salvare il log
-                if current_time - last_log_time >= 15:
-                    filename = datetime.now().strftime("%Y%m%d_%H.log")
-                    file_path = os.path.join(log_dir, filename)
-                    with open(file_path, 'a') as f:
-                        for line in log_buffer:
-                            f.write(line + "\n")
-                    log_buffer = []  # Svuota il buffer
-                    last_log_time = current_time
-
-                last_time = current_time
+                process_packet(packet, current_time)
             try:
                 speed = float(packet.hspeed)
             except (TypeError, ValueError):
                 speed = 0
-            
+
             speed = speed * 3.6  # Conversione da m/s a km/h
 
             # Se la velocità è bassa, si potrebbe rallentare il ciclo (qui commentato)
             # if speed <= 2:
             #    time.sleep(1)      # 1 pacchetto al secondo
             # else:
-            time.sleep(0.04)   # 25 pacchetti al secondo
+            time.sleep(1.0 / head_id.config.get("RATE", RATE))   # 25 pacchetti al secondo di default
         except Exception as e:
             if "GPS not active" in str(e):
                 print("Errore GPS: GPS non attivo, attesa di 10 secondi.")
@@ -203,10 +270,62 @@ try:
             else:
                 print(f"Errore non gestito: {e}")
 
-except KeyboardInterrupt:
-    print("Programma interrotto dall'utente")
-except Exception as e:
-    print(f"Errore: {e}")
-finally:
-    # Chiusura del socket UDP
-    sock.close()
+
+def watch_loop():
+    """ Elabora ogni fix TPV di gpsd una sola volta, con il suo orario; fra un fix e l'altro dorme. """
+    global packet_count, last_time
+
+    watch = GpsdWatch()
+    last_sent = None
+    while True:
+        try:
+            watch.open()
+            print("Connesso a gpsd (WATCH JSON)")
+            for report in watch:
+                # Orario del fix, non quello di arrivo: dt del filtro esatto
+                current_time = report.timestamp
+                if current_time - last_time >= 1:
+                    packet_count = 0
+
+                # RATE resta il massimo di pacchetti al secondo (ricevitori più veloci)
+                min_interval = 0.9 / head_id.config.get("RATE", RATE)
+                if last_sent is not None and 0 <= current_time - last_sent < min_interval:
+                    continue
+                last_sent = current_time
+                try:
+                    process_packet(report, current_time)
+                except Exception as e:
+                    print(f"Errore non gestito: {e}")
+        except OSError as e:
+            print(f"Errore gpsd: {e}, nuovo tentativo tra 10 secondi. ({watch.stats()})")
+            watch.close()
+            time.sleep(10)
+
+
+if __name__ == "__main__":
+    head_id.start()
+
+    # Creazione del socket UDP
+    sock = create_socket()
+    telemetry = create_telemetry_socket()
+    health.start()
+    log_writer.start()
+
+    try:
+        if WATCH_FLAG:
+            watch_loop()
+        else:
+            # Connessione al demone gpsd
+            gpsd.connect()
+            poll_loop()
+    except KeyboardInterrupt:
+        print("Programma interrotto dall'utente")
+    except Exception as e:
+        print(f"Errore: {e}")
+    finally:
+        # Chiusura del socket UDP (quanto resta in coda va nello spool)
+        sock.close()
+        if telemetry is not None:
+            telemetry.close()
+        # Scrive le ultime righe e chiude il segmento di log
+        log_writer.close()
@@ -7,10 +7,21 @@ import serial
 import threading
 import time
 import argparse
-import pynmea2
+import asyncio
+import os
+import signal
 import sys
 from collections import deque
 
+from nmea_fast import NmeaParser, GGA
+from rtcm import RtcmFramer, RtcmRing
+from head_identity import get_wlan0_mac
+from gnss_replay import CH_NTRIP, CH_SERIAL, CH_TO_RECEIVER, SessionRecorder
+from log_writer import LogWriter
+from serial_reader import LineFramer, SerialLineReader
+from ubx import UbxFramer, SYNC1 as UBX_SYNC1, decode_nav_pvt, nav_pvt_config_messages
+from udp_fanout import EpochBundler, UdpFanout, parse_destination, format_destination
+
 # Flag per il controllo dell'esecuzione
 running = True
 
@@ -28,109 +39,126 @@ config = {
     "gps_port": "/dev/ttyACM0",
     "gps_baudrate": 115200,
     "gps_retry": 3,
+    "ubx": False,  # posizione da UBX-NAV-PVT invece che da NMEA GGA
     
     # RTCM
-    "rtcm_interval": 1.0,
-    
-    # Destinazioni (lista di tuple (host, porta))
+    "rtcm_ring_size": 64,  # frame RTCM in attesa di scrittura sulla seriale
+    
+    # Raggruppamento delle sentenze di un'epoca in un solo datagramma
+    "bundle_epochs": False,
+    "bundle_mtu": 1420,         # MTU dell'interfaccia VPN (vpn.conf)
+    "bundle_terminator": None,  # es. "GLL"; None = confine dall'orario GGA/RMC
+    
+    # Datagrammi in coda per ogni destinazione (oltre si scartano i più vecchi)
+    "udp_queue_len": 64,
+    
+    # Spool su disco dei datagrammi non consegnati, reinviati come storici
+    # (prefisso HIST,) al ritorno del collegamento. None = disattivato, finché
+    # le destinazioni non riconoscono i datagrammi storici; --spool-dir lo
+    # attiva. Anello di 2 MiB per destinazione (spool.SEGMENTS × spool.SEGMENT_SIZE)
+    "spool_dir": None,
+    "spool_replay_rate": 20,    # datagrammi storici al secondo per destinazione
+    "uplink_iface": "wlan0",    # interfaccia sotto la VPN (None = non controllata)
+    
+    # Log delle sentenze NMEA in segmenti orari compressi, scritti da un thread
+    # (log_writer.py). None = disattivato; fsync: always/interval/rotate/never
+    "log_dir": "/home/pi/ippodromoScripts/logRTK",
+    "log_codec": "gzip",        # "gzip" o "zstd"
+    "log_fsync": "interval",
+    
+    # Registrazione grezza per la rielaborazione: byte del ricevitore, stream
+    # RTCM del caster e byte scritti al ricevitore, in segmenti orari compressi
+    # <testa>_<inizio sessione>_<ora>.rec.gz riproducibili con gnss_replay.py
+    "raw_log": False,
+    "raw_log_dir": "/home/pi/ippodromoScripts/logRTK",
+    "head_name": None,          # nome della testa nei file (None = MAC di wlan0)
+    
+    # Destinazioni: tuple (host, porta) che ricevono tutte le sentenze oppure
+    # (host, porta, filtro) con filtro {tipo: intervallo minimo in s, 0 = senza limite}
     "destinations": [
         ("10.0.0.1", 3131),
-        ("213.209.192.165", 5001)
+        ("213.209.192.165", 5001, {b"GGA": 1 / 5})
     ]
 }
 
 # Variabili globali
-rtcm_data = b''
-rtcm_lock = threading.Lock()
+rtcm_framer = RtcmFramer()
+rtcm_ring = RtcmRing(config["rtcm_ring_size"])
+rtcm_written = 0
+rtcm_write_errors = 0
+gps_serial = None  # porta seriale aperta da gps_worker, usata anche per scrivere RTCM
 gps_position = None
 gps_lock = threading.Lock()
-last_rtcm_time = 0
 
 # Per il calcolo degli hertz
 gps_update_times = deque(maxlen=100)
 hertz_lock = threading.Lock()
 current_hertz = 0
 
-# Socket UDP
-udp_sockets = []
+# Invio UDP: una coda limitata e un socket non bloccante per destinazione
+udp_fanout = None
+
+# Log NMEA su SD (log_writer.LogWriter), creato nel main se abilitato
+nmea_log = None
+
+# Registrazione grezza (gnss_replay.SessionRecorder), creata nel main se abilitata
+raw_recorder = None
+
+def record_raw(channel, data):
+    """Accoda byte alla registrazione grezza, se attiva (nessuna scrittura su SD qui)."""
+    if raw_recorder:
+        raw_recorder.write(channel, data)
+
+def record_receiver_bytes(data):
+    """Blocco letto dalla seriale (memoryview sul buffer del lettore)."""
+    raw_recorder.write(CH_SERIAL, data)
 
 def init_udp_sockets():
-    """Inizializza i socket UDP per tutte le destinazioni."""
-    global udp_sockets
+    """Inizializza le code e i socket UDP per tutte le destinazioni."""
+    global udp_fanout
     
     # Chiudi eventuali socket esistenti
-    for sock in udp_sockets:
-        try:
-            sock.close()
-        except:
-            pass
-    
-    udp_sockets = []
-    
-    # Crea nuovi socket
-    for dest_host, dest_port in config["destinations"]:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            udp_sockets.append((sock, dest_host, dest_port))
-            print(f"Socket UDP inizializzato per {dest_host}:{dest_port}")
-        except Exception as e:
-            print(f"Errore creazione socket UDP per {dest_host}:{dest_port}: {e}")
+    if udp_fanout:
+        udp_fanout.close()
+    
+    udp_fanout = UdpFanout(config["destinations"], maxlen=config["udp_queue_len"],
+                           spool_dir=config["spool_dir"],
+                           uplink_iface=config["uplink_iface"],
+                           replay_rate=config["spool_replay_rate"])
+    for dest in config["destinations"]:
+        print(f"Socket UDP inizializzato per {format_destination(dest)}")
 
-def send_gps_data(gps_data):
-    """Invia i dati GPS a tutte le destinazioni."""
-    global udp_sockets
-    
-    if not udp_sockets:
-        init_udp_sockets()
-        if not udp_sockets:
-            return
-    
-    data_bytes = gps_data.encode()
-    failed_sockets = []
-    
-    for i, (sock, dest_host, dest_port) in enumerate(udp_sockets):
-        try:
-            sock.sendto(data_bytes, (dest_host, dest_port))
-        except Exception as e:
-            print(f"Errore invio a {dest_host}:{dest_port} - {e}")
-            failed_sockets.append(i)
-    
-    # Ricrea i socket che hanno fallito
-    for i in failed_sockets:
-        try:
-            sock, dest_host, dest_port = udp_sockets[i]
-            sock.close()
-            new_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            udp_sockets[i] = (new_sock, dest_host, dest_port)
-        except Exception as e:
-            print(f"Errore ricreazione socket: {e}")
+def send_gps_data(line, now):
+    """Accoda una sentenza per le destinazioni che la accettano, senza bloccare."""
+    if udp_fanout:
+        udp_fanout.route(line, now)
+
+def build_ntrip_request():
+    """Prepara la richiesta HTTP per il mountpoint NTRIP."""
+    # Prepara credenziali
+    credentials = f"{config['ntrip_username']}:{config['ntrip_password']}"
+    encoded_credentials = base64.b64encode(credentials.encode()).decode()
+    
+    request = (
+        f"GET /{config['ntrip_mountpoint']} HTTP/1.1\r\n"
+        f"User-Agent: NTRIP PythonClient/1.0\r\n"
+        f"Authorization: Basic {encoded_credentials}\r\n"
+        f"Ntrip-Version: NTRIP/2.0\r\n"
+        f"Connection: close\r\n"
+        f"\r\n"
+    )
+    return request.encode()
 
 def ntrip_worker():
     """Thread per la connessione al caster NTRIP."""
-    global rtcm_data
-    
     while running:
         try:
             print(f"Connessione al caster NTRIP {config['ntrip_host']}:{config['ntrip_port']}...")
             
-            # Prepara credenziali
-            credentials = f"{config['ntrip_username']}:{config['ntrip_password']}"
-            encoded_credentials = base64.b64encode(credentials.encode()).decode()
-            
-            # Prepara richiesta HTTP
-            request = (
-                f"GET /{config['ntrip_mountpoint']} HTTP/1.1\r\n"
-                f"User-Agent: NTRIP PythonClient/1.0\r\n"
-                f"Authorization: Basic {encoded_credentials}\r\n"
-                f"Ntrip-Version: NTRIP/2.0\r\n"
-                f"Connection: close\r\n"
-                f"\r\n"
-            )
-            
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                 s.settimeout(10.0)  # Timeout per la connessione
                 s.connect((config["ntrip_host"], config["ntrip_port"]))
-                s.sendall(request.encode())
+                s.sendall(build_ntrip_request())
                 
                 response = s.recv(1024)
                 if b"ICY 200 OK" not in response:
@@ -140,21 +168,26 @@ def ntrip_worker():
                 print("Connessione NTRIP stabilita")
                 s.settimeout(30.0)  # Timeout più lungo per la lettura
                 
-                # Salva i dati dopo l'header
+                # Un frame a metà della connessione precedente non va ricomposto
+                rtcm_framer.reset()
+                
+                # Accoda i frame già presenti dopo l'header
                 rtcm_part = response.split(b"\r\n\r\n", 1)
                 if len(rtcm_part) > 1 and rtcm_part[1]:
-                    with rtcm_lock:
-                        rtcm_data = rtcm_part[1]
+                    record_raw(CH_NTRIP, rtcm_part[1])
+                    for frame in rtcm_framer.feed(rtcm_part[1]):
+                        rtcm_ring.push(frame)
                 
                 # Loop di ricezione
                 while running:
-                    data = s.recv(1024)
+                    data = s.recv(4096)
                     if not data:
                         print("Connessione NTRIP chiusa dal server")
                         break
                     
-                    with rtcm_lock:
-                        rtcm_data = data
+                    record_raw(CH_NTRIP, data)
+                    for frame in rtcm_framer.feed(data):
+                        rtcm_ring.push(frame)
         
         except (socket.error, ConnectionError) as e:
             print(f"Errore NTRIP: {e}")
@@ -165,61 +198,98 @@ def ntrip_worker():
             print(f"Tentativo di riconnessione NTRIP tra {config['ntrip_retry']} secondi...")
             time.sleep(config["ntrip_retry"])
 
+def make_bundler():
+    """Crea il raggruppatore per epoca se abilitato in configurazione."""
+    if not config["bundle_epochs"]:
+        return None
+    return EpochBundler(udp_fanout,
+                        mtu=config["bundle_mtu"],
+                        terminator=config["bundle_terminator"])
+
+def update_gps_position(fix, raw):
+    """Aggiorna la posizione mostrata nello stato."""
+    global gps_position
+    
+    with gps_lock:
+        gps_position = {
+            'lat': fix.lat,
+            'lon': fix.lon,
+            'alt': fix.alt,
+            'quality': fix.quality,
+            'satellites': fix.satellites,
+            'hdop': fix.hdop,
+            'time': fix.time,
+            'raw': raw
+        }
+
+def handle_gps_line(line, parser, bundler):
+    """Elabora una sentenza NMEA (bytes o memoryview senza CRLF) o un frame UBX."""
+    if not line:
+        return
+    
+    if line[0] == UBX_SYNC1:
+        # Modalità UBX: un frame NAV-PVT contiene già tutto il fix, senza testo da analizzare
+        if decode_nav_pvt(line, parser.fix):
+            update_gps_position(parser.fix, None)
+        return
+    
+    if line[0] != 0x24:  # '$'
+        return
+    
+    # Aggiorna timestamp per calcolo hertz
+    now = time.time()
+    with hertz_lock:
+        gps_update_times.append(now)
+    
+    # Invia tutti i dati NMEA (una sentenza o un'epoca per datagramma)
+    if bundler:
+        bundler.add(line, now)
+    else:
+        send_gps_data(line, now)
+    
+    # Log: accoda soltanto, la scrittura su SD è nel thread del writer
+    if nmea_log:
+        nmea_log.write_line(line)
+    
+    # Solo GGA serve allo stato: le altre sentenze non vengono analizzate
+    if not config["ubx"] and parser.parse(line) is GGA:
+        update_gps_position(parser.fix, bytes(line))
+
+def make_reader_framer():
+    """Framer per la seriale: solo righe NMEA, oppure stream misto UBX + NMEA."""
+    return UbxFramer() if config["ubx"] else LineFramer()
+
 def gps_worker():
     """Thread per la connessione al GPS e l'elaborazione dei dati."""
-    global gps_position, last_rtcm_time
+    global gps_serial
     
     while running:
         ser = None
         try:
             print(f"Connessione al GPS sulla porta {config['gps_port']}...")
             ser = serial.Serial(config["gps_port"], config["gps_baudrate"], timeout=1)
+            gps_serial = ser
             print("Connessione GPS stabilita")
             
+            if config["ubx"]:
+                messages = nav_pvt_config_messages()
+                ser.write(messages)
+                record_raw(CH_TO_RECEIVER, messages)
+                print("Ricevitore configurato per UBX-NAV-PVT")
+            
+            parser = NmeaParser()
+            bundler = make_bundler()
+            reader = SerialLineReader(ser, framer=make_reader_framer(),
+                                      on_bytes=record_receiver_bytes if raw_recorder else None)
+            
             while running:
                 try:
-                    line = ser.readline().decode('ascii', errors='replace').strip()
+                    # Legge a blocchi tutto ciò che è disponibile sulla seriale
+                    for line in reader.read_lines():
+                        handle_gps_line(line, parser, bundler)
                     
-                    if not line or not line.startswith('$'):
-                        continue
-                    
-                    # Aggiorna timestamp per calcolo hertz
-                    with hertz_lock:
-                        gps_update_times.append(time.time())
-                    
-                    # Invia tutti i dati NMEA
-                    send_gps_data(line)
-                    
-                    try:
-                        msg = pynmea2.parse(line)
-                        
-                        if isinstance(msg, pynmea2.GGA):
-                            with gps_lock:
-                                gps_position = {
-                                    'lat': msg.latitude,
-                                    'lon': msg.longitude,
-                                    'alt': msg.altitude,
-                                    'quality': msg.gps_qual,
-                                    'satellites': msg.num_sats,
-                                    'hdop': msg.horizontal_dil,
-                                    'time': msg.timestamp,
-                                    'raw': line
-                                }
-                            
-                            # Invia correzioni RTCM
-                            current_time = time.time()
-                            with rtcm_lock:
-                                if rtcm_data and (current_time - last_rtcm_time) >= config["rtcm_interval"]:
-                                    try:
-                                        ser.write(rtcm_data)
-                                        last_rtcm_time = current_time
-                                    except Exception as e:
-                                        print(f"Errore nell'invio correzioni RTCM: {e}")
-                                        raise  # Forza la riconnessione
-                    
-                    except pynmea2.ParseError:
-                        # Ignora errori di parsing
-                        pass
+                    if bundler:
+                        bundler.poll(time.time())
                 
                 except serial.SerialException as e:
                     print(f"Errore seriale: {e}")
@@ -232,6 +302,7 @@ def gps_worker():
         except Exception as e:
             print(f"Errore imprevisto GPS: {e}")
         finally:
+            gps_serial = None
             if ser:
                 try:
                     ser.close()
@@ -242,52 +313,318 @@ def gps_worker():
             print(f"Tentativo di riconnessione GPS tra {config['gps_retry']} secondi...")
             time.sleep(config["gps_retry"])
 
-def hertz_worker():
-    """Thread per il calcolo della frequenza di aggiornamento."""
+def rtcm_writer_worker():
+    """Thread che scrive sulla seriale GPS ogni frame RTCM appena arriva."""
+    global rtcm_written, rtcm_write_errors
+    
+    while running:
+        frames = rtcm_ring.pop_all(timeout=0.5)
+        if not frames:
+            continue
+        
+        ser = gps_serial
+        if ser is None:
+            # Seriale non disponibile: le correzioni ormai vecchie sono inutili
+            rtcm_ring.discard(len(frames))
+            continue
+        
+        try:
+            data = b''.join(frames)
+            ser.write(data)
+            rtcm_written += len(frames)
+            record_raw(CH_TO_RECEIVER, data)
+        except Exception as e:
+            # La riconnessione della seriale è gestita da gps_worker
+            rtcm_write_errors += len(frames)
+            print(f"Errore nell'invio correzioni RTCM: {e}")
+
+QUALITY_MAP = {
+    0: "Invalida",
+    1: "GPS",
+    2: "DGPS",
+    4: "RTK fix",
+    5: "RTK float",
+    6: "DR"
+}
+
+def update_hertz():
+    """Aggiorna la frequenza di aggiornamento dagli istanti dell'ultimo secondo."""
     global current_hertz
     
+    with hertz_lock:
+        now = time.time()
+        # Rimuovi i timestamp più vecchi di 1 secondo
+        while gps_update_times and now - gps_update_times[0] > 1.0:
+            gps_update_times.popleft()
+        
+        # Il numero di aggiornamenti nell'ultimo secondo è la frequenza in Hz
+        current_hertz = len(gps_update_times) / 3
+
+def print_status():
+    """Stampa l'ultima posizione e i contatori RTCM."""
+    with gps_lock:
+        if gps_position:
+            quality = gps_position['quality']
+            quality_desc = QUALITY_MAP.get(quality, f"Sconosciuta ({quality})")
+            
+            print(f"Posizione: Lat: {gps_position['lat']:.6f}, "
+                  f"Lon: {gps_position['lon']:.6f}, "
+                  f"Qualità: {quality_desc}, "
+                  f"Sat: {gps_position['satellites']}, "
+                  f"Hz: {current_hertz:.1f}, "
+                  f"RTCM ok/corrotti/persi: {rtcm_written}/"
+                  f"{rtcm_framer.corrupt}/"
+                  f"{rtcm_ring.dropped + rtcm_write_errors}")
+    if udp_fanout:
+        print(f"UDP: {udp_fanout.stats()}")
+    if nmea_log:
+        print(f"LOG: {nmea_log.stats()}")
+    if raw_recorder:
+        print(f"RAW: {raw_recorder.stats()}")
+
+def hertz_worker():
+    """Thread per il calcolo della frequenza di aggiornamento."""
     while running:
         try:
             time.sleep(1)
-            
-            with hertz_lock:
-                now = time.time()
-                # Rimuovi i timestamp più vecchi di 1 secondo
-                while gps_update_times and now - gps_update_times[0] > 1.0:
-                    gps_update_times.popleft()
-                
-                # Il numero di aggiornamenti nell'ultimo secondo è la frequenza in Hz
-                current_hertz = len(gps_update_times) / 3
+            update_hertz()
         except Exception as e:
             print(f"Errore nel calcolo hertz: {e}")
 
 def status_worker():
     """Thread per la visualizzazione dello stato."""
-    quality_map = {
-        0: "Invalida",
-        1: "GPS",
-        2: "DGPS",
-        4: "RTK fix",
-        5: "RTK float",
-        6: "DR"
-    }
-    
     while running:
         try:
             time.sleep(1)
-            with gps_lock:
-                if gps_position:
-                    quality = gps_position['quality']
-                    quality_desc = quality_map.get(quality, f"Sconosciuta ({quality})")
-                    
-                    print(f"Posizione: Lat: {gps_position['lat']:.6f}, "
-                          f"Lon: {gps_position['lon']:.6f}, "
-                          f"Qualità: {quality_desc}, "
-                          f"Sat: {gps_position['satellites']}, "
-                          f"Hz: {current_hertz:.1f}")
+            print_status()
+        except Exception as e:
+            print(f"Errore visualizzazione stato: {e}")
+
+# ─────────────────────── Runtime asyncio (opzionale) ───────────────────────
+# Alternativa ai thread: seriale, NTRIP, invio UDP e attività periodiche
+# girano tutti su un unico event loop, senza passaggi di GIL fra thread.
+
+class AsyncGpsSerial:
+    """Porta seriale GPS letta e scritta dal loop tramite fd non bloccante."""
+    
+    def __init__(self, loop, on_line, on_batch=None, framer=None):
+        self._loop = loop
+        self._on_line = on_line
+        self._on_batch = on_batch
+        self._framer = framer if framer is not None else LineFramer()
+        self._out = bytearray()
+        self.ser = serial.Serial(config["gps_port"], config["gps_baudrate"], timeout=0)
+        self.fd = self.ser.fileno()
+        os.set_blocking(self.fd, False)
+        # Completato con un'eccezione quando la porta smette di funzionare
+        self.failed = loop.create_future()
+        loop.add_reader(self.fd, self._on_readable)
+    
+    def _fail(self, exc):
+        if not self.failed.done():
+            self.failed.set_exception(exc)
+    
+    def _on_readable(self):
+        framer = self._framer
+        space = framer.writable()
+        try:
+            n = os.readv(self.fd, [space])
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(e)
+            return
+        if not n:
+            self._fail(ConnectionError("porta seriale chiusa"))
+            return
+        
+        framer.commit(n)
+        if raw_recorder:
+            raw_recorder.write(CH_SERIAL, space[:n])
+        for line in framer.lines():
+            self._on_line(line)
+        if self._on_batch:
+            self._on_batch()
+    
+    def write(self, data):
+        """Scrive senza bloccare; l'eventuale resto viene inviato quando la porta è pronta."""
+        if self._out:
+            self._out.extend(data)
+            return
+        try:
+            n = os.write(self.fd, data)
+        except BlockingIOError:
+            n = 0
+        except OSError as e:
+            self._fail(e)
+            raise
+        if n < len(data):
+            self._out.extend(data[n:])
+            self._loop.add_writer(self.fd, self._on_writable)
+    
+    def _on_writable(self):
+        try:
+            n = os.write(self.fd, self._out)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._loop.remove_writer(self.fd)
+            self._fail(e)
+            return
+        del self._out[:n]
+        if not self._out:
+            self._loop.remove_writer(self.fd)
+    
+    def close(self):
+        self._loop.remove_reader(self.fd)
+        self._loop.remove_writer(self.fd)
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+
+async_gps_serial = None
+
+def drain_rtcm_async():
+    """Scrive sulla seriale i frame RTCM in coda (runtime asyncio)."""
+    global rtcm_written, rtcm_write_errors
+    
+    frames = rtcm_ring.pop_all(timeout=0)
+    if not frames:
+        return
+    if async_gps_serial is None:
+        # Seriale non disponibile: le correzioni ormai vecchie sono inutili
+        rtcm_ring.discard(len(frames))
+        return
+    try:
+        data = b''.join(frames)
+        async_gps_serial.write(data)
+        rtcm_written += len(frames)
+        record_raw(CH_TO_RECEIVER, data)
+    except OSError as e:
+        rtcm_write_errors += len(frames)
+        print(f"Errore nell'invio correzioni RTCM: {e}")
+
+async def ntrip_task():
+    """Connessione al caster NTRIP sul loop asyncio."""
+    while True:
+        writer = None
+        try:
+            print(f"Connessione al caster NTRIP {config['ntrip_host']}:{config['ntrip_port']}...")
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(config["ntrip_host"], config["ntrip_port"]), 10.0)
+            writer.write(build_ntrip_request())
+            await writer.drain()
+            
+            response = await asyncio.wait_for(reader.read(1024), 10.0)
+            if b"ICY 200 OK" not in response:
+                raise ConnectionError("Risposta NTRIP non valida")
+            print("Connessione NTRIP stabilita")
+            
+            rtcm_framer.reset()
+            data = response.split(b"\r\n\r\n", 1)[1] if b"\r\n\r\n" in response else b""
+            while True:
+                if data:
+                    record_raw(CH_NTRIP, data)
+                for frame in rtcm_framer.feed(data):
+                    rtcm_ring.push(frame)
+                drain_rtcm_async()
+                
+                data = await asyncio.wait_for(reader.read(4096), 30.0)
+                if not data:
+                    print("Connessione NTRIP chiusa dal server")
+                    break
+        
+        except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+            print(f"Errore NTRIP: {e}")
+        finally:
+            if writer:
+                writer.close()
+        
+        print(f"Tentativo di riconnessione NTRIP tra {config['ntrip_retry']} secondi...")
+        await asyncio.sleep(config["ntrip_retry"])
+
+async def gps_task():
+    """Lettura del ricevitore GPS sul loop asyncio."""
+    global async_gps_serial
+    
+    loop = asyncio.get_running_loop()
+    while True:
+        port = None
+        bundler = make_bundler()
+        try:
+            print(f"Connessione al GPS sulla porta {config['gps_port']}...")
+            parser = NmeaParser()
+            port = AsyncGpsSerial(loop,
+                                  lambda line: handle_gps_line(line, parser, bundler),
+                                  on_batch=udp_fanout.drain,
+                                  framer=make_reader_framer())
+            async_gps_serial = port
+            print("Connessione GPS stabilita")
+            
+            if config["ubx"]:
+                messages = nav_pvt_config_messages()
+                port.write(messages)
+                record_raw(CH_TO_RECEIVER, messages)
+                print("Ricevitore configurato per UBX-NAV-PVT")
+            
+            while True:
+                # Attende un guasto della porta, svuotando l'epoca se lo stream si ferma
+                done, _ = await asyncio.wait({port.failed}, timeout=1.0)
+                if done:
+                    port.failed.result()
+                if bundler:
+                    bundler.poll(time.time())
+        
+        except (serial.SerialException, OSError, ConnectionError) as e:
+            print(f"Errore seriale: {e}")
+        finally:
+            async_gps_serial = None
+            if bundler:
+                bundler.flush()
+            if port:
+                port.close()
+        
+        print(f"Tentativo di riconnessione GPS tra {config['gps_retry']} secondi...")
+        await asyncio.sleep(config["gps_retry"])
+
+async def udp_task():
+    """Ritenta l'invio delle code UDP rimaste in sospeso e ricrea i socket in errore."""
+    while True:
+        pending = udp_fanout.drain()
+        await asyncio.sleep(0.05 if pending else 0.5)
+
+async def periodic_task():
+    """Calcolo hertz e stampa dello stato una volta al secondo."""
+    while True:
+        await asyncio.sleep(1)
+        try:
+            update_hertz()
+            print_status()
         except Exception as e:
             print(f"Errore visualizzazione stato: {e}")
 
+async def async_main():
+    """Avvia i task sul loop e li chiude appena arriva SIGINT/SIGTERM."""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    tasks = [
+        asyncio.create_task(ntrip_task()),
+        asyncio.create_task(gps_task()),
+        asyncio.create_task(udp_task()),
+        asyncio.create_task(periodic_task()),
+    ]
+    print("Sistema GPS-RTK avviato (asyncio). Premi Ctrl+C per terminare.")
+    
+    await stop.wait()
+    print("\nChiusura in corso...")
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 def parse_arguments():
     """Funzione per gestire i parametri da linea di comando."""
     parser = argparse.ArgumentParser(description='Sistema GPS-RTK con correzioni NTRIP')
@@ -302,16 +639,48 @@ def parse_arguments():
                       help='Porta del caster NTRIP')
     
     parser.add_argument('--add-dest', dest='add_dest', action='append', 
-                      help='Aggiungi destinazione nel formato host:porta')
+                      help='Aggiungi destinazione nel formato host:porta[:TIPI], '
+                           'es. host:porta:GGA,RMC@5 (solo GGA e RMC, max 5 Hz)')
     
     parser.add_argument('--clear-dest', dest='clear_dest', action='store_true',
                       help='Rimuovi tutte le destinazioni predefinite')
     
+    parser.add_argument('--bundle', dest='bundle', action='store_true',
+                      help='Invia tutte le sentenze di un\'epoca in un solo datagramma')
+    
+    parser.add_argument('--bundle-terminator', dest='bundle_terminator',
+                      help='Sentenza che chiude l\'epoca (es. GLL)')
+    
+    parser.add_argument('--mtu', dest='mtu', type=int,
+                      help='MTU del collegamento per il raggruppamento (default 1420)')
+    
+    parser.add_argument('--ubx', dest='ubx', action='store_true',
+                      help='Configura il ricevitore u-blox per NAV-PVT e usa quello per la posizione')
+    
+    parser.add_argument('--asyncio', dest='use_asyncio', action='store_true',
+                      help='Usa un unico event loop asyncio invece dei thread')
+    
+    parser.add_argument('--spool-dir', dest='spool_dir',
+                      help='Salva in questa cartella i datagrammi non consegnati e li reinvia '
+                           'come storici (HIST,), es. /home/pi/ippodromoScripts/spool/mainRTK')
+    
+    parser.add_argument('--no-log', dest='no_log', action='store_true',
+                      help='Non salvare le sentenze NMEA in logRTK')
+    
+    parser.add_argument('--log-codec', dest='log_codec', choices=['gzip', 'zstd'],
+                      help='Compressione dei segmenti di log (default gzip)')
+    
+    parser.add_argument('--raw-log', dest='raw_log', action='store_true',
+                      help='Registra i byte grezzi del ricevitore e lo stream RTCM in logRTK')
+    
+    parser.add_argument('--head', dest='head_name',
+                      help='Nome della testa nei file della registrazione (default MAC di wlan0)')
+    
     return parser.parse_args()
 
 def main():
     """Funzione principale."""
-    global config
+    global config, nmea_log, raw_recorder
     
     # Parsing dei parametri da linea di comando
     args = parse_arguments()
@@ -326,6 +695,33 @@ def main():
     if args.ntrip_port:
         config["ntrip_port"] = args.ntrip_port
     
+    if args.ubx:
+        config["ubx"] = True
+    
+    if args.bundle:
+        config["bundle_epochs"] = True
+    
+    if args.bundle_terminator:
+        config["bundle_terminator"] = args.bundle_terminator.upper()
+    
+    if args.mtu:
+        config["bundle_mtu"] = args.mtu
+    
+    if args.spool_dir:
+        config["spool_dir"] = args.spool_dir
+    
+    if args.no_log:
+        config["log_dir"] = None
+    
+    if args.log_codec:
+        config["log_codec"] = args.log_codec
+    
+    if args.raw_log:
+        config["raw_log"] = True
+    
+    if args.head_name:
+        config["head_name"] = args.head_name
+    
     # Gestione delle destinazioni
     if args.clear_dest:
         config["destinations"] = []
@@ -333,37 +729,76 @@ def main():
     if args.add_dest:
         for dest_str in args.add_dest:
             try:
-                host, port = dest_str.split(':')
-                config["destinations"].append((host, int(port)))
-                print(f"Aggiunta destinazione: {host}:{port}")
+                dest = parse_destination(dest_str)
+                config["destinations"].append(dest)
+                print(f"Aggiunta destinazione: {format_destination(dest)}")
             except ValueError:
-                print(f"Formato destinazione non valido: {dest_str}. Usa host:porta")
+                print(f"Formato destinazione non valido: {dest_str}. Usa host:porta[:TIPI]")
     
     # Stampa la configurazione
     print("\nConfigurazione:")
-    print(f"GPS: {config['gps_port']} ({config['gps_baudrate']} baud)")
+    print(f"GPS: {config['gps_port']} ({config['gps_baudrate']} baud"
+          f"{', UBX NAV-PVT' if config['ubx'] else ''})")
     print(f"NTRIP: {config['ntrip_host']}:{config['ntrip_port']}/{config['ntrip_mountpoint']}")
+    if config["bundle_epochs"]:
+        print(f"Raggruppamento per epoca: MTU {config['bundle_mtu']}, "
+              f"terminatore {config['bundle_terminator'] or 'orario GGA/RMC'}")
     print("Destinazioni:")
-    for dest_host, dest_port in config["destinations"]:
-        print(f"  {dest_host}:{dest_port}")
+    for dest in config["destinations"]:
+        print(f"  {format_destination(dest)}")
+    if config["spool_dir"]:
+        print(f"Spool: {config['spool_dir']} (reinvio {config['spool_replay_rate']}/s)")
+    if config["log_dir"]:
+        print(f"Log NMEA: {config['log_dir']} ({config['log_codec']}, fsync {config['log_fsync']})")
     
     # Inizializza i socket UDP
     init_udp_sockets()
     
+    # Avvia il thread di scrittura del log
+    if config["log_dir"]:
+        nmea_log = LogWriter(config["log_dir"], codec=config["log_codec"],
+                             fsync=config["log_fsync"]).start()
+    
+    # Avvia la registrazione grezza (prima dei thread che la alimentano)
+    if config["raw_log"]:
+        raw_recorder = SessionRecorder(config["raw_log_dir"],
+                                       config["head_name"] or get_wlan0_mac(),
+                                       codec=config["log_codec"],
+                                       fsync=config["log_fsync"]).start_writer()
+        print(f"Registrazione grezza: {config['raw_log_dir']} "
+              f"(testa {raw_recorder.head}, sessione {raw_recorder.session})")
+    
+    if args.use_asyncio:
+        try:
+            asyncio.run(async_main())
+        finally:
+            udp_fanout.close()
+            if nmea_log:
+                nmea_log.close()
+            if raw_recorder:
+                raw_recorder.close()
+            print("Sistema terminato.")
+        return
+    
+    # Thread di invio UDP (le code vengono svuotate fuori dal thread GPS)
+    udp_fanout.start()
+    
     # Avvia i thread
     threads = []
     
     ntrip_thread = threading.Thread(target=ntrip_worker)
     gps_thread = threading.Thread(target=gps_worker)
+    rtcm_thread = threading.Thread(target=rtcm_writer_worker)
     hertz_thread = threading.Thread(target=hertz_worker)
     status_thread = threading.Thread(target=status_worker)
     
     ntrip_thread.daemon = True
     gps_thread.daemon = True
+    rtcm_thread.daemon = True
     hertz_thread.daemon = True
     status_thread.daemon = True
     
-    threads.extend([ntrip_thread, gps_thread, hertz_thread, status_thread])
+    threads.extend([ntrip_thread, gps_thread, rtcm_thread, hertz_thread, status_thread])
     
     for thread in threads:
         thread.start()
@@ -381,11 +816,13 @@ def main():
         time.sleep(1)  # Attendi che i thread si fermino
         
         # Chiudi i socket
-        for sock, _, _ in udp_sockets:
-            try:
-                sock.close()
-            except:
-                pass
+        udp_fanout.close()
+        
+        # Scrive le ultime sentenze e chiude il segmento di log
+        if nmea_log:
+            nmea_log.close()
+        if raw_recorder:
+            raw_recorder.close()
         
         print("Sistema terminato.")
 
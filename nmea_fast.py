@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Parser NMEA veloce per le sole sentenze usate nel ciclo GPS: GGA, RMC e VTG.
+
+Lavora direttamente sui byte letti dalla seriale (nessuna decodifica in str),
+verifica il checksum e aggiorna in place un unico record Fix riutilizzato
+ad ogni sentenza, senza creare oggetti messaggio come pynmea2.
+"""
+
+GGA = b'GGA'
+RMC = b'RMC'
+VTG = b'VTG'
+
+KNOTS_TO_KMH = 1.852
+
+_DOLLAR = 0x24
+_STAR = b'*'
+_SOUTH_WEST = (b'S', b'W')
+
+
+class Fix:
+    """Ultimo stato noto del ricevitore, aggiornato dalle sentenze NMEA."""
+
+    __slots__ = (
+        'time', 'date', 'lat', 'lon', 'alt', 'quality', 'satellites',
+        'hdop', 'valid', 'speed_kmh', 'course', 'h_acc',
+    )
+
+    def __init__(self):
+        self.time = None        # secondi dalla mezzanotte UTC (float)
+        self.date = None        # data UTC come tupla (anno, mese, giorno)
+        self.lat = None         # gradi decimali
+        self.lon = None         # gradi decimali
+        self.alt = None         # metri sul livello del mare
+        self.quality = 0        # qualità GGA (0 invalida, 4 RTK fix, 5 RTK float)
+        self.satellites = 0
+        self.hdop = None
+        self.valid = False      # stato RMC 'A'
+        self.speed_kmh = 0.0
+        self.course = None      # rotta rispetto al nord vero (gradi)
+        self.h_acc = None       # accuratezza orizzontale stimata (m), solo UBX
+
+
+def _xor_bytes(data):
+    """XOR di tutti i byte di data, ripiegando un unico intero invece di ciclare."""
+    n = len(data)
+    if not n:
+        return 0
+    x = int.from_bytes(data, 'big')
+    while n > 1:
+        low = n - n // 2
+        shift = low << 3
+        x = (x >> shift) ^ (x & ((1 << shift) - 1))
+        n = low
+    return x
+
+
+def _coord(value, hemisphere):
+    """Converte ddmm.mmmm / dddmm.mmmm in gradi decimali."""
+    if not value:
+        return None
+    v = float(value)
+    degrees = int(v / 100)
+    result = degrees + (v - degrees * 100) / 60.0
+    return -result if hemisphere in _SOUTH_WEST else result
+
+
+def _utc_time(value):
+    """Converte hhmmss.ss in secondi dalla mezzanotte."""
+    if len(value) < 6:
+        return None
+    return int(value[0:2]) * 3600 + int(value[2:4]) * 60 + float(value[4:])
+
+
+def _float(value):
+    return float(value) if value else None
+
+
+class NmeaParser:
+    """Parser per GGA, RMC e VTG che aggiorna il record self.fix."""
+
+    def __init__(self, fix=None):
+        self.fix = fix if fix is not None else Fix()
+        self.bad_checksum = 0
+
+    def parse(self, line):
+        """Analizza una sentenza e aggiorna self.fix.
+
+        Restituisce GGA, RMC o VTG se la sentenza è stata applicata,
+        None se il tipo non è gestito o la sentenza non è valida.
+        """
+        if len(line) < 10 or line[0] != _DOLLAR:
+            return None
+
+        # Restituisce sempre le costanti del modulo, confrontabili con `is`
+        tag = line[3:6]
+        if tag == GGA:
+            kind = GGA
+        elif tag == RMC:
+            kind = RMC
+        elif tag == VTG:
+            kind = VTG
+        else:
+            return None
+        if isinstance(line, memoryview):
+            # Copia solo le sentenze che vengono effettivamente analizzate
+            line = line.tobytes()
+
+        star = line.rfind(_STAR)
+        if star < 7:
+            return None
+        try:
+            if _xor_bytes(line[1:star]) != int(line[star + 1:star + 3], 16):
+                self.bad_checksum += 1
+                return None
+        except ValueError:
+            self.bad_checksum += 1
+            return None
+
+        f = line[7:star].split(b',')
+        fix = self.fix
+        try:
+            if kind is GGA:
+                if len(f) < 9:
+                    return None
+                fix.time = _utc_time(f[0])
+                fix.lat = _coord(f[1], f[2])
+                fix.lon = _coord(f[3], f[4])
+                fix.quality = int(f[5]) if f[5] else 0
+                fix.satellites = int(f[6]) if f[6] else 0
+                fix.hdop = _float(f[7])
+                fix.alt = _float(f[8])
+            elif kind is RMC:
+                if len(f) < 9:
+                    return None
+                fix.time = _utc_time(f[0])
+                fix.valid = f[1] == b'A'
+                if fix.valid:
+                    fix.lat = _coord(f[2], f[3])
+                    fix.lon = _coord(f[4], f[5])
+                fix.speed_kmh = float(f[6]) * KNOTS_TO_KMH if f[6] else 0.0
+                fix.course = _float(f[7])
+                d = f[8]
+                if len(d) == 6:
+                    fix.date = (2000 + int(d[4:6]), int(d[2:4]), int(d[0:2]))
+            else:
+                if len(f) < 7:
+                    return None
+                fix.course = _float(f[0])
+                if f[6]:
+                    fix.speed_kmh = float(f[6])
+                elif f[4]:
+                    fix.speed_kmh = float(f[4]) * KNOTS_TO_KMH
+                else:
+                    fix.speed_kmh = 0.0
+        except ValueError:
+            return None
+        return kind
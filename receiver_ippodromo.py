@@ -1,65 +1,126 @@
 #!/usr/bin/env python3
 import socket
 import json
-import subprocess
+import os
+
+from fleet_config import CONFIG_PORT, MULTICAST_GROUP, entry_for, encode_ack
+from head_id_ipc import push_head_id
+from head_identity import CONFIG_FILE, get_wlan0_mac
 
 # Impostazioni
 UDP_IP = "0.0.0.0"
-UDP_PORT = 5959
-CONFIG_FILE = "/home/pi/ippodromoScripts/config.json"
-SERVICE_TO_RESTART = "horsemonitor.service"
+UDP_PORT = CONFIG_PORT
+
+# MAC di questa testa: seleziona la voce nei comandi di gruppo
+MAC_ADDR = get_wlan0_mac()
 
-def update_config(horse_number):
+def read_config():
     """
-    Legge il file di configurazione, aggiorna il valore di HEAD_ID e lo riscrive.
+    Legge il file di configurazione; None se non è leggibile.
+    Un file che non esiste ancora equivale a una configurazione vuota
+    (mainGNSS.py usa i valori predefiniti) e viene creato alla prima scrittura.
     """
     try:
         with open(CONFIG_FILE, "r") as f:
-            config = json.load(f)
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
     except Exception as e:
         print(f"[ERRORE] Lettura del file {CONFIG_FILE}: {e}")
-        return False
-
-    # Aggiorna o imposta il valore di HEAD_ID
-    config["HEAD_ID"] = horse_number
+        return None
 
+def write_config(config):
+    """
+    Scrive la configurazione completa; False se non è stato possibile.
+    """
+    # Scrittura su file temporaneo e rename atomico: chi legge il file
+    # vede sempre la versione vecchia o quella nuova, mai una a metà
+    tmp_file = CONFIG_FILE + ".tmp"
     try:
-        with open(CONFIG_FILE, "w") as f:
+        with open(tmp_file, "w") as f:
             json.dump(config, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, CONFIG_FILE)
     except Exception as e:
         print(f"[ERRORE] Scrittura del file {CONFIG_FILE}: {e}")
         return False
+    return True
+
+def update_config(values):
+    """
+    Legge il file di configurazione, aggiorna i valori (es. HEAD_ID) e lo riscrive.
+    """
+    config = read_config()
+    if config is None:
+        return False
 
-    print(f"[INFO] Aggiornato HEAD_ID a {horse_number} in {CONFIG_FILE}")
+    # Aggiorna o imposta i valori
+    if not write_config({**config, **values}):
+        return False
+
+    print(f"[INFO] Aggiornato {values} in {CONFIG_FILE}")
     return True
 
-def restart_service():
+def apply_head_id(horse_number, rate=None):
+    """
+    Applica il nuovo HEAD_ID (ed eventualmente RATE) al processo in esecuzione
+    tramite IPC locale, se ne ha uno (mainGNSS.py). Se nessuno conferma, ad
+    esempio con mainRTK.py che non usa HEAD_ID, il valore resta soltanto in
+    CONFIG_FILE: nessun riavvio del servizio, che farebbe perdere il fix RTK.
+    """
+    extra = {"RATE": rate} if rate is not None else {}
+    if horse_number is not None and push_head_id(horse_number, **extra):
+        print(f"[INFO] HEAD_ID {horse_number} applicato a caldo.")
+    else:
+        print(f"[INFO] Nessun processo con HEAD_ID a caldo: valore salvato in {CONFIG_FILE}.")
+
+def apply_fleet_command(sock, message, addr):
     """
-    Riavvia il servizio utilizzando systemctl.
-    È necessario che l'utente che esegue lo script abbia i permessi per
-    eseguire il comando 'sudo systemctl restart horsemonitor.service' senza password.
+    Applica la voce di un comando di gruppo indirizzata a questa testa e
+    risponde al mittente con la conferma compatta: OK se la configurazione è
+    stata salvata in CONFIG_FILE. HEAD_ID e RATE vengono anche applicati a
+    caldo se il processo in esecuzione li usa; DESTINATION vale dal prossimo
+    avvio di mainGNSS.py.
     """
+    entry = entry_for(message, MAC_ADDR)
+    if entry is None:
+        return  # comando per altre teste
+
+    version = message.get("version", 0)
+    config = read_config()
+    ok = config is not None
+    if ok and config.get("CONFIG_VERSION") == version:
+        # Ritrasmissione di un comando già applicato: solo conferma
+        print(f"[INFO] Configurazione {version} già applicata")
+        head_id = config.get("HEAD_ID")
+    else:
+        head_id = entry.get("HEAD_ID", config.get("HEAD_ID") if ok else None)
+        ok = ok and update_config({**entry, "CONFIG_VERSION": version})
+        if ok:
+            apply_head_id(head_id, entry.get("RATE"))
+
     try:
-        result = subprocess.run(
-            ["sudo", "systemctl", "restart", SERVICE_TO_RESTART],
-            capture_output=True, text=True
-        )
-        if result.returncode != 0:
-            print(f"[ERRORE] Riavvio servizio: {result.stderr}")
-        else:
-            print(f"[INFO] Servizio {SERVICE_TO_RESTART} riavviato correttamente.")
-    except Exception as e:
-        print(f"[ERRORE] Esecuzione comando di riavvio: {e}")
+        sock.sendto(encode_ack(MAC_ADDR, version, head_id, ok), addr)
+    except OSError as e:
+        print(f"[ERRORE] Invio conferma a {addr}: {e}")
 
 def main():
-    # Crea il socket UDP e lo mette in ascolto
+    # Crea il socket UDP e lo mette in ascolto (unicast, broadcast e
+    # gruppo multicast dei comandi di gruppo)
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sock.bind((UDP_IP, UDP_PORT))
-    print(f"[INFO] In ascolto su UDP {UDP_IP}:{UDP_PORT}...")
+    try:
+        membership = socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton("0.0.0.0")
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    except OSError as e:
+        print(f"[ERRORE] Iscrizione al gruppo {MULTICAST_GROUP}: {e}")
+    print(f"[INFO] In ascolto su UDP {UDP_IP}:{UDP_PORT} (gruppo {MULTICAST_GROUP}), MAC {MAC_ADDR}...")
 
     while True:
         try:
-            data, addr = sock.recvfrom(1024)  # Buffer da 1024 byte
+            data, addr = sock.recvfrom(65535)
             print(f"[INFO] Ricevuto pacchetto da {addr}")
 
             try:
@@ -68,6 +129,11 @@ def main():
                 print(f"[ERRORE] JSON non valido: {e}")
                 continue
 
+            # Comando di gruppo: più teste indirizzate per MAC
+            if isinstance(message, dict) and "heads" in message:
+                apply_fleet_command(sock, message, addr)
+                continue
+
             # Verifica che la chiave "horse_number" sia presente
             if "horse_number" not in message:
                 print("[ERRORE] Chiave 'horse_number' non trovata nel pacchetto ricevuto.")
@@ -76,9 +142,10 @@ def main():
             horse_number = message["horse_number"]
             print(f"[INFO] Imposto HEAD_ID a: {horse_number}")
 
-            # Aggiorna il file di configurazione e riavvia il servizio se l'aggiornamento ha avuto successo
-            if update_config(horse_number):
-                restart_service()
+            # Aggiorna il file di configurazione e, se l'aggiornamento ha avuto
+            # successo, applica il valore al processo in esecuzione
+            if update_config({"HEAD_ID": horse_number}):
+                apply_head_id(horse_number)
 
         except KeyboardInterrupt:
             print("\n[INFO] Interrotto dall'utente. Uscita...")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Framing dello stream RTCM3 proveniente dal caster NTRIP.
+
+Il flusso TCP arriva a blocchi arbitrari: un frame RTCM può essere spezzato
+fra due recv() oppure più frame possono arrivare nello stesso blocco.
+RtcmFramer ricostruisce i frame completi e ne verifica il CRC-24Q,
+RtcmRing li accoda (con capacità limitata) fino alla scrittura sulla seriale.
+
+Formato frame RTCM3:
+    0xD3 | 6 bit riservati + 10 bit lunghezza | payload | CRC-24Q (3 byte)
+"""
+
+import threading
+from collections import deque
+
+RTCM3_PREAMBLE = 0xD3
+RTCM3_HEADER_LEN = 3
+RTCM3_CRC_LEN = 3
+RTCM3_MAX_PAYLOAD = 1023
+
+
+def _make_crc24q_table():
+    """Costruisce la tabella per il CRC-24Q (polinomio 0x1864CFB)."""
+    table = []
+    for i in range(256):
+        crc = i << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+        table.append(crc & 0xFFFFFF)
+    return table
+
+
+_CRC24Q_TABLE = _make_crc24q_table()
+
+
+def crc24q(data, start=0, end=None):
+    """Calcola il CRC-24Q di data[start:end]."""
+    if end is None:
+        end = len(data)
+    crc = 0
+    table = _CRC24Q_TABLE
+    for i in range(start, end):
+        crc = ((crc << 8) & 0xFFFFFF) ^ table[(crc >> 16) ^ data[i]]
+    return crc
+
+
+class RtcmFramer:
+    """Ricostruisce frame RTCM3 completi da uno stream di byte."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self.frames = 0         # frame validi estratti
+        self.corrupt = 0        # frame scartati per CRC errato
+        self.skipped_bytes = 0  # byte scartati durante la risincronizzazione
+
+    def reset(self):
+        """Svuota il buffer (da chiamare ad ogni nuova connessione NTRIP)."""
+        self._buf.clear()
+
+    def feed(self, data):
+        """Aggiunge byte allo stream e restituisce la lista dei frame completi."""
+        buf = self._buf
+        buf.extend(data)
+        frames = []
+        pos = 0
+        size = len(buf)
+
+        while True:
+            # Cerca il preambolo
+            start = buf.find(RTCM3_PREAMBLE, pos)
+            if start < 0:
+                self.skipped_bytes += size - pos
+                pos = size
+                break
+            self.skipped_bytes += start - pos
+            pos = start
+
+            if size - pos < RTCM3_HEADER_LEN:
+                break
+
+            # I 6 bit riservati devono essere a zero, altrimenti non è un frame
+            if buf[pos + 1] & 0xFC:
+                pos += 1
+                self.skipped_bytes += 1
+                continue
+
+            length = ((buf[pos + 1] & 0x03) << 8) | buf[pos + 2]
+            total = RTCM3_HEADER_LEN + length + RTCM3_CRC_LEN
+            if size - pos < total:
+                break
+
+            crc_pos = pos + RTCM3_HEADER_LEN + length
+            expected = (buf[crc_pos] << 16) | (buf[crc_pos + 1] << 8) | buf[crc_pos + 2]
+            if crc24q(buf, pos, crc_pos) != expected:
+                # Falso preambolo o frame danneggiato: risincronizza dal byte successivo
+                self.corrupt += 1
+                pos += 1
+                self.skipped_bytes += 1
+                continue
+
+            frames.append(bytes(buf[pos:pos + total]))
+            self.frames += 1
+            pos += total
+
+        if pos:
+            del buf[:pos]
+        return frames
+
+
+class RtcmRing:
+    """Coda limitata di frame RTCM completi, thread-safe.
+
+    Se la coda è piena il frame più vecchio viene scartato: una correzione
+    vecchia è meno utile di una appena arrivata.
+    """
+
+    def __init__(self, maxlen=64):
+        self._frames = deque()
+        self._maxlen = maxlen
+        self._cond = threading.Condition()
+        self.pushed = 0
+        self.dropped = 0
+
+    def push(self, frame):
+        """Accoda un frame, scartando il più vecchio se la coda è piena."""
+        with self._cond:
+            if len(self._frames) >= self._maxlen:
+                self._frames.popleft()
+                self.dropped += 1
+            self._frames.append(frame)
+            self.pushed += 1
+            self._cond.notify()
+
+    def pop_all(self, timeout=None):
+        """Attende almeno un frame (fino a timeout) e restituisce tutti quelli in coda."""
+        with self._cond:
+            if not self._frames:
+                self._cond.wait(timeout)
+            frames = list(self._frames)
+            self._frames.clear()
+        return frames
+
+    def discard(self, n):
+        """Conta come persi n frame già prelevati (es. seriale non disponibile)."""
+        with self._cond:
+            self.dropped += n
+
+    def clear(self):
+        """Scarta tutti i frame in coda, contandoli come persi."""
+        with self._cond:
+            self.dropped += len(self._frames)
+            self._frames.clear()
+
+    def __len__(self):
+        return len(self._frames)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Unico proprietario della porta seriale del ricevitore GNSS.
+
+Invece di aprire la stessa tty da più thread (lettura NMEA da una parte,
+scrittura RTCM dall'altra), SerialMux apre la porta una sola volta, la
+riapre in caso di errore, distribuisce righe/frame letti ai sottoscrittori
+e scrive sulla porta i dati accodati con write() (es. correzioni RTCM).
+Tiene i contatori di byte nelle due direzioni.
+"""
+
+import threading
+import time
+from collections import deque
+
+import serial
+
+from serial_reader import LineFramer, SerialLineReader
+
+
+class SerialMux:
+    """Porta seriale condivisa: un thread di lettura e uno di scrittura."""
+
+    def __init__(self, port, baudrate, framer_factory=LineFramer,
+                 write_queue_len=64, retry=3.0, on_open=None):
+        self.port = port
+        self.baudrate = baudrate
+        self._framer_factory = framer_factory
+        self._on_open = on_open            # callback(mux) ad ogni apertura
+        self._retry = retry
+        self._subscribers = []
+        self._queue = deque()
+        self._queue_len = write_queue_len
+        self._cond = threading.Condition()
+        self._ser = None
+        self._running = False
+        self._threads = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.writes_dropped = 0
+        self.reconnects = 0
+
+    def subscribe(self, callback):
+        """Registra callback(item) per ogni riga o frame letto.
+
+        item è una memoryview valida solo durante la chiamata.
+        """
+        self._subscribers.append(callback)
+
+    def write(self, data):
+        """Accoda data per la scrittura sulla porta, scartando il più vecchio se piena."""
+        with self._cond:
+            if len(self._queue) >= self._queue_len:
+                self._queue.popleft()
+                self.writes_dropped += 1
+            self._queue.append(bytes(data))
+            self._cond.notify()
+
+    @property
+    def is_open(self):
+        return self._ser is not None
+
+    def start(self):
+        self._running = True
+        for target in (self._read_loop, self._write_loop):
+            t = threading.Thread(target=target, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=2.0)
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                with serial.Serial(self.port, self.baudrate, timeout=1) as ser:
+                    self._ser = ser
+                    print(f"[SERIAL] {self.port} aperta @ {self.baudrate}")
+                    if self._on_open:
+                        self._on_open(self)
+                    reader = SerialLineReader(ser, framer=self._framer_factory())
+                    framer = reader.framer
+                    while self._running:
+                        before = framer.bytes_in
+                        for item in reader.read_lines():
+                            for callback in self._subscribers:
+                                callback(item)
+                        self.bytes_in += framer.bytes_in - before
+            except serial.SerialException as e:
+                print(f"[SERIAL] {e}; ritento in {self._retry:g} s")
+            finally:
+                self._ser = None
+            if self._running:
+                self.reconnects += 1
+                time.sleep(self._retry)
+
+    def _write_loop(self):
+        while self._running:
+            with self._cond:
+                if not self._queue:
+                    self._cond.wait(0.5)
+                chunks = list(self._queue)
+                self._queue.clear()
+            if not chunks:
+                continue
+
+            ser = self._ser
+            if ser is None:
+                # Porta chiusa: dati (correzioni) ormai inutili
+                self.writes_dropped += len(chunks)
+                continue
+            data = b''.join(chunks)
+            try:
+                ser.write(data)
+                self.bytes_out += len(data)
+            except (serial.SerialException, OSError) as e:
+                # La riapertura della porta è compito del thread di lettura
+                self.writes_dropped += len(chunks)
+                print(f"[SERIAL] errore scrittura: {e}")
+
+    def stats(self):
+        return (f"rx {self.bytes_in} B, tx {self.bytes_out} B, "
+                f"scritture perse {self.writes_dropped}, riaperture {self.reconnects}")
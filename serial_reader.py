@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Lettura a blocchi della seriale GNSS con separazione delle righe in casa.
+
+Invece di ser.readline() (che legge un byte alla volta) si legge in un colpo
+tutto quello che il driver ha già ricevuto, direttamente dentro un bytearray
+preallocato e riutilizzato. Le righe complete vengono restituite come
+memoryview sul buffer, senza copie e senza decodifica in str.
+
+Attenzione: le memoryview restituite sono valide solo fino alla lettura
+successiva; chi deve conservare una riga ne fa una copia con bytes().
+"""
+
+import os
+import select
+
+import serial
+
+_LF = 0x0A
+_CR = 0x0D
+
+
+class LineFramer:
+    """Buffer riutilizzabile che accumula byte e separa le righe complete."""
+
+    def __init__(self, size=16384):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0     # inizio dei dati non ancora consumati
+        self._end = 0       # fine dei dati validi
+        self.bytes_in = 0
+        self.lines_out = 0
+        self.overflows = 0  # righe troppo lunghe scartate
+
+    def writable(self):
+        """Restituisce lo spazio libero in coda al buffer, compattandolo se serve."""
+        if self._start:
+            pending = self._end - self._start
+            self._buf[0:pending] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        if self._end == len(self._buf):
+            # Nessun terminatore in tutto il buffer: dati non validi, si riparte
+            self.overflows += 1
+            self._end = 0
+        return self._view[self._end:]
+
+    def commit(self, n):
+        """Segnala che n byte sono stati scritti nello spazio di writable()."""
+        self._end += n
+        self.bytes_in += n
+
+    def feed(self, data):
+        """Copia data nel buffer e restituisce le righe complete (generatore)."""
+        view = memoryview(data)
+        while view:
+            space = self.writable()
+            n = min(len(space), len(view))
+            space[:n] = view[:n]
+            self.commit(n)
+            view = view[n:]
+            # Con buffer pieno le righe vanno consumate prima di continuare
+            yield from self.lines()
+
+    def lines(self):
+        """Restituisce le righe complete (senza CR/LF) come memoryview."""
+        buf = self._buf
+        view = self._view
+        end = self._end
+        pos = self._start
+        while pos < end:
+            nl = buf.find(_LF, pos, end)
+            if nl < 0:
+                break
+            stop = nl
+            if stop > pos and buf[stop - 1] == _CR:
+                stop -= 1
+            start = pos
+            pos = nl + 1
+            self._start = pos
+            if stop > start:
+                self.lines_out += 1
+                yield view[start:stop]
+        self._start = pos
+
+
+class SerialLineReader:
+    """Legge dalla seriale tutto ciò che è disponibile e ne separa le righe.
+
+    on_bytes, se indicata, riceve ogni blocco letto (memoryview sul buffer,
+    da copiare) prima della separazione in righe: es. la registrazione grezza.
+    """
+
+    def __init__(self, ser, size=16384, framer=None, on_bytes=None):
+        self._ser = ser
+        self._framer = framer if framer is not None else LineFramer(size)
+        self._on_bytes = on_bytes
+        self._timeout = ser.timeout if ser.timeout is not None else 1.0
+        try:
+            self._fd = ser.fileno()
+        except (AttributeError, NotImplementedError, OSError):
+            self._fd = None
+
+    @property
+    def framer(self):
+        return self._framer
+
+    def _fill(self):
+        """Legge un blocco dalla seriale nel buffer; restituisce i byte letti."""
+        space = self._framer.writable()
+        if self._fd is not None:
+            # POSIX: attende dati e li legge direttamente nel buffer, senza copie
+            try:
+                ready, _, _ = select.select([self._fd], [], [], self._timeout)
+                if not ready:
+                    return 0
+                n = os.readv(self._fd, [space])
+            except OSError as e:
+                raise serial.SerialException(f"errore lettura seriale: {e}")
+            if n == 0:
+                raise serial.SerialException("dispositivo disconnesso")
+        else:
+            waiting = self._ser.in_waiting
+            data = self._ser.read(min(waiting, len(space)) if waiting else 1)
+            n = len(data)
+            space[:n] = data
+        self._framer.commit(n)
+        if self._on_bytes is not None and n:
+            self._on_bytes(space[:n])
+        return n
+
+    def read_lines(self, decode=False):
+        """Legge un blocco e restituisce le righe complete ricevute.
+
+        Con decode=True le righe sono str ASCII, altrimenti memoryview.
+        Se entro il timeout non arriva nulla non restituisce righe.
+        """
+        self._fill()
+        if decode:
+            return (line.tobytes().decode('ascii', errors='replace')
+                    for line in self._framer.lines())
+        return self._framer.lines()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Spool su disco dei pacchetti non consegnati durante le interruzioni del
+collegamento (VPN o rete cellulare giù).
+
+I pacchetti vengono accodati in un anello di segmenti a dimensione fissa,
+mappati in memoria con mmap e scritti solo in append. Quando l'anello è
+pieno il segmento più vecchio viene riutilizzato (i suoi pacchetti non
+ancora reinviati vengono persi e contati in dropped), così lo spazio su
+disco resta limitato: con i valori predefiniti (SEGMENTS × SEGMENT_SIZE,
+8 × 256 KiB) ogni spool occupa al massimo 2 MiB su disco e in page cache,
+cioè circa 12 minuti di pacchetti CSV di mainGNSS a 25 Hz o di sentenze
+GGA a 5 Hz per oltre un'ora. Gli script ne aprono uno per destinazione.
+
+append() e consume() copiano soltanto in memoria; l'msync su disco avviene
+ogni SYNC_INTERVAL in un thread dello spool (sync()), così una SD lenta non
+ferma mai chi legge il ricevitore.
+
+Formato:
+    segmento   magic 'SPL1' | numero di sequenza del segmento (U8 LE) | record...
+    record     lunghezza (U2) | CRC32 del payload (U4) | payload
+Dopo l'ultimo record c'è sempre una lunghezza 0: all'avvio ogni segmento
+viene riletto fino al terminatore o al primo record con CRC errato (coda
+scritta a metà), e la posizione di lettura viene ripresa dal file cursor.
+
+Chi reinvia i pacchetti li marca con HISTORICAL_PREFIX, così il server li
+distingue da quelli in tempo reale: va attivato solo verso server che
+riconoscono il prefisso (head_packet.decode, ingest_server.py).
+
+UDP non ha conferme: nello spool finiscono solo i pacchetti che la testa
+sa di non aver consegnato (interfaccia di uscita giù, errore di invio, coda
+piena), non quelli inviati e persi lungo il percorso.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+SEGMENT_MAGIC = b'SPL1'
+SEGMENT_SIZE = 256 * 1024
+SEGMENTS = 8
+
+# Intervallo fra due msync su disco (s), eseguiti dal thread dello spool
+SYNC_INTERVAL = 1.0
+
+# Prefisso dei pacchetti reinviati dallo spool
+HISTORICAL_PREFIX = b'HIST,'
+
+_SEG_HEADER = struct.Struct('<4sQ')
+_REC_HEADER = struct.Struct('<HI')
+_CURSOR = struct.Struct('<QI')
+_TERMINATOR = b'\x00\x00'
+
+
+def mark_historical(data):
+    return HISTORICAL_PREFIX + data
+
+
+class _Segment:
+    __slots__ = ('path', 'map', 'seq', 'end', 'count')
+
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        self.seq = None     # None = segmento mai scritto
+        self.end = 0        # fine dell'ultimo record valido
+        self.count = 0      # record contenuti
+
+
+class Spool:
+    """Anello di segmenti su disco con un solo lettore (thread-safe)."""
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE, segments=SEGMENTS):
+        if segments < 2:
+            raise ValueError("servono almeno 2 segmenti")
+        self.path = path
+        self._size = segment_size
+        self._max_record = segment_size - _SEG_HEADER.size - _REC_HEADER.size - len(_TERMINATOR)
+        self._lock = threading.Lock()
+        # msync fuori da _lock: append() (thread GPS) copia solo in memoria
+        self._sync_lock = threading.Lock()
+        self._dirty = False
+        self._unsynced = []     # segmenti completati non ancora scritti su disco
+        self._stop = threading.Event()
+        self.appended = 0
+        self.consumed = 0
+        self.dropped = 0        # pacchetti sovrascritti prima di essere reinviati
+        self.too_big = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._segments = [_Segment(os.path.join(path, f"seg-{i:02d}.bin"))
+                          for i in range(segments)]
+        self._remove_extra_segments()
+        self._cursor = self._open_map(os.path.join(path, "cursor"), _CURSOR.size)
+        self._recover()
+        self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True)
+        self._sync_thread.start()
+
+    # ───── apertura e recupero ─────
+    def _remove_extra_segments(self):
+        """Elimina i segmenti oltre quelli configurati (anello più grande in passato)."""
+        names = {os.path.basename(seg.path) for seg in self._segments}
+        for name in os.listdir(self.path):
+            if name.startswith("seg-") and name.endswith(".bin") and name not in names:
+                os.remove(os.path.join(self.path, name))
+
+    def _open_map(self, path, size):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            return mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _scan(self, seg):
+        """Trova la fine dei record validi del segmento (recupero della coda)."""
+        m = seg.map
+        pos = _SEG_HEADER.size
+        count = 0
+        while pos + _REC_HEADER.size <= self._size:
+            length, crc = _REC_HEADER.unpack_from(m, pos)
+            start = pos + _REC_HEADER.size
+            if length == 0 or start + length > self._size:
+                break
+            if zlib.crc32(m[start:start + length]) != crc:
+                break
+            pos = start + length
+            count += 1
+        seg.end = pos
+        seg.count = count
+        if pos + len(_TERMINATOR) <= self._size:
+            m[pos:pos + len(_TERMINATOR)] = _TERMINATOR
+
+    def _recover(self):
+        for seg in self._segments:
+            if not os.path.exists(seg.path):
+                continue
+            seg.map = self._open_map(seg.path, self._size)
+            magic, seq = _SEG_HEADER.unpack_from(seg.map, 0)
+            if magic != SEGMENT_MAGIC:
+                continue
+            seg.seq = seq
+            self._scan(seg)
+
+        used = [s for s in self._segments if s.seq is not None]
+        if not used:
+            self._writer = self._start_segment(0, 1)
+            self._set_reader(self._writer, _SEG_HEADER.size)
+            return
+        self._writer = self._segments.index(max(used, key=lambda s: s.seq))
+
+        r_seq, r_off = _CURSOR.unpack_from(self._cursor, 0)
+        reader = next((s for s in used if s.seq == r_seq), None)
+        if reader is None or r_off > reader.end:
+            # Cursore assente o già sovrascritto: si riparte dal segmento più vecchio
+            reader, r_off = min(used, key=lambda s: s.seq), _SEG_HEADER.size
+        self._set_reader(self._segments.index(reader), r_off)
+
+    def _start_segment(self, index, seq):
+        seg = self._segments[index]
+        if seg.map is None:
+            seg.map = self._open_map(seg.path, self._size)
+        seg.seq = seq
+        seg.count = 0
+        seg.end = _SEG_HEADER.size
+        seg.map[seg.end:seg.end + len(_TERMINATOR)] = _TERMINATOR
+        _SEG_HEADER.pack_into(seg.map, 0, SEGMENT_MAGIC, seq)
+        return index
+
+    def _set_reader(self, index, offset):
+        """Posiziona il lettore e ricalcola i record in attesa."""
+        self._reader = index
+        self._r_off = offset
+        self._r_done = self._count_before(index, offset)
+        pending = self._segments[index].count - self._r_done
+        i = index
+        while i != self._writer:
+            i = (i + 1) % len(self._segments)
+            pending += self._segments[i].count
+        self.pending = pending
+        self._save_cursor()
+
+    def _count_before(self, index, offset):
+        m = self._segments[index].map
+        pos = _SEG_HEADER.size
+        n = 0
+        while pos < offset:
+            length, _crc = _REC_HEADER.unpack_from(m, pos)
+            pos += _REC_HEADER.size + length
+            n += 1
+        return n
+
+    def _save_cursor(self):
+        _CURSOR.pack_into(self._cursor, 0, self._segments[self._reader].seq, self._r_off)
+
+    # ───── scrittura ─────
+    def append(self, data):
+        """Aggiunge un pacchetto; False se è troppo grande per un segmento."""
+        n = len(data)
+        if n > self._max_record or n > 0xFFFF:
+            self.too_big += 1
+            return False
+        with self._lock:
+            seg = self._segments[self._writer]
+            need = _REC_HEADER.size + n
+            if seg.end + need + len(_TERMINATOR) > self._size:
+                seg = self._segments[self._next_segment()]
+            m = seg.map
+            pos = seg.end
+            start = pos + _REC_HEADER.size
+            # Prima payload e terminatore, per ultima la lunghezza del record
+            m[start:start + n] = data
+            m[start + n:start + n + len(_TERMINATOR)] = _TERMINATOR
+            _REC_HEADER.pack_into(m, pos, n, zlib.crc32(data))
+            seg.end = start + n
+            seg.count += 1
+            self.pending += 1
+            self.appended += 1
+            self._dirty = True
+        return True
+
+    def _next_segment(self):
+        """Passa al segmento successivo, sovrascrivendo il più vecchio se serve."""
+        old_writer = self._writer
+        index = (old_writer + 1) % len(self._segments)
+        seg = self._segments[index]
+        if index == self._reader and seg.seq is not None:
+            # Anello pieno: si perdono i pacchetti non ancora reinviati
+            lost = seg.count - self._r_done
+            self.dropped += lost
+            self.pending -= lost
+            self._reader = (index + 1) % len(self._segments)
+            self._r_off = _SEG_HEADER.size
+            self._r_done = 0
+        self._unsynced.append(self._segments[old_writer])
+        self._writer = self._start_segment(index, self._segments[old_writer].seq + 1)
+        self._save_cursor()
+        return index
+
+    # ───── lettura ─────
+    def peek(self, max_records):
+        """Restituisce fino a max_records pacchetti in attesa, senza consumarli."""
+        out = []
+        with self._lock:
+            index, pos, done = self._reader, self._r_off, self._r_done
+            while len(out) < max_records:
+                seg = self._segments[index]
+                if done >= seg.count:
+                    if index == self._writer:
+                        break
+                    index = (index + 1) % len(self._segments)
+                    pos, done = _SEG_HEADER.size, 0
+                    continue
+                length, _crc = _REC_HEADER.unpack_from(seg.map, pos)
+                start = pos + _REC_HEADER.size
+                out.append(seg.map[start:start + length])
+                pos = start + length
+                done += 1
+        return out
+
+    def consume(self, n):
+        """Segna come reinviati i primi n pacchetti restituiti da peek()."""
+        with self._lock:
+            while n > 0 and self.pending > 0:
+                seg = self._segments[self._reader]
+                if self._r_done >= seg.count:
+                    if self._reader == self._writer:
+                        break
+                    self._reader = (self._reader + 1) % len(self._segments)
+                    self._r_off, self._r_done = _SEG_HEADER.size, 0
+                    continue
+                length, _crc = _REC_HEADER.unpack_from(seg.map, self._r_off)
+                self._r_off += _REC_HEADER.size + length
+                self._r_done += 1
+                self.pending -= 1
+                self.consumed += 1
+                n -= 1
+            self._save_cursor()
+            self._dirty = True
+
+    # ───── disco ─────
+    def sync(self):
+        """Scrive su disco i segmenti e il cursore modificati.
+
+        L'elenco delle mappe si prende sotto _lock, l'msync (che sulla SD può
+        durare decine di ms) avviene fuori: append() e consume() non lo attendono.
+        """
+        with self._sync_lock:
+            with self._lock:
+                if not self._dirty and not self._unsynced:
+                    return
+                maps = {id(seg.map): seg.map for seg in self._unsynced}
+                writer = self._segments[self._writer].map
+                maps[id(writer)] = writer
+                self._unsynced = []
+                self._dirty = False
+            for m in maps.values():
+                m.flush()
+            self._cursor.flush()
+
+    def _sync_loop(self):
+        while not self._stop.wait(SYNC_INTERVAL):
+            try:
+                self.sync()
+            except (OSError, ValueError) as e:
+                print(f"[SPOOL] sync {self.path}: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._sync_thread.join(timeout=2.0)
+        with self._sync_lock, self._lock:
+            for seg in self._segments:
+                if seg.map is not None:
+                    seg.map.flush()
+                    seg.map.close()
+                    seg.map = None
+            self._cursor.flush()
+            self._cursor.close()
+
+    def stats(self):
+        return (f"spool {self.pending} in attesa, {self.appended} salvati, "
+                f"{self.consumed} reinviati, {self.dropped} persi")
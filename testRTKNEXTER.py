@@ -5,26 +5,50 @@ Invia una singola riga compatta con i dati RTK/GNSS
 su tutte le destinazioni UDP configurate e ne stampa
 una al secondo sul terminale.
 
-Formato pacchetto:
-    MAC/±DD.dddddd7/±DDD.dddddd7/ss/q/vv.v/YYMMDDhhmmss
+Formato pacchetto (CONFIG["packet_format"]):
+    "ascii"   MAC/±DD.dddddd7/±DDD.dddddd7/ss/q/vv.v/YYMMDDhhmmss
+    "binary"  26 byte con sequenza e tempo della settimana in ms (vedi head_packet.py)
+
+Con CONFIG["packet_trace"] ogni pacchetto riporta anche sequenza e ora di
+invio in ms, per misurare perdite e latenza con link_stats.py.
 """
 
+import argparse
 import socket
-import serial
 import threading
 import time
 import base64
 import datetime
-import subprocess
-import re
 
-import pynmea2
+from epoch_assembler import EpochAssembler
+from head_identity import get_wlan0_mac
+from nmea_fast import NmeaParser
+from heading_estimator import HeadingEstimator
+from head_packet import (encode_ascii, encode_binary, decode as decode_packet,
+                         time_of_week_ms, unix_ms_to_tow)
+from rtcm import RtcmFramer
+from serial_mux import SerialMux
+from serial_reader import LineFramer
+from ubx import UbxFramer, SYNC1 as UBX_SYNC1, decode_nav_pvt, nav_pvt_config_messages
+from udp_fanout import UdpFanout
 
 # ────────────────────────── CONFIGURAZIONE ──────────────────────────
 CONFIG = {
     "gps_port":     "/dev/ttyACM0",
     "gps_baud":     115200,
     "destinations": [("193.70.113.55", 3131)],
+    "udp_queue_len": 64,    # pacchetti in coda per destinazione
+    # Spool dei pacchetti non consegnati, reinviati come storici (HIST,):
+    # anello di 2 MiB per destinazione (vedi spool.py). None = niente spool,
+    # finché il server non riconosce i pacchetti storici
+    "spool_dir":    None,
+    "spool_replay_rate": 20,  # pacchetti storici reinviati al secondo
+    "uplink_iface": "wlan0",  # interfaccia controllata per sapere se il link è su
+    "ubx":          False,  # fix da UBX-NAV-PVT (u-blox) invece che da NMEA
+    "packet_format": "ascii",  # "ascii" (compatibile) oppure "binary"
+    "packet_trace": False,  # aggiunge sequenza e ora di invio (ms) al pacchetto
+    "packet_heading": False,  # aggiunge la direzione (heading_estimator.py)
+    "epoch_deadline": 0.1,  # s di attesa massima delle sentenze di un'epoca
 
     # Parametri NTRIP (opzionale):
     "ntrip_host":   "83.217.185.132",
@@ -35,50 +59,21 @@ CONFIG = {
 }
 # --------------------------------------------------------------------
 
-def get_wlan0_mac():
-    """Ottiene il MAC address dell'interfaccia wlan0."""
-    try:
-        # Metodo 1: usando /sys/class/net/wlan0/address
-        with open('/sys/class/net/wlan0/address', 'r') as f:
-            mac = f.read().strip().replace(':', '').upper()
-            return mac
-    except FileNotFoundError:
-        pass
-    
-    try:
-        # Metodo 2: usando il comando ip
-        result = subprocess.run(['ip', 'link', 'show', 'wlan0'], 
-                              capture_output=True, text=True, check=True)
-        match = re.search(r'link/ether ([0-9a-f:]{17})', result.stdout)
-        if match:
-            mac = match.group(1).replace(':', '').upper()
-            return mac
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
-    
-    try:
-        # Metodo 3: usando ifconfig (fallback)
-        result = subprocess.run(['ifconfig', 'wlan0'], 
-                              capture_output=True, text=True, check=True)
-        match = re.search(r'ether ([0-9a-f:]{17})', result.stdout)
-        if match:
-            mac = match.group(1).replace(':', '').upper()
-            return mac
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
-    
-    # Fallback: usa uuid.getnode() se wlan0 non è disponibile
-    import uuid
-    print("[WARNING] wlan0 non trovata, uso MAC generico")
-    return f"{uuid.getnode():012X}"
-
 # MAC address dell'interfaccia wlan0
 MAC_ADDR = get_wlan0_mac()
+MAC_BYTES = bytes.fromhex(MAC_ADDR)
 print(f"[INFO] MAC wlan0: {MAC_ADDR}")
 
 # ───────────── variabili globali condivise fra i thread ─────────────
 running          = True
-udp_socks        = []
+udp_fanout       = None
+gps_mux          = None    # unico proprietario della seriale GPS
+
+# Parser NMEA, ultimo fix e assemblatore delle epoche, usati solo dal
+# thread di lettura di gps_mux (assembler viene creato nel main)
+parser           = NmeaParser()
+fix              = parser.fix
+assembler        = None
 
 # Dati GPS più recenti
 gps_data = {
@@ -88,8 +83,13 @@ gps_data = {
     'longitude': None,
     'satellites': 0,
     'quality': 0,
-    'last_valid_time': None
+    'tow_ms': 0,           # ms dall'inizio della settimana UTC (formato binario)
+    'last_valid_time': None,
+    'speed_age': None,     # età (s) della velocità rispetto alla posizione
+    'heading': None,       # direzione stimata (gradi dal nord), None se non nota
 }
+packet_seq = 0             # sequenza del pacchetto (binario o tracciatura)
+heading_estimator = HeadingEstimator()
 gps_lock = threading.Lock()
 
 last_print_ts = 0.0    # per limitare la stampa a 1 Hz
@@ -97,182 +97,165 @@ last_print_ts = 0.0    # per limitare la stampa a 1 Hz
 
 # ─────────────────────────── FUNZIONI UTILI ─────────────────────────
 def init_udp():
-    """Inizializza i socket UDP indicati in CONFIG."""
-    global udp_socks
-    for s, *_ in udp_socks:
-        s.close()
-    udp_socks.clear()
+    """Inizializza code e socket UDP per le destinazioni indicate in CONFIG."""
+    global udp_fanout
+    if udp_fanout:
+        udp_fanout.close()
+    udp_fanout = UdpFanout(CONFIG["destinations"], maxlen=CONFIG["udp_queue_len"],
+                           spool_dir=CONFIG["spool_dir"],
+                           uplink_iface=CONFIG["uplink_iface"],
+                           replay_rate=CONFIG["spool_replay_rate"])
+    udp_fanout.start()
     for host, port in CONFIG["destinations"]:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        udp_socks.append((sock, host, port))
         print(f"[UDP] destinazione {host}:{port}")
 
 
-def send_udp(msg: str):
-    """Invia msg a tutte le destinazioni UDP configurate."""
-    data = msg.encode()
-    for sock, host, port in udp_socks:
-        try:
-            sock.sendto(data, (host, port))
-        except OSError as e:
-            print(f"[!] UDP error {host}:{port} – {e}")
+def send_udp(data: bytes):
+    """Accoda data per tutte le destinazioni UDP configurate (non blocca)."""
+    udp_fanout.send(data)
 
 
-def update_timestamp_from_msg(msg):
-    """Aggiorna il timestamp dai dati del messaggio NMEA."""
-    current_time = None
+def update_timestamp(date, seconds_of_day):
+    """Aggiorna il timestamp dalla data e dall'ora UTC di un fix."""
+    if seconds_of_day is None or not date:
+        return False
 
-    # Prova con datestamp + timestamp (RMC)
-    if hasattr(msg, 'datestamp') and hasattr(msg, 'timestamp') and msg.datestamp and msg.timestamp:
-        try:
-            current_time = datetime.datetime.combine(msg.datestamp, msg.timestamp)
-        except (AttributeError, ValueError, TypeError):
-            pass
+    year, month, day = date
+    seconds = int(seconds_of_day)
+    hh, rem = divmod(seconds, 3600)
+    mm, ss = divmod(rem, 60)
+    try:
+        current_time = datetime.datetime(year, month, day, hh, mm, ss)
+    except ValueError:
+        return False
+
+    with gps_lock:
+        gps_data['timestamp'] = f"{year % 100:02d}{month:02d}{day:02d}{hh:02d}{mm:02d}{ss:02d}"
+        gps_data['tow_ms'] = time_of_week_ms(year, month, day, seconds_of_day)
+        gps_data['last_valid_time'] = current_time
+    return True
+
+
+def format_packet():
+    """Crea il pacchetto (bytes) dai dati in gps_data (chiamare con gps_lock)."""
+    global packet_seq
+
+    packet_seq = (packet_seq + 1) & 0xFFFF
+    sent_unix_ms = int(time.time() * 1000) if CONFIG["packet_trace"] else None
+
+    if CONFIG["packet_format"] == "binary":
+        return encode_binary(MAC_BYTES,
+                             gps_data['latitude'], gps_data['longitude'],
+                             gps_data['satellites'], gps_data['quality'],
+                             gps_data['speed_kmh'], gps_data['tow_ms'], packet_seq,
+                             None if sent_unix_ms is None else unix_ms_to_tow(sent_unix_ms),
+                             gps_data['heading'] if CONFIG["packet_heading"] else False)
+    return encode_ascii(MAC_ADDR,
+                        gps_data['latitude'], gps_data['longitude'],
+                        gps_data['satellites'], gps_data['quality'],
+                        gps_data['speed_kmh'], gps_data['timestamp'],
+                        None if sent_unix_ms is None else packet_seq, sent_unix_ms,
+                        gps_data['heading'] if CONFIG["packet_heading"] else None)
+
+
+def update_heading(course, speed_kmh):
+    """Aggiorna la direzione stimata con la posizione in gps_data (chiamare con gps_lock)."""
+    estimate = heading_estimator.add(gps_data['tow_ms'] / 1000.0,
+                                     gps_data['latitude'], gps_data['longitude'],
+                                     course, None if speed_kmh is None else speed_kmh / 3.6)
+    gps_data['heading'] = estimate.heading
+
+
+def send_packet(packet):
+    """Invia il pacchetto e ne stampa al massimo uno al secondo."""
+    global last_print_ts
 
-    # Infine prova solo con timestamp (GGA)
-    if not current_time and hasattr(msg, 'timestamp') and msg.timestamp:
-        try:
-            today = datetime.date.today()
-            current_time = datetime.datetime.combine(today, msg.timestamp)
-        except (AttributeError, ValueError, TypeError):
-            pass
-
-    # Se abbiamo un tempo valido, aggiorna
-    if current_time:
-        with gps_lock:
-            gps_data['timestamp'] = current_time.strftime("%y%m%d%H%M%S")
-            gps_data['last_valid_time'] = current_time
-        return True
-
-    return False
-
-    
-    # Se abbiamo un tempo valido, aggiornalo
-    if current_time:
-        with gps_lock:
-            gps_data['timestamp'] = current_time.strftime("%y%m%d%H%M%S")
-            gps_data['last_valid_time'] = current_time
-        return True
-    
-    return False
+    send_udp(packet)
+
+    # ---------- STAMPA max 1 riga al secondo ----------
+    now = time.time()
+    if now - last_print_ts >= 1.0:
+        if CONFIG["packet_format"] == "binary":
+            text = f"[{len(packet)} B] {decode_packet(packet)}"
+        else:
+            text = packet.decode().strip()
+        speed_age = gps_data['speed_age']
+        if speed_age:
+            text += f"  (velocità vecchia di {speed_age:.2f} s)"
+        print(text)
+        last_print_ts = now
+
+
+def handle_nav_pvt(fix):
+    """Aggiorna gps_data da un fix NAV-PVT e invia il pacchetto se valido."""
+    update_timestamp(fix.date, fix.time)
+    with gps_lock:
+        gps_data['satellites'] = fix.satellites
+        gps_data['quality'] = fix.quality
+        gps_data['speed_kmh'] = fix.speed_kmh
+        gps_data['speed_age'] = 0.0
+        if fix.quality <= 0:
+            return
+        gps_data['latitude'] = fix.lat
+        gps_data['longitude'] = fix.lon
+        update_heading(fix.course, fix.speed_kmh)
+        packet = format_packet()
+    send_packet(packet)
 # --------------------------------------------------------------------
 
-# ───────────────────────── THREAD - GPS ─────────────────────────────
-def gps_worker():
-    """Legge la seriale GPS, estrae dati da RMC/GGA/VTG e invia pacchetti."""
-    global last_print_ts
-
-    print(f"[GPS] seriale {CONFIG['gps_port']} @ {CONFIG['gps_baud']}")
-    while running:
-        try:
-            with serial.Serial(CONFIG["gps_port"], CONFIG["gps_baud"], timeout=1) as ser:
-                for raw in ser:
-                    if not running:
-                        break
-                        
-                    try:
-                        line = raw.decode("ascii", errors="replace").strip()
-                    except UnicodeDecodeError:
-                        continue
-                    if not line.startswith('$'):
-                        continue
-
-                    # prova a parsare la sentenza NMEA
-                    try:
-                        msg = pynmea2.parse(line)
-                    except pynmea2.ParseError:
-                        continue
-
-                    # ------------------- VTG -------------------
-                    if isinstance(msg, pynmea2.VTG):
-                        with gps_lock:
-                            # Velocità diretta in km/h dal VTG
-                            try:
-                                if msg.spd_over_grnd_kmph is not None:
-                                    gps_data['speed_kmh'] = float(msg.spd_over_grnd_kmph)
-                                elif msg.spd_over_grnd_kts is not None:
-                                    speed_knots = float(msg.spd_over_grnd_kts)
-                                    gps_data['speed_kmh'] = speed_knots * 1.852
-                                else:
-                                    gps_data['speed_kmh'] = 0.0
-                            except (ValueError, TypeError):
-                                gps_data['speed_kmh'] = 0.0
-
-                    # ------------------- RMC -------------------
-                    elif isinstance(msg, pynmea2.RMC):
-                        with gps_lock:
-                            # Velocità (knots → km/h)
-                            try:
-                                if msg.spd_over_grnd is not None:
-                                    gps_data['speed_kmh'] = float(msg.spd_over_grnd) * 1.852
-                                else:
-                                    gps_data['speed_kmh'] = 0.0
-                            except (ValueError, TypeError):
-                                gps_data['speed_kmh'] = 0.0
-                            
-                            # Posizione da RMC se valida
-                            if msg.status == 'A' and msg.latitude and msg.longitude:  # 'A' = Active/Valid
-                                gps_data['latitude'] = msg.latitude
-                                gps_data['longitude'] = msg.longitude
-                        
-                        # Timestamp da RMC
-                        update_timestamp_from_msg(msg)
-
-                    # ------------------- GGA -------------------
-                    elif isinstance(msg, pynmea2.GGA):
-                        should_send = False
-                        
-                        with gps_lock:
-                            # Aggiorna sempre satelliti e qualità
-                            try:
-                                gps_data['satellites'] = int(msg.num_sats) if msg.num_sats else 0
-                            except (ValueError, TypeError):
-                                gps_data['satellites'] = 0
-                                
-                            try:
-                                gps_data['quality'] = int(msg.gps_qual) if msg.gps_qual else 0
-                            except (ValueError, TypeError):
-                                gps_data['quality'] = 0
-                            
-                            # Posizione da GGA se abbiamo un fix valido
-                            if msg.gps_qual and int(msg.gps_qual) > 0 and msg.latitude and msg.longitude:
-                                gps_data['latitude'] = msg.latitude
-                                gps_data['longitude'] = msg.longitude
-                                should_send = True
-                            
-                            # Crea il pacchetto se abbiamo posizione valida
-                            if should_send and gps_data['latitude'] is not None and gps_data['longitude'] is not None:
-                                compact = (
-                                    f"{MAC_ADDR}/"
-                                    f"{gps_data['latitude']:+09.7f}/"
-                                    f"{gps_data['longitude']:+010.7f}/"
-                                    f"{gps_data['satellites']:02d}/"
-                                    f"{gps_data['quality']}/"
-                                    f"{gps_data['speed_kmh']:.1f}/"
-                                    f"{gps_data['timestamp']}\n"
-                                )
-                        
-                        # Timestamp da GGA se non l'abbiamo già da RMC
-                        update_timestamp_from_msg(msg)
-                        
-                        # Invia solo se abbiamo un fix valido
-                        if should_send:
-                            send_udp(compact)
-
-                            # ---------- STAMPA max 1 riga al secondo ----------
-                            now = time.time()
-                            if now - last_print_ts >= 1.0:
-                                print(compact.strip())
-                                last_print_ts = now
-
-        except serial.SerialException as e:
-            print(f"[GPS] {e}; ritento in 3 s")
-            time.sleep(3)
+# ──────────────────────── LETTURA GPS (seriale) ──────────────────────
+def configure_receiver(mux):
+    """Chiamata ad ogni apertura della seriale: configura NAV-PVT se richiesto."""
+    if CONFIG["ubx"]:
+        mux.write(nav_pvt_config_messages())
+        print("[GPS] ricevitore configurato per UBX-NAV-PVT")
+
+
+def on_gps_line(raw):
+    """Elabora una riga NMEA (o un frame UBX) letta da gps_mux."""
+    # ------------------- UBX NAV-PVT -------------------
+    if CONFIG["ubx"]:
+        # un frame contiene l'intero fix: le righe NMEA si ignorano
+        if raw[0] == UBX_SYNC1 and decode_nav_pvt(raw, fix):
+            handle_nav_pvt(fix)
+        return
+
+    # parser veloce sui byte grezzi (verifica anche il checksum)
+    now = time.monotonic()
+    kind = parser.parse(raw)
+    if kind is None:
+        # anche le altre sentenze fanno scattare la scadenza dell'epoca
+        assembler.poll(now)
+        return
+    assembler.add(kind, fix, now)
+
+
+def on_epoch(epoch):
+    """Invia il pacchetto di un'epoca assemblata (GGA/RMC/VTG con lo stesso orario)."""
+    update_timestamp(epoch.date, epoch.time)
+
+    with gps_lock:
+        gps_data['satellites'] = epoch.satellites
+        gps_data['quality'] = epoch.quality
+        gps_data['speed_kmh'] = epoch.speed_kmh
+        gps_data['speed_age'] = epoch.speed_age
+
+        # Invia solo con un fix valido e una posizione di questa epoca
+        if epoch.quality <= 0 or epoch.lat is None or epoch.position_age != 0:
+            return
+        gps_data['latitude'] = epoch.lat
+        gps_data['longitude'] = epoch.lon
+        # Rotta e velocità del ricevitore solo se di questa stessa epoca
+        fresh = epoch.speed_age == 0
+        update_heading(epoch.course if fresh else None, epoch.speed_kmh if fresh else None)
+        packet = format_packet()
+    send_packet(packet)
 # --------------------------------------------------------------------
 
 # ─────────────────────── THREAD - NTRIP (opz.) ──────────────────────
 def ntrip_worker():
-    """Riceve correzioni RTCM dal caster NTRIP e le inoltra alla seriale GPS."""
+    """Riceve correzioni RTCM dal caster NTRIP e le accoda su gps_mux."""
+    framer = RtcmFramer()
     while running:
         try:
             creds = base64.b64encode(f"{CONFIG['user']}:{CONFIG['password']}".encode()).decode()
@@ -282,17 +265,21 @@ def ntrip_worker():
 
             with socket.create_connection((CONFIG["ntrip_host"], CONFIG["ntrip_port"]), 10) as s:
                 s.sendall(req.encode())
-                if b"ICY 200 OK" not in s.recv(1024):
+                response = s.recv(1024)
+                if b"ICY 200 OK" not in response:
                     print("[NTRIP] risposta non valida")
                     raise ConnectionError
                 print("[NTRIP] connesso")
 
-                with serial.Serial(CONFIG["gps_port"], CONFIG["gps_baud"], timeout=1) as ser:
-                    while running:
-                        data = s.recv(1024)
-                        if not data:
-                            raise ConnectionError("stream chiuso")
-                        ser.write(data)
+                # la seriale resta aperta da gps_mux: qui si accodano solo frame completi
+                framer.reset()
+                data = response.split(b"\r\n\r\n", 1)[-1] if b"\r\n\r\n" in response else b""
+                while running:
+                    for frame in framer.feed(data):
+                        gps_mux.write(frame)
+                    data = s.recv(4096)
+                    if not data:
+                        raise ConnectionError("stream chiuso")
 
         except Exception as e:
             print(f"[NTRIP] {e}; riconnessione in 5 s")
@@ -301,18 +288,45 @@ def ntrip_worker():
 
 # ───────────────────────────── MAIN ────────────────────────────────
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description='Testa RTK: posizione su UDP con correzioni NTRIP')
+    ap.add_argument('--gps-port', help='Porta seriale del ricevitore GPS')
+    ap.add_argument('--ntrip-host', help='Host del caster NTRIP')
+    ap.add_argument('--ntrip-port', type=int, help='Porta del caster NTRIP')
+    ap.add_argument('--spool-dir', help='Cartella dello spool dei pacchetti non consegnati '
+                                        '(es. /home/pi/ippodromoScripts/spool/testRTKNEXTER)')
+    args = ap.parse_args()
+    for key in ("gps_port", "ntrip_host", "ntrip_port", "spool_dir"):
+        if getattr(args, key):
+            CONFIG[key] = getattr(args, key)
+
     init_udp()
+    assembler = EpochAssembler(on_epoch, deadline=CONFIG["epoch_deadline"])
+
+    gps_mux = SerialMux(CONFIG["gps_port"], CONFIG["gps_baud"],
+                        framer_factory=UbxFramer if CONFIG["ubx"] else LineFramer,
+                        on_open=configure_receiver)
+    gps_mux.subscribe(on_gps_line)
+    gps_mux.start()
 
-    t_gps   = threading.Thread(target=gps_worker,   daemon=True)
     t_ntrip = threading.Thread(target=ntrip_worker, daemon=True)
-    t_gps.start()
     t_ntrip.start()
 
     try:
+        last_stats = (time.time(), 0)
         while True:
             time.sleep(1)
+
+            # ---------- contatori seriale ogni 10 s ----------
+            now = time.time()
+            if now - last_stats[0] >= 10:
+                rtcm_rate = (gps_mux.bytes_out - last_stats[1]) / (now - last_stats[0])
+                print(f"[SERIAL] {gps_mux.stats()}, RTCM {rtcm_rate:.0f} B/s")
+                print(f"[UDP] {udp_fanout.stats()}")
+                if not CONFIG["ubx"]:
+                    print(f"[GPS] {assembler.stats()}")
+                last_stats = (now, gps_mux.bytes_out)
     except KeyboardInterrupt:
         running = False
         print("\n[MAIN] interrompo…")
-        for s, *_ in udp_socks:
-            s.close()
+        gps_mux.stop()
+        udp_fanout.close()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Archivio a colonne dei tracciati per l'analisi delle corse.
+
+Un giorno (UTC) di una testa è una directory con un file binario per
+colonna, a larghezza fissa e little-endian, leggibile con numpy.memmap:
+
+    <radice>/<tipo>/<testa>/<AAAAMMGG>/
+        meta.json     colonne, tipi, righe, passo dell'indice
+        t.bin         istante Unix (s, f8), righe in ordine di tempo
+        lat.bin ...   una colonna per file
+        index.bin     indice sparso: t di una riga ogni INDEX_STRIDE
+
+Per estrarre una finestra di tempo si cerca nell'indice (piccolo) il
+blocco di righe che la contiene e poi solo dentro quel blocco della
+colonna t: le colonne vengono lette dal sistema operativo solo per le
+pagine della finestra, senza analizzare il file intero.
+
+Tipi:
+    gnss    dai log di mainGNSS (logGNSS/*.log, anche .log.gz/.log.zst di
+            log_writer.py): t lat lon alt speed (m/s) heading (gradi)
+    accgir  dai CSV di AccGirAcquisizione.py (logAccGir/sensor_log_*.csv):
+            t accel_x accel_y accel_z gyro_x gyro_y gyro_z
+I valori assenti ("N/A") sono NaN. Riconvertire gli stessi log non duplica
+le righe: a parità di istante resta l'ultima importata.
+
+Uso:
+    python3 track_archive.py import-gnss logGNSS/*.log* --archive archivio
+    python3 track_archive.py import-accgir logAccGir/*.csv --head 53550 --archive archivio
+    python3 track_archive.py query --head 53550 --start "2026-10-17 14:30" --end "2026-10-17 14:35"
+
+Da Python:
+    archive = TrackArchive("archivio")
+    fix = archive.query("53550", start, end)        # {colonna: array}
+    gara = archive.query_heads(start, end)          # {testa: {colonna: array}}
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import numpy as np
+
+from log_writer import read_segment
+
+KIND_GNSS = "gnss"
+KIND_ACCGIR = "accgir"
+
+COLUMNS = {
+    KIND_GNSS: (('t', '<f8'), ('lat', '<f8'), ('lon', '<f8'), ('alt', '<f4'),
+                ('speed', '<f4'), ('heading', '<f4')),
+    KIND_ACCGIR: (('t', '<f8'), ('accel_x', '<f4'), ('accel_y', '<f4'), ('accel_z', '<f4'),
+                  ('gyro_x', '<f4'), ('gyro_y', '<f4'), ('gyro_z', '<f4')),
+}
+
+# Righe fra due voci dell'indice sparso (41 s a 25 Hz)
+INDEX_STRIDE = 1024
+
+DAY_FORMAT = "%Y%m%d"
+META_NAME = "meta.json"
+INDEX_NAME = "index.bin"
+
+
+def day_of(t):
+    """Giorno UTC (AAAAMMGG) dell'istante Unix t."""
+    return datetime.fromtimestamp(t, timezone.utc).strftime(DAY_FORMAT)
+
+
+def parse_time(text):
+    """Secondi Unix da un numero o da un orario ISO (senza fuso = ora locale)."""
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+
+
+def _float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan       # "N/A" o campo vuoto
+
+
+# ───────────────────────────── GIORNO ─────────────────────────────
+class DayTable:
+    """Un giorno di una testa: colonne aperte con numpy.memmap in sola lettura."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_NAME)) as f:
+            meta = json.load(f)
+        self.kind = meta["kind"]
+        self.head = meta["head"]
+        self.day = meta["day"]
+        self.rows = meta["rows"]
+        self.stride = meta["index_stride"]
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in meta["columns"]}
+        self.index = np.fromfile(os.path.join(path, INDEX_NAME), dtype='<f8')
+        self._maps = {}
+
+    def column(self, name):
+        """Colonna intera come memmap (nessuna lettura finché non si accede ai dati)."""
+        array = self._maps.get(name)
+        if array is None:
+            if self.rows == 0:
+                array = np.empty(0, dtype=self.dtypes[name])
+            else:
+                array = np.memmap(os.path.join(self.path, name + ".bin"),
+                                  dtype=self.dtypes[name], mode='r', shape=(self.rows,))
+            self._maps[name] = array
+        return array
+
+    def rows_between(self, start, end):
+        """(i0, i1): righe con start <= t < end, cercate prima nell'indice sparso."""
+        t = self.column('t')
+        b0 = max(int(np.searchsorted(self.index, start, 'right')) - 1, 0)
+        b1 = int(np.searchsorted(self.index, end, 'left'))
+        lo = b0 * self.stride
+        hi = min(b1 * self.stride, self.rows)
+        window = t[lo:hi]
+        return (lo + int(np.searchsorted(window, start, 'left')),
+                lo + int(np.searchsorted(window, end, 'left')))
+
+    def slice(self, start, end, columns=None):
+        """{colonna: vista memmap} delle righe nella finestra [start, end)."""
+        i0, i1 = self.rows_between(start, end)
+        return {name: self.column(name)[i0:i1] for name in (columns or self.dtypes)}
+
+    def read(self, columns=None):
+        """Tutte le righe, copiate in memoria."""
+        return {name: np.array(self.column(name)) for name in (columns or self.dtypes)}
+
+
+# ───────────────────────────── ARCHIVIO ─────────────────────────────
+class TrackArchive:
+    """Radice dell'archivio: scrittura dei giorni e interrogazione per tempo e testa."""
+
+    def __init__(self, root):
+        self.root = root
+        self._open = {}
+
+    def _dir(self, kind, head, day=None):
+        parts = [self.root, kind, str(head)]
+        if day is not None:
+            parts.append(day)
+        return os.path.join(*parts)
+
+    def heads(self, kind=KIND_GNSS):
+        try:
+            return sorted(os.listdir(os.path.join(self.root, kind)))
+        except FileNotFoundError:
+            return []
+
+    def days(self, head, kind=KIND_GNSS):
+        try:
+            names = os.listdir(self._dir(kind, head))
+        except FileNotFoundError:
+            return []
+        return sorted(n for n in names if len(n) == 8 and n.isdigit())
+
+    def open_day(self, head, day, kind=KIND_GNSS):
+        """DayTable del giorno, None se non archiviato."""
+        key = (kind, str(head), day)
+        table = self._open.get(key)
+        if table is None:
+            path = self._dir(kind, head, day)
+            if not os.path.exists(os.path.join(path, META_NAME)):
+                return None
+            table = self._open[key] = DayTable(path)
+        return table
+
+    def write_day(self, head, day, data, kind=KIND_GNSS):
+        """Scrive (unendo a quanto già archiviato) le righe di un giorno.
+
+        data è {colonna: array}; le righe vengono ordinate per t e a parità
+        di istante resta l'ultima. Il giorno viene riscritto in una
+        directory temporanea e poi sostituito, così un'interruzione non
+        lascia colonne di lunghezze diverse.
+        """
+        columns = COLUMNS[kind]
+        new = {name: np.asarray(data[name], dtype=dtype) for name, dtype in columns}
+        old = self.open_day(head, day, kind)
+        if old is not None:
+            existing = old.read()
+            new = {name: np.concatenate([existing[name], new[name]]) for name, _ in columns}
+
+        t = new['t']
+        order = np.argsort(t, kind='stable')
+        t = t[order]
+        # Ultima riga per ogni istante (i dati nuovi seguono gli archiviati)
+        keep = np.append(t[1:] != t[:-1], True) & ~np.isnan(t)
+        order = order[keep]
+
+        path = self._dir(kind, head, day)
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, dtype in columns:
+            new[name][order].astype(dtype, copy=False).tofile(os.path.join(tmp, name + ".bin"))
+        t = new['t'][order]
+        t[::INDEX_STRIDE].astype('<f8').tofile(os.path.join(tmp, INDEX_NAME))
+        with open(os.path.join(tmp, META_NAME), 'w') as f:
+            json.dump({"kind": kind, "head": str(head), "day": day, "rows": len(t),
+                       "index_stride": INDEX_STRIDE,
+                       "columns": [[name, dtype] for name, dtype in columns]}, f)
+
+        self._open.pop((kind, str(head), day), None)
+        if old is not None:
+            retired = path + ".old"
+            shutil.rmtree(retired, ignore_errors=True)
+            os.rename(path, retired)
+            os.rename(tmp, path)
+            shutil.rmtree(retired)
+        else:
+            os.rename(tmp, path)
+        return len(t)
+
+    def write(self, head, data, kind=KIND_GNSS):
+        """Divide le righe per giorno UTC e le scrive; restituisce {giorno: righe}."""
+        t = np.asarray(data['t'], dtype='<f8')
+        days = np.floor(t / 86400.0)
+        written = {}
+        for number in np.unique(days[~np.isnan(days)]):
+            mask = days == number
+            day = day_of(number * 86400.0)
+            written[day] = self.write_day(head, day, {k: np.asarray(v)[mask] for k, v in data.items()},
+                                          kind)
+        return written
+
+    def query(self, head, start, end, kind=KIND_GNSS, columns=None):
+        """{colonna: array} di una testa con start <= t < end (secondi Unix).
+
+        Con un solo giorno coinvolto gli array sono viste memmap (nessuna
+        copia); su più giorni vengono concatenati.
+        """
+        names = columns or [name for name, _ in COLUMNS[kind]]
+        first, last = day_of(start), day_of(end)
+        parts = []
+        for day in self.days(head, kind):
+            if first <= day <= last:
+                table = self.open_day(head, day, kind)
+                i0, i1 = table.rows_between(start, end)
+                if i1 > i0:
+                    parts.append({name: table.column(name)[i0:i1] for name in names})
+        if not parts:
+            return {name: np.empty(0, dtype=dict(COLUMNS[kind])[name]) for name in names}
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([p[name] for p in parts]) for name in names}
+
+    def query_heads(self, start, end, kind=KIND_GNSS, heads=None, columns=None):
+        """{testa: {colonna: array}} per tutte le teste (o quelle indicate) con dati nella finestra."""
+        out = {}
+        for head in heads or self.heads(kind):
+            data = self.query(head, start, end, kind, columns)
+            if len(next(iter(data.values()))):
+                out[head] = data
+        return out
+
+
+# ───────────────────────────── CONVERTITORI ─────────────────────────────
+def parse_gnss_log(path):
+    """Righe GPS di un log di mainGNSS → {testa: {colonna: array}}.
+
+    Campi: GPS,testa,lat,lon,orario,alt,velocità,direzione,cpu,ram[,seq,invio].
+    L'orario è quello del fix (UTC, ISO); righe malformate vengono saltate.
+    """
+    if path.endswith('.log'):
+        with open(path, 'rb') as f:
+            raw = f.read()
+    else:
+        raw = read_segment(path)        # .log.gz / .log.zst, anche con la coda troncata
+    heads = {}
+    for line in raw.decode('utf-8', 'replace').splitlines():
+        fields = line.split(',')
+        if len(fields) < 8 or fields[0] != 'GPS':
+            continue
+        try:
+            moment = datetime.fromisoformat(fields[4].replace('Z', '+00:00'))
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            row = (moment.timestamp(), float(fields[2]), float(fields[3]),
+                   _float(fields[5]), _float(fields[6]), _float(fields[7]))
+        except ValueError:
+            continue
+        heads.setdefault(fields[1], []).append(row)
+    return {head: _columns(rows, KIND_GNSS) for head, rows in heads.items()}
+
+
+def parse_accgir_csv(path):
+    """CSV di AccGirAcquisizione.py → {colonna: array} (t è il timestamp float)."""
+    rows = []
+    with open(path, newline='') as f:
+        for record in csv.reader(f):
+            if len(record) < 8 or record[0] == 'timestamp':
+                continue
+            try:
+                rows.append((float(record[0]),) + tuple(_float(v) for v in record[2:8]))
+            except ValueError:
+                continue
+    return _columns(rows, KIND_ACCGIR)
+
+
+def _columns(rows, kind):
+    columns = COLUMNS[kind]
+    if not rows:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in columns}
+    table = np.array(rows, dtype='<f8')
+    return {name: table[:, i].astype(dtype) for i, (name, dtype) in enumerate(columns)}
+
+
+def _gather(parts, kind):
+    """Unisce i blocchi {colonna: array} di più file."""
+    return {name: np.concatenate([p[name] for p in parts]) for name, _ in COLUMNS[kind]}
+
+
+def import_gnss(archive, paths):
+    """Converte i log di mainGNSS; restituisce {testa: righe lette}."""
+    per_head = {}
+    for path in paths:
+        for head, data in parse_gnss_log(path).items():
+            per_head.setdefault(head, []).append(data)
+    counts = {}
+    for head, parts in per_head.items():
+        data = _gather(parts, KIND_GNSS)
+        archive.write(head, data, KIND_GNSS)
+        counts[head] = len(data['t'])
+    return counts
+
+
+def import_accgir(archive, head, paths):
+    """Converte i CSV di AccGirAcquisizione.py di una testa; restituisce le righe lette."""
+    data = _gather([parse_accgir_csv(path) for path in paths], KIND_ACCGIR)
+    archive.write(head, data, KIND_ACCGIR)
+    return len(data['t'])
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Archivio a colonne dei tracciati')
+    ap.add_argument('--archive', default='archivio', help='radice dell\'archivio')
+    sub = ap.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('import-gnss', help='converte i log di mainGNSS (.log, .log.gz, .log.zst)')
+    p.add_argument('paths', nargs='+')
+
+    p = sub.add_parser('import-accgir', help='converte i CSV di AccGirAcquisizione.py')
+    p.add_argument('paths', nargs='+')
+    p.add_argument('--head', required=True, help='testa a cui appartengono i CSV')
+
+    p = sub.add_parser('query', help='stampa le righe di una finestra di tempo')
+    p.add_argument('--kind', choices=list(COLUMNS), default=KIND_GNSS)
+    p.add_argument('--head', action='append', help='testa (ripetibile, default tutte)')
+    p.add_argument('--start', required=True, help='secondi Unix o ISO (senza fuso = ora locale)')
+    p.add_argument('--end', required=True)
+    p.add_argument('--columns', help='colonne separate da virgola')
+
+    sub.add_parser('info', help='teste, giorni e righe archiviate')
+    args = ap.parse_args()
+
+    archive = TrackArchive(args.archive)
+    if args.command == 'import-gnss':
+        for head, rows in sorted(import_gnss(archive, args.paths).items()):
+            print(f"[INFO] testa {head}: {rows} fix importati")
+    elif args.command == 'import-accgir':
+        rows = import_accgir(archive, args.head, args.paths)
+        print(f"[INFO] testa {args.head}: {rows} campioni importati")
+    elif args.command == 'query':
+        columns = args.columns.split(',') if args.columns else [n for n, _ in COLUMNS[args.kind]]
+        if 't' not in columns:
+            columns.insert(0, 't')
+        result = archive.query_heads(parse_time(args.start), parse_time(args.end),
+                                     args.kind, args.head, columns)
+        print(','.join(['head'] + columns))
+        for head, data in result.items():
+            for row in zip(*(data[name].tolist() for name in columns)):
+                print(','.join([head] + [repr(v) for v in row]))
+    else:
+        for kind in COLUMNS:
+            for head in archive.heads(kind):
+                for day in archive.days(head, kind):
+                    print(f"{kind:<7} {head:<8} {day} {archive.open_day(head, day, kind).rows:>9} righe")
+
+
+if __name__ == "__main__":
+    main()
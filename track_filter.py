@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Filtro di tracciamento (Kalman a velocità costante) in un piano locale ENU.
+
+Le posizioni vengono proiettate in metri Est/Nord rispetto a un'origine
+vicina (la prima posizione, spostata se ci si allontana più di
+ORIGIN_RESET_M), così il modello a velocità costante e il rumore hanno
+unità fisiche. Ogni fix usa il proprio dt e, per R, l'accuratezza
+dichiarata dal ricevitore (epx/epy di gpsd).
+
+Con misura di sola posizione e rumori indipendenti per asse, il filtro 4×4
+[e, n, ve, vn] si separa in due filtri 2×2 [posizione, velocità] identici:
+predizione e aggiornamento sono scritti in forma chiusa su float Python,
+senza matrici né allocazioni per fix.
+"""
+
+import math
+
+# Semiasse maggiore ed eccentricità² WGS84
+_WGS84_A = 6378137.0
+_WGS84_E2 = 6.69437999014e-3
+
+# Densità spettrale dell'accelerazione (m²/s³): quanto il cavallo può
+# cambiare velocità fra un fix e l'altro
+ACCEL_NOISE = 4.0
+
+# Deviazione standard di posizione (m) se il ricevitore non la riporta,
+# e minima accettata (un RTK fix dichiara anche pochi mm)
+DEFAULT_SIGMA = 2.5
+MIN_SIGMA = 0.02
+
+# Oltre questo intervallo fra due fix (s) il filtro riparte dalla misura
+MAX_GAP = 2.0
+
+# Distanza dall'origine oltre la quale il piano locale viene ricentrato (m)
+ORIGIN_RESET_M = 5000.0
+
+# Sotto questa velocità (m/s) la direzione non è affidabile: resta l'ultima
+MIN_HEADING_SPEED = 0.5
+
+
+def local_scale(lat):
+    """Metri per grado di latitudine e di longitudine attorno a lat (WGS84)."""
+    sin_lat = math.sin(math.radians(lat))
+    w = 1.0 - _WGS84_E2 * sin_lat * sin_lat
+    n = _WGS84_A / math.sqrt(w)                             # primo verticale
+    m = _WGS84_A * (1.0 - _WGS84_E2) / (w * math.sqrt(w))   # meridiano
+    return math.radians(m), math.radians(n * math.cos(math.radians(lat)))
+
+
+class _Axis:
+    """Filtro 2×2 [posizione, velocità] lungo un asse."""
+
+    __slots__ = ('x', 'v', 'p00', 'p01', 'p11')
+
+    def reset(self, x, var):
+        self.x = x
+        self.v = 0.0
+        self.p00 = var
+        self.p01 = 0.0
+        self.p11 = 100.0    # velocità iniziale ignota (±10 m/s)
+
+    def step(self, z, var, dt, q):
+        # Predizione: x += v·dt, P = F P Fᵀ + Q (accelerazione bianca)
+        dt2 = dt * dt
+        self.x += self.v * dt
+        p11 = self.p11
+        p01 = self.p01 + dt * p11
+        p00 = self.p00 + dt * (self.p01 + p01) + q * dt2 * dt / 3.0
+        p01 += q * dt2 / 2.0
+        p11 += q * dt
+
+        # Aggiornamento con la misura di posizione z (varianza var)
+        s = p00 + var
+        k0 = p00 / s
+        k1 = p01 / s
+        y = z - self.x
+        self.x += k0 * y
+        self.v += k1 * y
+        self.p00 = (1.0 - k0) * p00
+        self.p01 = (1.0 - k0) * p01
+        self.p11 = p11 - k1 * p01
+
+
+class TrackEstimate:
+    """Stato filtrato: posizione, velocità ENU, velocità e direzione."""
+
+    __slots__ = ('lat', 'lon', 've', 'vn', 'speed', 'heading', 'sigma')
+
+    def __repr__(self):
+        return (f"TrackEstimate(lat={self.lat:.8f} lon={self.lon:.8f} "
+                f"speed={self.speed:.2f} m/s heading={self.heading})")
+
+
+class TrackFilter:
+    """Kalman a velocità costante su Est/Nord locali."""
+
+    def __init__(self, accel_noise=ACCEL_NOISE, default_sigma=DEFAULT_SIGMA,
+                 max_gap=MAX_GAP):
+        self.accel_noise = accel_noise
+        self.default_sigma = default_sigma
+        self.max_gap = max_gap
+        self._east = _Axis()
+        self._north = _Axis()
+        self._t = None
+        self._lat0 = self._lon0 = None
+        self.estimate = TrackEstimate()
+        self.estimate.heading = None
+        self.resets = 0
+
+    def _set_origin(self, lat, lon):
+        self._lat0 = lat
+        self._lon0 = lon
+        self._m_per_deg_lat, self._m_per_deg_lon = local_scale(lat)
+
+    def _reset(self, lat, lon, t, var_e, var_n):
+        self._set_origin(lat, lon)
+        self._east.reset(0.0, var_e)
+        self._north.reset(0.0, var_n)
+        self._t = t
+        self.resets += 1
+
+    def update(self, lat, lon, t, sigma_e=None, sigma_n=None):
+        """Aggiunge un fix (gradi, istante in s, deviazioni standard in m).
+
+        Restituisce la stima aggiornata (lo stesso oggetto ad ogni chiamata).
+        Un fix con lo stesso istante del precedente non viene riapplicato.
+        """
+        sigma_e = max(sigma_e or self.default_sigma, MIN_SIGMA)
+        sigma_n = max(sigma_n or self.default_sigma, MIN_SIGMA)
+        var_e = sigma_e * sigma_e
+        var_n = sigma_n * sigma_n
+
+        if self._t is None:
+            self._reset(lat, lon, t, var_e, var_n)
+        elif t != self._t:
+            dt = t - self._t
+            e = (lon - self._lon0) * self._m_per_deg_lon
+            n = (lat - self._lat0) * self._m_per_deg_lat
+            if dt < 0 or dt > self.max_gap:
+                # Buco nei dati o orario all'indietro: si riparte dalla misura
+                self._reset(lat, lon, t, var_e, var_n)
+            else:
+                q = self.accel_noise
+                self._east.step(e, var_e, dt, q)
+                self._north.step(n, var_n, dt, q)
+                self._t = t
+                if abs(self._east.x) > ORIGIN_RESET_M or abs(self._north.x) > ORIGIN_RESET_M:
+                    self._recenter()
+        return self._output()
+
+    def _recenter(self):
+        """Sposta l'origine sulla posizione stimata (stato e covarianze invariati)."""
+        lat, lon = self._to_geodetic()
+        self._set_origin(lat, lon)
+        self._east.x = 0.0
+        self._north.x = 0.0
+
+    def _to_geodetic(self):
+        return (self._lat0 + self._north.x / self._m_per_deg_lat,
+                self._lon0 + self._east.x / self._m_per_deg_lon)
+
+    def _output(self):
+        est = self.estimate
+        est.lat, est.lon = self._to_geodetic()
+        est.ve = self._east.v
+        est.vn = self._north.v
+        est.speed = math.hypot(est.ve, est.vn)
+        if est.speed >= MIN_HEADING_SPEED:
+            est.heading = math.degrees(math.atan2(est.ve, est.vn)) % 360.0
+        est.sigma = math.sqrt(self._east.p00 + self._north.p00)
+        return est
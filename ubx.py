@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Protocollo binario UBX dei ricevitori u-blox (solo ciò che serve: NAV-PVT).
+
+Un frame UBX-NAV-PVT (100 byte) contiene in un colpo solo posizione,
+velocità, rotta, tipo di fix, numero di satelliti e accuratezza, senza
+dover assemblare più sentenze NMEA di testo.
+
+Formato frame:
+    0xB5 0x62 | classe | id | lunghezza (U2 LE) | payload | CK_A CK_B
+"""
+
+import struct
+
+from serial_reader import LineFramer
+
+SYNC1 = 0xB5
+SYNC2 = 0x62
+HEADER_LEN = 6
+CHECKSUM_LEN = 2
+MAX_PAYLOAD = 1024
+
+CLS_NAV = 0x01
+ID_NAV_PVT = 0x07
+NAV_PVT_LEN = 92
+
+CLS_CFG = 0x06
+ID_CFG_MSG = 0x01
+ID_CFG_VALSET = 0x8A
+
+# Chiavi di configurazione (generazione 9, es. ZED-F9P): uscita NAV-PVT per porta
+CFG_MSGOUT_UBX_NAV_PVT_UART1 = 0x20910007
+CFG_MSGOUT_UBX_NAV_PVT_USB = 0x20910009
+
+# iTOW, data/ora, validità, tAcc, nano, fixType, flags, flags2, numSV,
+# lon, lat, height, hMSL, hAcc, vAcc, velN, velE, velD, gSpeed, headMot,
+# sAcc, headAcc, pDOP
+_NAV_PVT = struct.Struct('<IHBBBBBBIiBBBBiiiiIIiiiiiIIH')
+
+_DOLLAR = 0x24
+_LF = 0x0A
+_CR = 0x0D
+
+
+def checksum(data, start=0, end=None):
+    """Checksum di Fletcher a 8 bit usato da UBX (su classe, id, lunghezza e payload)."""
+    if end is None:
+        end = len(data)
+    ck_a = ck_b = 0
+    for i in range(start, end):
+        ck_a = (ck_a + data[i]) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return ck_a, ck_b
+
+
+def build_message(cls, msg_id, payload=b''):
+    """Costruisce un frame UBX completo."""
+    body = bytes([cls, msg_id]) + struct.pack('<H', len(payload)) + payload
+    ck_a, ck_b = checksum(body)
+    return bytes([SYNC1, SYNC2]) + body + bytes([ck_a, ck_b])
+
+
+def nav_pvt_config_messages(rate=1):
+    """Messaggi che abilitano NAV-PVT ad ogni soluzione di navigazione.
+
+    Vengono inviati sia CFG-MSG (u-blox 8 e precedenti, porta corrente)
+    sia CFG-VALSET in RAM (generazione 9): ogni ricevitore ignora quello
+    che non conosce.
+    """
+    legacy = build_message(CLS_CFG, ID_CFG_MSG, bytes([CLS_NAV, ID_NAV_PVT, rate]))
+    valset = build_message(
+        CLS_CFG, ID_CFG_VALSET,
+        bytes([0x00, 0x01, 0x00, 0x00])  # versione 0, layer RAM
+        + struct.pack('<IB', CFG_MSGOUT_UBX_NAV_PVT_USB, rate)
+        + struct.pack('<IB', CFG_MSGOUT_UBX_NAV_PVT_UART1, rate)
+    )
+    return legacy + valset
+
+
+def decode_nav_pvt(frame, fix):
+    """Decodifica un frame NAV-PVT nel record Fix; False se non è NAV-PVT."""
+    if (frame[2] != CLS_NAV or frame[3] != ID_NAV_PVT
+            or len(frame) < HEADER_LEN + NAV_PVT_LEN + CHECKSUM_LEN):
+        return False
+
+    (_itow, year, month, day, hour, minute, sec, _valid, _tacc, nano,
+     fix_type, flags, _flags2, num_sv, lon, lat, _height, h_msl, h_acc, _v_acc,
+     _vel_n, _vel_e, _vel_d, g_speed, head_mot, _s_acc, _head_acc,
+     p_dop) = _NAV_PVT.unpack_from(frame, HEADER_LEN)
+
+    fix_ok = flags & 0x01
+    carr_soln = (flags >> 6) & 0x03
+
+    # Qualità nella stessa scala del campo GGA
+    if not fix_ok or fix_type == 0:
+        quality = 0
+    elif carr_soln == 2:
+        quality = 4         # RTK fix
+    elif carr_soln == 1:
+        quality = 5         # RTK float
+    elif fix_type == 1:
+        quality = 6         # solo dead reckoning
+    elif flags & 0x02:
+        quality = 2         # DGPS
+    else:
+        quality = 1
+
+    fix.time = hour * 3600 + minute * 60 + sec + nano * 1e-9
+    fix.date = (year, month, day)
+    fix.lat = lat * 1e-7
+    fix.lon = lon * 1e-7
+    fix.alt = h_msl / 1000.0
+    fix.quality = quality
+    fix.satellites = num_sv
+    fix.hdop = p_dop * 0.01     # NAV-PVT fornisce il PDOP
+    fix.valid = bool(fix_ok)
+    fix.speed_kmh = g_speed * 0.0036
+    fix.course = head_mot * 1e-5
+    fix.h_acc = h_acc / 1000.0
+    return True
+
+
+class UbxFramer(LineFramer):
+    """Separa uno stream misto UBX + NMEA in frame UBX completi e righe NMEA.
+
+    lines() restituisce memoryview: un frame UBX inizia con 0xB5, una
+    sentenza NMEA con '$' (senza CR/LF). I frame UBX con checksum errato
+    vengono scartati e contati in bad_checksum.
+    """
+
+    def __init__(self, size=16384):
+        super().__init__(size)
+        self.bad_checksum = 0
+
+    def lines(self):
+        buf = self._buf
+        view = self._view
+        end = self._end
+        pos = self._start
+        while pos < end:
+            b = buf[pos]
+            if b == SYNC1:
+                if end - pos < HEADER_LEN:
+                    break
+                length = buf[pos + 4] | (buf[pos + 5] << 8)
+                if buf[pos + 1] != SYNC2 or length > MAX_PAYLOAD:
+                    pos += 1
+                    continue
+                total = HEADER_LEN + length + CHECKSUM_LEN
+                if end - pos < total:
+                    break
+                ck_pos = pos + HEADER_LEN + length
+                if checksum(buf, pos + 2, ck_pos) != (buf[ck_pos], buf[ck_pos + 1]):
+                    self.bad_checksum += 1
+                    pos += 1
+                    continue
+                start = pos
+                pos += total
+                self._start = pos
+                self.lines_out += 1
+                yield view[start:pos]
+            elif b == _DOLLAR:
+                nl = buf.find(_LF, pos, end)
+                if nl < 0:
+                    break
+                stop = nl - 1 if buf[nl - 1] == _CR else nl
+                start = pos
+                pos = nl + 1
+                self._start = pos
+                self.lines_out += 1
+                yield view[start:stop]
+            else:
+                # Byte fuori frame: salta al prossimo inizio possibile
+                nxt_ubx = buf.find(SYNC1, pos + 1, end)
+                nxt_nmea = buf.find(_DOLLAR, pos + 1, end)
+                candidates = [n for n in (nxt_ubx, nxt_nmea) if n >= 0]
+                pos = min(candidates) if candidates else end
+        self._start = pos
+
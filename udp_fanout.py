@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Strumenti per l'invio UDP delle sentenze NMEA verso le destinazioni.
+
+EpochBundler raggruppa tutte le sentenze della stessa epoca di navigazione
+in un unico datagramma (dimensionato sull'MTU della VPN) invece di inviarne
+uno per sentenza. Il confine di epoca si riconosce dal cambio di orario
+UTC nelle sentenze che lo riportano (GGA, RMC, ...) oppure da una sentenza
+terminatrice configurabile (es. GLL, l'ultima emessa dai u-blox).
+
+Il datagramma contiene le sentenze terminate da CRLF, come sulla seriale:
+chi lo riceve lo separa con split_bundle() (o un semplice splitlines()).
+
+UdpFanout tiene una coda limitata e un socket non bloccante per ogni
+destinazione, così una destinazione irraggiungibile non rallenta la
+lettura della seriale. Ogni destinazione può accettare solo alcuni tipi di
+sentenza, ciascuno con una frequenza massima (vedi parse_destination).
+
+Con spool_dir i datagrammi che non si riescono a consegnare (errore di
+invio, coda piena, interfaccia di uscita giù) vengono salvati su disco
+(spool.py) e reinviati, marcati come storici, quando il collegamento
+torna: a frequenza limitata e solo con la coda dei dati in tempo reale
+vuota, così il tempo reale ha sempre la precedenza.
+"""
+
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+from spool import Spool, mark_historical
+
+# Header IPv4 (20 byte) + UDP (8 byte)
+UDP_IP_OVERHEAD = 28
+
+# Sentenze con l'orario UTC nel primo campo
+TIME_TAGGED = (b'GGA', b'RMC', b'GNS', b'ZDA', b'GST', b'GBS')
+
+# Attesa prima di ricreare il socket di una destinazione in errore (s)
+RECONNECT_DELAY = 1.0
+
+# Tolleranza sul limite di frequenza, per non perdere epoche a causa del jitter
+RATE_TOLERANCE = 0.9
+
+# Datagrammi storici reinviati al secondo per destinazione
+REPLAY_RATE = 20.0
+
+# Stati di /sys/class/net/<if>/operstate per cui il collegamento è giù
+_LINK_DOWN_STATES = ('down', 'dormant', 'lowerlayerdown', 'notpresent')
+
+
+class LinkMonitor:
+    """Stato dell'interfaccia di uscita (es. wlan0), letto da /sys/class/net.
+
+    UDP non segnala la perdita dei datagrammi: se l'interfaccia sotto la VPN
+    è giù, sendto riesce ma i dati vanno persi. Lo stato viene riletto al
+    massimo ogni interval secondi; se il file non esiste il link è considerato su.
+    """
+
+    def __init__(self, iface, interval=0.5):
+        self.iface = iface
+        self._path = f"/sys/class/net/{iface}/operstate"
+        self._interval = interval
+        self._checked = -interval
+        self._up = True
+
+    def up(self, now):
+        if now - self._checked >= self._interval:
+            self._checked = now
+            try:
+                with open(self._path) as f:
+                    self._up = f.read().strip() not in _LINK_DOWN_STATES
+            except OSError:
+                self._up = True
+        return self._up
+
+
+class EpochBundler:
+    """Riconosce i confini di epoca e fa inviare un datagramma per epoca.
+
+    Le sentenze vengono smistate subito da UdpFanout nei buffer delle
+    destinazioni interessate; a fine epoca ogni buffer diventa un datagramma.
+    """
+
+    def __init__(self, fanout, mtu=1420, terminator=None, max_age=1.0):
+        self._fanout = fanout
+        self._limit = mtu - UDP_IP_OVERHEAD
+        self._terminator = terminator.encode() if terminator else None
+        self._max_age = max_age
+        self._pending = False
+        self._epoch = None
+        self._started = 0.0
+        self.epochs = 0
+        self.sentences = 0
+
+    def add(self, line, now):
+        """Aggiunge una sentenza (bytes o memoryview senza CRLF) all'epoca corrente."""
+        if self._pending and now - self._started > self._max_age:
+            self.flush()
+
+        kind = line[3:6]
+        if self._terminator is None and kind in TIME_TAGGED:
+            tag = bytes(line[7:17])
+            comma = tag.find(b',')
+            if comma >= 0:
+                tag = tag[:comma]
+            if tag != self._epoch:
+                # Nuova epoca: la precedente è completa
+                self.flush()
+                self._epoch = tag
+
+        if not self._pending:
+            self._started = now
+            self._pending = True
+        self._fanout.route(line, now, self._limit)
+        self.sentences += 1
+
+        if self._terminator is not None and kind == self._terminator:
+            self.flush()
+
+    def poll(self, now):
+        """Invia l'epoca corrente se è più vecchia di max_age (stream fermo)."""
+        if self._pending and now - self._started > self._max_age:
+            self.flush()
+
+    def flush(self):
+        """Invia le sentenze accumulate, se presenti."""
+        if not self._pending:
+            return
+        self._pending = False
+        self.epochs += 1
+        self._fanout.flush_bundles()
+
+
+def split_bundle(datagram):
+    """Separa un datagramma (singola sentenza o epoca raggruppata) in sentenze."""
+    return [line for line in datagram.splitlines() if line]
+
+
+class DestinationSender:
+    """Coda limitata e socket UDP non bloccante verso una singola destinazione.
+
+    Se la coda è piena viene scartato il datagramma più vecchio: per la
+    posizione in tempo reale conta l'ultimo dato, non quelli arretrati.
+    Con uno spool il datagramma scartato viene salvato per il reinvio.
+    """
+
+    def __init__(self, host, port, maxlen=64, sentence_filter=None,
+                 spool=None, link=None, replay_rate=REPLAY_RATE):
+        self.host = host
+        self.port = port
+        self.addr = (host, port)
+        self.queue = deque()
+        self.maxlen = maxlen
+        # None = tutte le sentenze, altrimenti {tipo: intervallo minimo (s) o 0}
+        self.filter = sentence_filter
+        self.last_sent = {}
+        self.bundle = bytearray()
+        self.sock = None
+        self.sent = 0
+        self.dropped = 0
+        self.limited = 0
+        self.errors = 0
+        self.last_error = None
+        self._retry_at = 0.0
+        self.spool = spool
+        self.link = link
+        self.replay_rate = replay_rate
+        self._tokens = 0.0
+        self._last_replay = 0.0
+        self.open()
+
+    def open(self):
+        """(Ri)crea il socket non bloccante."""
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self.sock = sock
+        except OSError as e:
+            self.errors += 1
+            self.last_error = e
+
+    def enqueue(self, data):
+        if len(self.queue) >= self.maxlen:
+            try:
+                oldest = self.queue.popleft()
+            except IndexError:
+                # Svuotata nel frattempo da drain()
+                pass
+            else:
+                self._lost(oldest)
+        self.queue.append(data)
+
+    def _lost(self, data):
+        """Datagramma non consegnato: nello spool se presente, altrimenti perso."""
+        if self.spool is None or not self.spool.append(data):
+            self.dropped += 1
+
+    def add_to_bundle(self, line, limit):
+        """Aggiunge una sentenza al datagramma dell'epoca, chiudendolo se supera limit."""
+        if self.bundle and len(self.bundle) + len(line) + 2 > limit:
+            self.flush_bundle()
+        # La riga viene copiata: può essere una vista sul buffer della seriale
+        self.bundle += line
+        self.bundle += b'\r\n'
+
+    def flush_bundle(self):
+        if self.bundle:
+            self.enqueue(bytes(self.bundle))
+            self.bundle.clear()
+
+    def drain(self, now):
+        """Invia quanto possibile senza bloccare; True se restano dati in coda.
+
+        La coda è condivisa con enqueue() (thread GPS), che quando è piena ne
+        toglie la testa: ogni datagramma viene quindi prima estratto e poi
+        inviato, e rimesso in testa solo se il socket non lo accetta, così
+        nessuno dei due thread tocca un datagramma già preso dall'altro.
+        """
+        queue = self.queue
+        if self.spool is not None and self.link is not None and not self.link.up(now):
+            # Interfaccia giù: inutile inviare, tutto nello spool
+            while True:
+                try:
+                    data = queue.popleft()
+                except IndexError:
+                    break
+                self._lost(data)
+            return False
+
+        if self.sock is None:
+            if now < self._retry_at:
+                return False
+            self.open()
+            if self.sock is None:
+                self._retry_at = now + RECONNECT_DELAY
+                return False
+
+        while True:
+            try:
+                data = queue.popleft()
+            except IndexError:
+                break
+            try:
+                self.sock.sendto(data, self.addr)
+            except BlockingIOError:
+                # Buffer del socket pieno: torna in testa, si riprova quando
+                # il socket è di nuovo scrivibile
+                queue.appendleft(data)
+                return True
+            except OSError as e:
+                # Destinazione irraggiungibile (ICMP, VPN giù...): il datagramma
+                # va nello spool (o si scarta) e si ricrea il socket più tardi
+                self._lost(data)
+                self._send_error(e, now)
+                return False
+            self.sent += 1
+
+        if self.spool is not None and self.spool.pending:
+            return self._replay(now)
+        return False
+
+    def _send_error(self, e, now):
+        self.errors += 1
+        self.last_error = e
+        self.sock.close()
+        self.sock = None
+        self._retry_at = now + RECONNECT_DELAY
+
+    def _replay(self, now):
+        """Reinvia dallo spool i datagrammi consentiti dal limite di frequenza."""
+        rate = self.replay_rate
+        self._tokens = min(rate, self._tokens + (now - self._last_replay) * rate)
+        self._last_replay = now
+        batch = self.spool.peek(int(self._tokens))
+        sent = 0
+        for data in batch:
+            try:
+                self.sock.sendto(mark_historical(data), self.addr)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                self._send_error(e, now)
+                break
+            sent += 1
+        self.spool.consume(sent)
+        self._tokens -= sent
+        return sent < len(batch) and self.sock is not None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.spool is not None:
+            # Quanto resta in coda verrà reinviato al prossimo avvio
+            while self.queue:
+                self._lost(self.queue.popleft())
+            self.spool.close()
+
+    def stats(self):
+        text = f"{self.host}:{self.port} inviati {self.sent} persi {self.dropped} errori {self.errors}"
+        if self.filter is not None:
+            text += f" limitati {self.limited}"
+        if self.spool is not None:
+            text += f" {self.spool.stats()}"
+        return text
+
+
+class UdpFanout:
+    """Invio UDP verso più destinazioni senza mai bloccare chi produce i dati.
+
+    send() accoda soltanto; l'invio vero avviene nel thread creato da start()
+    oppure, nel runtime asyncio, chiamando drain() dal loop.
+    """
+
+    def __init__(self, destinations, maxlen=64, spool_dir=None, uplink_iface=None,
+                 replay_rate=REPLAY_RATE):
+        link = LinkMonitor(uplink_iface) if uplink_iface else None
+        self.senders = []
+        for dest in destinations:
+            host, port = dest[0], dest[1]
+            sentence_filter = dest[2] if len(dest) > 2 else None
+            spool = None
+            if spool_dir:
+                # Uno spool per destinazione: ognuna torna raggiungibile per conto suo
+                try:
+                    spool = Spool(os.path.join(spool_dir, f"{host}_{port}"))
+                except OSError as e:
+                    print(f"[UDP] spool non disponibile per {host}:{port}: {e}")
+            self.senders.append(DestinationSender(host, port, maxlen, sentence_filter,
+                                                  spool, link, replay_rate))
+
+        # Tabella di smistamento calcolata una volta: tipo → destinazioni interessate.
+        # I tipi non elencati vanno solo alle destinazioni senza filtro.
+        self._catch_all = [s for s in self.senders if s.filter is None]
+        self._routes = {}
+        for sender in self.senders:
+            for kind in sender.filter or ():
+                self._routes.setdefault(kind, list(self._catch_all)).append(sender)
+
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+
+    def send(self, data):
+        """Accoda data (bytes-like, viene copiato) per tutte le destinazioni."""
+        data = bytes(data)
+        for sender in self.senders:
+            sender.enqueue(data)
+        self._wakeup.set()
+
+    def route(self, line, now, bundle_limit=None):
+        """Smista una sentenza NMEA alle destinazioni che la accettano.
+
+        Il tipo viene letto e cercato una sola volta per sentenza; per ogni
+        destinazione resta solo il controllo della frequenza massima.
+        Con bundle_limit la sentenza va nel datagramma d'epoca della
+        destinazione (vedi EpochBundler), altrimenti viene accodata subito.
+        """
+        kind = bytes(line[3:6])
+        targets = self._routes.get(kind, self._catch_all)
+        data = None
+        for sender in targets:
+            if sender.filter is not None:
+                interval = sender.filter[kind]
+                if interval:
+                    last = sender.last_sent.get(kind)
+                    if last is not None and now - last < interval * RATE_TOLERANCE:
+                        sender.limited += 1
+                        continue
+                    sender.last_sent[kind] = now
+            if bundle_limit:
+                sender.add_to_bundle(line, bundle_limit)
+            else:
+                if data is None:
+                    data = bytes(line)
+                sender.enqueue(data)
+        if data is not None:
+            self._wakeup.set()
+
+    def flush_bundles(self):
+        """Chiude i datagrammi d'epoca di tutte le destinazioni."""
+        for sender in self.senders:
+            sender.flush_bundle()
+        self._wakeup.set()
+
+    def drain(self):
+        """Tenta l'invio delle code; restituisce i mittenti con dati in sospeso."""
+        now = time.monotonic()
+        return [s for s in self.senders if s.drain(now)]
+
+    def start(self):
+        """Avvia il thread di invio."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(RECONNECT_DELAY)
+            self._wakeup.clear()
+            pending = self.drain()
+            while pending and self._running:
+                # Attende che almeno un socket torni scrivibile
+                socks = [s.sock for s in pending if s.sock is not None]
+                if socks:
+                    select.select([], socks, [], 0.1)
+                pending = self.drain()
+
+    def close(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        for sender in self.senders:
+            sender.close()
+
+    def stats(self):
+        return " | ".join(s.stats() for s in self.senders)
+
+
+def parse_destination(spec):
+    """Interpreta una destinazione nel formato host:porta[:TIPI].
+
+    TIPI è un elenco di sentenze separate da virgola, ognuna con frequenza
+    massima opzionale in Hz: "GGA@5,RMC@1". Se solo l'ultima ha la frequenza,
+    questa vale per tutte: "GGA,RMC@5". Senza TIPI (o con "*") la destinazione
+    riceve tutte le sentenze. Restituisce (host, porta) o (host, porta, filtro).
+    """
+    parts = spec.split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError(f"destinazione non valida: {spec}")
+    host, port = parts[0], int(parts[1])
+    if len(parts) == 2 or parts[2] in ('', '*'):
+        return (host, port)
+
+    items = []
+    for item in parts[2].split(','):
+        kind, _, rate = item.strip().upper().partition('@')
+        if len(kind) != 3 or not kind.isalpha():
+            raise ValueError(f"tipo di sentenza non valido: {item}")
+        items.append((kind, float(rate) if rate else None))
+
+    shared_rate = items[-1][1]
+    sentence_filter = {}
+    for kind, rate in items:
+        if rate is None:
+            rate = shared_rate
+        if rate is not None and rate <= 0:
+            raise ValueError(f"frequenza non valida per {kind}: {rate}")
+        sentence_filter[kind.encode()] = 1.0 / rate if rate else 0
+    return (host, port, sentence_filter)
+
+
+def format_destination(dest):
+    """Descrizione leggibile di una destinazione (inverso di parse_destination)."""
+    text = f"{dest[0]}:{dest[1]}"
+    if len(dest) > 2 and dest[2] is not None:
+        kinds = []
+        for kind, interval in dest[2].items():
+            kinds.append(f"{kind.decode()}@{1.0 / interval:g}Hz" if interval else kind.decode())
+        text += " [" + ",".join(kinds) + "]"
+    return text